@@ -0,0 +1,93 @@
+"""
+Benchmark for the search chunker on MB-scale documents.
+
+Builds prose with paragraphs, a long single-line log dump and a PDF-like
+text with no paragraph breaks, then reports chunking throughput and checks
+that every chunk is within the token bound and that consecutive chunks
+cover the text without gaps.
+
+    python benchmarks/bench_chunker.py [--mb 1 4 16] [--max-tokens 512] [--overlap 64]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "function-app-flatten", "FlattenCosmosData"))
+from chunker import build_chunks, chunk_text, count_tokens  # noqa: E402
+
+WORDS = ("the deployment of service failed after node pool upgrade cluster rollback latency timeout "
+         "configuration Kubernetes ingress certificate renewal database migration incident owner").split()
+
+
+def prose(size, rng):
+    parts = []
+    total = 0
+    while total < size:
+        sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 24))).capitalize() + "."
+                     for _ in range(rng.randint(2, 8))]
+        paragraph = " ".join(sentences) + "\n\n"
+        parts.append(paragraph)
+        total += len(paragraph)
+    return "".join(parts)
+
+
+def log_dump(size, rng):
+    # One huge line: no paragraph, line or sentence breaks to cut at
+    parts = []
+    total = 0
+    while total < size:
+        part = f"ts={rng.randint(10**9, 10**10)} level=ERROR msg={rng.choice(WORDS)}_{rng.getrandbits(64):x} "
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+def pdf_text(size, rng):
+    # Extracted PDF text: short lines, sentences running across them
+    return prose(size, rng).replace("\n\n", " ").replace(". ", ".\n")
+
+
+def check(text, chunks, max_tokens):
+    assert chunks, "no chunks"
+    assert max(count_tokens(chunk) for chunk in chunks) <= max_tokens, "chunk over the token bound"
+    # Each chunk must start inside (or right after) the previous one, so nothing is skipped
+    position = 0
+    for chunk in chunks:
+        found = text.find(chunk, max(0, position - len(chunk)))
+        assert found != -1 and found <= position + 64, "gap between chunks"
+        position = found + len(chunk)
+    assert position >= len(text.rstrip()) - 1, "text tail not covered"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--overlap", type=int, default=64)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    for mb in args.mb:
+        size = int(mb * 1024 * 1024)
+        for name, build in (("prose", prose), ("log dump", log_dump), ("pdf text", pdf_text)):
+            text = build(size, rng)
+            started = time.perf_counter()
+            chunks = chunk_text(text, args.max_tokens, args.overlap)
+            elapsed = time.perf_counter() - started
+            check(text, chunks, args.max_tokens)
+            print(f"{name:9} {len(text) / 2**20:6.1f} MiB -> {len(chunks):6} chunks in {elapsed * 1000:8.1f} ms "
+                  f"({len(text) / 2**20 / elapsed:5.1f} MiB/s)")
+
+    doc = {"id": "10001", "title": "Runbook", "content": prose(4 * 2**20, rng), "pdf_text": pdf_text(2**20, rng)}
+    started = time.perf_counter()
+    chunks = build_chunks(doc, max_tokens=args.max_tokens, overlap=args.overlap)
+    elapsed = time.perf_counter() - started
+    assert len({chunk["id"] for chunk in chunks}) == len(chunks), "duplicate chunk ids"
+    print(f"build_chunks: 5 MiB document -> {len(chunks)} chunk documents in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cold-start benchmark for the fetch_data function.
+
+Each sample runs in a fresh interpreter, like a Function cold start in
+Azure (WEBSITE_INSTANCE_ID is set, so no .env file is read): it
+imports fetch_data (timing the import) and then pulls the first Jira issue
+from a local fake (timing import-to-first-request). Pass --compare with a
+git revision to run the same measurement against fetch_data as it was at
+that revision, e.g. before clients were created lazily.
+
+    python benchmarks/bench_cold_start.py [--samples 7] [--compare HEAD~1]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from fakes import FETCH_DATA_DIR, REPO_ROOT, FakeCosmosAccount, FakeJira, import_fetch_data
+
+HEAVY_MODULES = ("azure.ai.vision.imageanalysis", "azure.ai.documentintelligence", "dotenv")
+
+
+def child(path, jira_url, cosmos_url):
+    started = time.perf_counter()
+    fetch_data = import_fetch_data(path, JIRA_API_URL=jira_url, COSMOSDB_URL=cosmos_url,
+                                   WEBSITE_INSTANCE_ID="bench")
+    imported = time.perf_counter()
+    next(iter(fetch_data.fetch_jira_tickets()))
+    first = time.perf_counter()
+    result = {"import": imported - started, "first_request": first - started,
+              "heavy": [name for name in HEAVY_MODULES if name in sys.modules]}
+    print("RESULT " + json.dumps(result), flush=True)
+    os._exit(0)
+
+
+def export_revision(revision, target):
+    relative = os.path.relpath(FETCH_DATA_DIR, REPO_ROOT)
+    archive = os.path.join(target, "fetch_data.tar")
+    with open(archive, "wb") as f:
+        subprocess.run(["git", "archive", revision, relative], cwd=REPO_ROOT, stdout=f, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(target)
+    return os.path.join(target, relative)
+
+
+def measure(path, samples, jira, cosmos):
+    results = []
+    for _ in range(samples):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", path, jira.url, cosmos.url],
+                                capture_output=True, text=True, check=True).stdout
+        line = next(line for line in output.splitlines() if line.startswith("RESULT "))
+        results.append(json.loads(line[len("RESULT "):]))
+    return results
+
+
+def report(label, results):
+    imports = statistics.median(r["import"] for r in results) * 1000
+    firsts = statistics.median(r["first_request"] for r in results) * 1000
+    heavy = ", ".join(results[0]["heavy"]) or "none"
+    print(f"{label:12} import {imports:7.1f} ms   import-to-first-issue {firsts:7.1f} ms   heavy modules loaded: {heavy}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(*sys.argv[2:5])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=7)
+    parser.add_argument("--compare", help="git revision to measure fetch_data at as well")
+    args = parser.parse_args()
+
+    with FakeJira(100) as jira, FakeCosmosAccount() as cosmos, tempfile.TemporaryDirectory() as tmp:
+        variants = [("working tree", FETCH_DATA_DIR)]
+        if args.compare:
+            variants.insert(0, (args.compare, export_revision(args.compare, tmp)))
+        for label, path in variants:
+            report(label, measure(path, args.samples, jira, cosmos))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Attachment enrichment throughput with latency-injecting Vision and Document
+Intelligence fakes.
+
+Runs the same synthetic issues through the enricher twice, once with one
+worker per pool (equivalent to the old serial loops) and once with the
+configured concurrency, and reports attachments/s for each.
+
+    python benchmarks/bench_enrichment.py [--issues 40] [--latency 0.2]
+"""
+import argparse
+import logging
+import time
+
+from fakes import (FakeAttachmentStore, FakeCosmosAccount, FakeDocumentIntelligence, FakeVision,
+                   import_fetch_data)
+
+
+def synthetic_issues(count, attachments_url, images, pdfs):
+    for i in range(count):
+        attachments = [{"mimeType": "image/png", "content": f"{attachments_url}/attachments/{i}-img-{n}.png"}
+                       for n in range(images)]
+        attachments += [{"mimeType": "application/pdf", "content": f"{attachments_url}/attachments/{i}-doc-{n}.pdf"}
+                        for n in range(pdfs)]
+        yield {"id": str(i), "key": f"OPS-{i}", "fields": {"attachment": attachments}}
+
+
+def run(fetch_data, enrichment, issues, image_concurrency, pdf_concurrency):
+    started = time.perf_counter()
+    with enrichment.AttachmentEnricher(fetch_data.ATTACHMENT_ANALYZERS, image_concurrency=image_concurrency,
+                                       pdf_concurrency=pdf_concurrency) as enricher:
+        enriched = list(enricher.enrich(issues, fetch_data.jira_attachment_jobs))
+    return enriched, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--issues", type=int, default=40)
+    parser.add_argument("--images", type=int, default=2, help="image attachments per issue")
+    parser.add_argument("--pdfs", type=int, default=1, help="PDF attachments per issue")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds added to every Vision/DocIntel request")
+    parser.add_argument("--image-concurrency", type=int, default=8)
+    parser.add_argument("--pdf-concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    with FakeVision(latency=args.latency) as vision, FakeDocumentIntelligence(latency=args.latency) as docintel, \
+            FakeAttachmentStore() as store, FakeCosmosAccount() as cosmos:
+        fetch_data = import_fetch_data(COSMOSDB_URL=cosmos.url, AZURE_VISION_ENDPOINT=vision.url,
+                                       AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT=docintel.url,
+                                       # Measures analysis concurrency, not the Atlassian rate limit
+                                       ATLASSIAN_RATE_PER_SECOND=0)
+        import enrichment
+        logging.getLogger().setLevel(logging.WARNING)
+
+        attachments = args.issues * (args.images + args.pdfs)
+        results = {}
+        for label, image_workers, pdf_workers in (("serial", 1, 1),
+                                                  ("concurrent", args.image_concurrency, args.pdf_concurrency)):
+            issues = synthetic_issues(args.issues, store.url, args.images, args.pdfs)
+            enriched, elapsed = run(fetch_data, enrichment, issues, image_workers, pdf_workers)
+            results[label] = enriched
+            print(f"{label:<11} {attachments} attachments in {elapsed:6.2f}s ({attachments / elapsed:6.1f}/s)")
+
+        if [r["key"] for r in results["serial"]] != [r["key"] for r in results["concurrent"]]:
+            raise SystemExit("record order differs between serial and concurrent runs")
+        missing = [r["key"] for r in results["concurrent"]
+                   if any(a["kind"] == "pdf" and not a["text"] for a in r.get("attachment_analyses", []))]
+        if args.pdfs and missing:
+            raise SystemExit(f"{len(missing)} records without PDF text, e.g. {missing[:3]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Full flatten rebuild (FLATTEN_MODE=full) over an in-memory Cosmos DB.
+
+Scenarios:
+  rebuild      every document re-flattened with 1 and with --workers worker
+               processes; reports docs/s and chunk writes
+  memory       a quarter of the corpus and the whole corpus with tracemalloc
+               on; reports the heap the rebuild needed beyond what it left
+               stored, which should stay flat as the corpus grows
+  resume       the target rejects one document part way through; the run must
+               fail without recording that page, and a second run must resume
+               from the last written page and leave every document flattened
+
+    python benchmarks/bench_flatten_rebuild.py [--docs 20000] [--workers 4] [--page-size 500]
+"""
+import argparse
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+from fakes import REPO_ROOT, prose
+from memory_cosmos import MemoryCosmosAccount
+
+FLATTEN_DIR = os.path.join(REPO_ROOT, "function-app-flatten")
+
+
+# Function to generate source document `index`: alternately a Jira issue with
+# an ADF description and a Confluence page with a storage-format body
+def source_document(index, text_chars):
+    if index % 2:
+        paragraphs = "".join(f"<p>{prose(index + n, 400)}</p>" for n in range(max(1, text_chars // 400)))
+        return {"id": str(200000 + index), "type": "page", "title": f"Runbook {index}",
+                "body": {"storage": {"value": f"<h2>Runbook {index}</h2>{paragraphs}", "representation": "storage"}}}
+    description = {"type": "doc", "version": 1, "content": [
+        {"type": "paragraph", "content": [{"type": "text", "text": prose(index + n, 400)}]}
+        for n in range(max(1, text_chars // 400))]}
+    return {"id": str(10000 + index), "key": f"OPS-{index}",
+            "fields": {"summary": f"Synthetic issue {index}", "description": description}}
+
+
+def source_container(docs, text_chars):
+    container = MemoryCosmosAccount().get_database_client("source").get_container_client("documents")
+    for index in range(docs):
+        container.upsert_item(source_document(index, text_chars))
+    return container
+
+
+def target_containers(flatten_cosmos):
+    database = MemoryCosmosAccount({"chunks": "/parent_id"}).get_database_client("flattened")
+    return (database.get_container_client("documents"),
+            database.get_container_client(flatten_cosmos.FLATTEN_STATE_CONTAINER),
+            database.get_container_client("chunks"))
+
+
+def rebuild(flatten_cosmos, source, target, state, chunks, workers):
+    """Runs one flatten_full and returns (seconds, documents read)."""
+    flatten_cosmos.FLATTEN_WORKERS = workers
+    flatten_cosmos.metrics.reset()
+    started = time.perf_counter()
+    try:
+        flatten_cosmos.flatten_full(source, target, state, chunks)
+    finally:
+        read = flatten_cosmos.metrics.counters.get("flatten.documents_read", 0)
+    return time.perf_counter() - started, read
+
+
+def reject_once(container, record_id):
+    """Makes the container fail the first upsert of `record_id` with a non-retryable error."""
+    from azure.cosmos.exceptions import CosmosHttpResponseError
+    upsert = container.upsert_item
+    rejected = []
+
+    def upsert_item(body, **kwargs):
+        if body.get("id") == record_id and not rejected:
+            rejected.append(record_id)
+            raise CosmosHttpResponseError(status_code=400, message="Rejected by the benchmark")
+        return upsert(body, **kwargs)
+
+    container.upsert_item = upsert_item
+    return rejected
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=4, help="worker processes for the parallel rebuild")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--text-chars", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.update(FLATTEN_PAGE_SIZE=str(args.page_size), COSMOS_DEAD_LETTER_PATH=os.devnull)
+    sys.path.insert(0, FLATTEN_DIR)
+    from FlattenCosmosData import flatten_cosmos
+    logging.getLogger().setLevel(logging.ERROR)
+
+    source = source_container(args.docs, args.text_chars)
+    print(f"{args.docs} source documents, {args.page_size} per page, {args.text_chars} characters of text each\n")
+
+    print(f"{'scenario':<22}{'seconds':>9}{'docs/s':>9}{'read':>8}{'chunks':>8}{'heap MiB':>10}")
+    for workers in sorted({1, args.workers}):
+        target, state, chunks = target_containers(flatten_cosmos)
+        seconds, read = rebuild(flatten_cosmos, source, target, state, chunks, workers)
+        if len(target) != args.docs:
+            raise SystemExit(f"rebuild with {workers} workers flattened {len(target)} of {args.docs} documents")
+        print(f"{f'rebuild, {workers} workers':<22}{seconds:>9.2f}{args.docs / seconds:>9.0f}{read:>8}{len(chunks):>8}{'':>10}")
+
+    heaps = []
+    for docs in (args.docs // 4, args.docs):
+        corpus = source_container(docs, args.text_chars) if docs != args.docs else source
+        target, state, chunks = target_containers(flatten_cosmos)
+        tracemalloc.start()
+        seconds, read = rebuild(flatten_cosmos, corpus, target, state, chunks, args.workers)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        heaps.append((peak - current) / 1024 / 1024)
+        print(f"{f'memory, {docs} docs':<22}{seconds:>9.2f}{docs / seconds:>9.0f}{read:>8}{len(chunks):>8}{heaps[-1]:>10.1f}")
+
+    target, state, chunks = target_containers(flatten_cosmos)
+    rejected_id = source_document(args.docs * 3 // 5, 0)["id"]
+    rejected = reject_once(target, rejected_id)
+    try:
+        rebuild(flatten_cosmos, source, target, state, chunks, args.workers)
+        raise SystemExit("the rebuild did not fail on the rejected document")
+    except RuntimeError:
+        pass
+    progress = state.read_item(flatten_cosmos.FLATTEN_STATE_ID, partition_key=flatten_cosmos.FLATTEN_STATE_ID)["rebuild"]
+    seconds, read = rebuild(flatten_cosmos, source, target, state, chunks, args.workers)
+    print(f"{'resume':<22}{seconds:>9.2f}{read / seconds:>9.0f}{read:>8}{len(chunks):>8}{'':>10}")
+
+    print(f"\nresume: first run stopped after {progress['count']} documents, second run read {read}")
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB (benchmark process)")
+    if not rejected:
+        raise SystemExit("the rejected document was never written")
+    if len(target) != args.docs:
+        raise SystemExit(f"resumed rebuild left {len(target)} of {args.docs} documents flattened")
+    if progress["count"] + read != args.docs:
+        raise SystemExit(f"resume read {read} documents after {progress['count']}, expected {args.docs - progress['count']}")
+    final = state.read_item(flatten_cosmos.FLATTEN_STATE_ID, partition_key=flatten_cosmos.FLATTEN_STATE_ID)
+    if not final.get("continuation"):
+        raise SystemExit("the finished rebuild did not record a change feed position")
+
+
+if __name__ == "__main__":
+    main()
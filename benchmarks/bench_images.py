@@ -0,0 +1,68 @@
+"""
+Image preparation before Vision analysis: streamed, size-capped download,
+MIME sniffing and downscaling.
+
+Serves a mix of attachments from a local fake (a 4K screenshot, a 12MP
+photo, an oversized file, a file that is not an image and a tiny icon) and
+reports, per attachment, the bytes downloaded, the bytes that would be sent
+to Vision with and without downscaling, the estimated peak memory and the
+preparation time. Downscaling needs Pillow (pip install pillow).
+
+    python benchmarks/bench_images.py [--max-dimension 2048]
+"""
+import argparse
+import io
+import logging
+import time
+
+from fakes import FakeAttachmentStore, FakeCosmosAccount, import_fetch_data, png_bytes
+
+
+def jpeg_photo(width, height):
+    from PIL import Image
+    import os
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-dimension", type=int, default=2048)
+    parser.add_argument("--max-mb", type=float, default=20)
+    args = parser.parse_args()
+
+    files = {
+        "screenshot-3840x2160.png": ("image/png", png_bytes(3840, 2160)),
+        "photo-4000x3000.jpg": ("image/jpeg", jpeg_photo(4000, 3000)),
+        "scan-6000x4000-noise.png": ("image/png", png_bytes(6000, 4000, noise=True)),
+        "diagram.svg": ("image/svg+xml", b'<svg xmlns="http://www.w3.org/2000/svg"></svg>' + b" " * 100000),
+        "icon-32x32.png": ("image/png", png_bytes(32, 32)),
+        "chart-800x600.png": ("image/png", png_bytes(800, 600)),
+    }
+    with FakeAttachmentStore(files) as store, FakeCosmosAccount() as cosmos:
+        fetch_data = import_fetch_data(COSMOSDB_URL=cosmos.url, IMAGE_MAX_DIMENSION=args.max_dimension,
+                                       IMAGE_MAX_MB=args.max_mb, ATLASSIAN_RATE_PER_SECOND=0)
+        import image_prep
+        logging.getLogger().setLevel(logging.ERROR)
+
+        print(f"{'attachment':28} {'size':>9} {'downloaded':>11} {'sent (raw)':>11} {'sent':>9} {'~peak':>9} {'ms':>7}")
+        for name, (_, body) in files.items():
+            url = f"{store.url}/attachments/{name}"
+            client = fetch_data.http_client_for(url)
+            raw = image_prep.prepare_image(client.get(url, stream=True), downscale=False)
+            started = time.perf_counter()
+            prepared = image_prep.prepare_image(client.get(url, stream=True), fetch_data.image_stats)
+            elapsed = (time.perf_counter() - started) * 1000
+            if prepared is None:
+                reason = next(iter(fetch_data.image_stats.skipped)) if fetch_data.image_stats.skipped else "skipped"
+                print(f"{name:28} {len(body) / 2**20:8.2f}M {'skipped: ' + reason:>31} {'':>19} {elapsed:7.1f}")
+                fetch_data.image_stats.skipped.clear()
+                continue
+            print(f"{name:28} {len(body) / 2**20:8.2f}M {prepared.downloaded / 2**20:10.2f}M "
+                  f"{raw.sent / 2**20:10.2f}M {prepared.sent / 2**20:8.2f}M {prepared.peak / 2**20:8.1f}M {elapsed:7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Paginated Jira fetch against a local fake serving 50k issues.
+
+Checks that every issue is yielded exactly once and reports throughput,
+peak Python heap use (which should stay flat as the corpus grows) and the
+HTTP client's per-endpoint latency. --throttle-every makes the fake answer
+429 periodically to exercise Retry-After handling. --edit-every makes the
+fake edit an already fetched issue every N issues served, moving it to the
+end of the results; the fetch must still yield every issue.
+
+    python benchmarks/bench_jira_fetch.py [--issues 50000] [--throttle-every 7] [--edit-every 50]
+"""
+import argparse
+import logging
+import time
+import tracemalloc
+
+from fakes import FakeCosmosAccount, FakeJira, import_fetch_data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--issues", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every Jira response")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth request with 429")
+    parser.add_argument("--rate", type=float, default=0, help="client requests/s per host (0 = unlimited)")
+    parser.add_argument("--edit-every", type=int, default=0, help="edit an already served issue every N issues served")
+    args = parser.parse_args()
+
+    with FakeJira(args.issues, latency=args.latency, throttle_every=args.throttle_every,
+                  edit_every=args.edit_every) as jira, \
+            FakeCosmosAccount() as cosmos:
+        fetch_data = import_fetch_data(JIRA_API_URL=jira.url, COSMOSDB_URL=cosmos.url, JIRA_PAGE_SIZE=args.page_size,
+                                       ATLASSIAN_RATE_PER_SECOND=args.rate)
+        logging.getLogger().setLevel(logging.WARNING)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        seen = set()
+        yielded = 0
+        for issue in fetch_data.fetch_jira_tickets():
+            seen.add(issue["key"])
+            yielded += 1
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"issues:      {len(seen)} / {args.issues}")
+        print(f"requests:    {jira.requests} ({jira.throttled} throttled), {jira.served} issues served")
+        print(f"edited:      {len(jira.edited)} issues, {yielded - len(seen)} yielded again as new versions")
+        print(f"elapsed:     {elapsed:.2f}s ({len(seen) / elapsed:.0f} issues/s)")
+        print(f"peak heap:   {peak / 1024 / 1024:.1f} MiB (includes the set of seen keys)")
+        for endpoint, stats in fetch_data.http_stats.endpoints.items():
+            print(f"{endpoint}: {stats}")
+        if len(seen) != args.issues:
+            raise SystemExit(f"expected {args.issues} unique issues, got {len(seen)}")
+
+
+if __name__ == "__main__":
+    main()
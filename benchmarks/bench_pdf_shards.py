@@ -0,0 +1,57 @@
+"""
+Page-range sharding of large PDFs against a local Document Intelligence
+stand-in whose processing time grows with the number of pages analysed.
+
+Analyses a small and a large PDF twice, once with sharding effectively
+disabled (one call per PDF) and once with the configured shard size, checks
+that the stitched content has every page exactly once and in order, and
+reports the wall time of each.
+
+    python benchmarks/bench_pdf_shards.py [--pages 300] [--shard-pages 50] [--seconds-per-page 0.05]
+"""
+import argparse
+import logging
+import time
+
+from fakes import FakeAttachmentStore, FakeCosmosAccount, FakeDocumentIntelligence, import_fetch_data, pdf_bytes
+
+
+def expected_content(pages):
+    return "\n".join(f"Text of page {page}." for page in range(1, pages + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--small-pages", type=int, default=12)
+    parser.add_argument("--shard-pages", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seconds-per-page", type=float, default=0.05)
+    args = parser.parse_args()
+
+    files = {"spec.pdf": ("application/pdf", pdf_bytes(args.pages)),
+             "note.pdf": ("application/pdf", pdf_bytes(args.small_pages))}
+    with FakeAttachmentStore(files) as store, FakeCosmosAccount() as cosmos, \
+            FakeDocumentIntelligence(seconds_per_page=args.seconds_per_page) as docintel:
+        fetch_data = import_fetch_data(COSMOSDB_URL=cosmos.url, AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT=docintel.url,
+                                       PDF_SHARD_CONCURRENCY=args.concurrency, ATLASSIAN_RATE_PER_SECOND=0)
+        logging.getLogger().setLevel(logging.WARNING)
+
+        for name, pages in (("note.pdf", args.small_pages), ("spec.pdf", args.pages)):
+            url = f"{store.url}/attachments/{name}"
+            timings = {}
+            for label, shard_pages in (("single call", 10 ** 9), ("sharded", args.shard_pages)):
+                fetch_data.PDF_SHARD_PAGES = shard_pages
+                requests_before = docintel.requests
+                started = time.perf_counter()
+                content = fetch_data.analyze_pdf(url)
+                timings[label] = time.perf_counter() - started
+                if content != expected_content(pages):
+                    raise SystemExit(f"{name} ({label}): stitched content does not match pages 1-{pages} in order")
+                print(f"{name:9} {pages:4} pages  {label:11} {timings[label]:6.2f}s  "
+                      f"({docintel.requests - requests_before} Document Intelligence requests)")
+            print(f"{name:9} speed-up {timings['single call'] / timings['sharded']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
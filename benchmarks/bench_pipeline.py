@@ -0,0 +1,224 @@
+"""
+End-to-end sync benchmark: fetch -> enrich -> store -> flatten, fully offline.
+
+Starts local fakes for Jira, Confluence, the attachment store, Vision and
+Document Intelligence, swaps Cosmos DB for the in-memory stand-in in
+memory_cosmos.py, runs sync_source("jira") and sync_source("confluence") and
+then the incremental flatten (with chunking) over what was stored. The sync
+stages are joined by a SQLite work queue in a temporary directory unless
+--work-queue none chains them in-process. Reports
+docs/s per phase and end to end, p50/p99 latency per stage, peak RSS and
+the simulated RU charge per container, and checks that every record made it
+to the flattened container and that a second incremental flatten, with
+nothing changed, resumes from the saved continuation and reads nothing.
+
+Corpus size, text size, attachment mix (average attachments per record),
+injected latency and 429s are all configurable, so a run before and after a
+change shows whether it is a regression. --json writes the results for
+comparison, and --min-docs-per-second fails the run below a threshold.
+
+    python benchmarks/bench_pipeline.py [--issues 2000] [--pages 500] [--images 0.3] [--pdfs 0.1]
+        [--atlassian-latency 0.02] [--ai-latency 0.05] [--throttle-every 0] [--cosmos-throttle-every 0]
+        [--work-queue sqlite|none]
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from fakes import (REPO_ROOT, FakeAttachmentStore, FakeConfluence, FakeDocumentIntelligence, FakeJira, FakeVision,
+                   import_fetch_data)
+from memory_cosmos import MemoryCosmosAccount
+
+FLATTEN_DIR = os.path.join(REPO_ROOT, "function-app-flatten")
+
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0, 0.0
+    return ordered[int(0.5 * (len(ordered) - 1))], ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+
+
+class StageTimer:
+    """Latency samples per pipeline stage, collected by wrapping the functions that implement each stage."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        # list.append is atomic, so enrichment threads can record concurrently
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+
+def instrument(fetch_data, flatten_cosmos, timer):
+    # Module globals are looked up at call time, so replacing them times every call
+    fetch_data.fetch_jira_page = timer.wrap("fetch.jira_page", fetch_data.fetch_jira_page)
+    fetch_data.fetch_confluence_page = timer.wrap("fetch.confluence_page", fetch_data.fetch_confluence_page)
+    for kind, analyze in list(fetch_data.ATTACHMENT_ANALYZERS.items()):
+        fetch_data.ATTACHMENT_ANALYZERS[kind] = timer.wrap(f"enrich.{kind}", analyze)
+    flatten_cosmos.flatten_document = timer.wrap("flatten.document", flatten_cosmos.flatten_document)
+    flatten_cosmos.sync_chunks = timer.wrap("flatten.chunks_page", flatten_cosmos.sync_chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--issues", type=int, default=2000)
+    parser.add_argument("--pages", type=int, default=500, help="Confluence pages")
+    parser.add_argument("--issue-chars", type=int, default=1500, help="description size of each issue")
+    parser.add_argument("--page-chars", type=int, default=6000, help="body size of each Confluence page")
+    parser.add_argument("--images", type=float, default=0.3, help="average image attachments per record")
+    parser.add_argument("--pdfs", type=float, default=0.1, help="average PDF attachments per record")
+    parser.add_argument("--pdf-pages", type=int, default=4)
+    parser.add_argument("--atlassian-latency", type=float, default=0.02, help="seconds added to every Jira/Confluence response")
+    parser.add_argument("--ai-latency", type=float, default=0.05, help="seconds added to every Vision/DocIntel request")
+    parser.add_argument("--seconds-per-page", type=float, default=0.02, help="Document Intelligence processing time per page")
+    parser.add_argument("--cosmos-latency", type=float, default=0.0, help="seconds added to every Cosmos operation")
+    parser.add_argument("--atlassian-rate", type=float, help="client requests/s per Atlassian host (default: the app's "
+                        "ATLASSIAN_RATE_PER_SECOND; 0 = unlimited); attachment downloads count against it too")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth Atlassian/AI request with 429")
+    parser.add_argument("--cosmos-throttle-every", type=int, default=0, help="throttle every Nth Cosmos operation")
+    parser.add_argument("--work-queue", choices=["sqlite", "none"], default="sqlite",
+                        help="join the sync stages with a SQLite work queue, or chain them in-process")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--min-docs-per-second", type=float, default=0, help="exit non-zero below this end-to-end rate")
+    args = parser.parse_args()
+
+    rss_before = peak_rss_mib()
+    with FakeAttachmentStore(latency=args.atlassian_latency, pdf_pages=args.pdf_pages) as store, \
+            FakeJira(args.issues, latency=args.atlassian_latency, throttle_every=args.throttle_every,
+                     text_chars=args.issue_chars, images=args.images, pdfs=args.pdfs, attachment_url=store.url) as jira, \
+            FakeConfluence(args.pages, latency=args.atlassian_latency, throttle_every=args.throttle_every,
+                           text_chars=args.page_chars, images=args.images, pdfs=args.pdfs, attachments=store) as confluence, \
+            FakeVision(latency=args.ai_latency, throttle_every=args.throttle_every) as vision, \
+            FakeDocumentIntelligence(latency=args.ai_latency, seconds_per_page=args.seconds_per_page,
+                                     throttle_every=args.throttle_every) as docintel, \
+            tempfile.TemporaryDirectory() as queue_dir:
+        account = MemoryCosmosAccount(partition_keys={"chunks": "/parent_id", "attachments": "/parent_id"}, latency=args.cosmos_latency,
+                                      throttle_every=args.cosmos_throttle_every)
+        fetch_data = import_fetch_data(JIRA_API_URL=jira.url, CONFLUENCE_API_URL=confluence.url, COSMOSDB_URL="memory://",
+                                       AZURE_VISION_ENDPOINT=vision.url, AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT=docintel.url,
+                                       COSMOSDB_DATABASE="source", COSMOSDB_CONTAINER="documents",
+                                       COSMOS_DEAD_LETTER_PATH=os.devnull, WORK_QUEUE_BACKEND=args.work_queue,
+                                       WORK_QUEUE_PATH=os.path.join(queue_dir, "work-queue.sqlite3"),
+                                       **({} if args.atlassian_rate is None else {"ATLASSIAN_RATE_PER_SECOND": args.atlassian_rate}))
+        fetch_data.CosmosClient = account.client
+        sys.path.insert(0, FLATTEN_DIR)
+        from FlattenCosmosData import flatten_cosmos
+        logging.getLogger().setLevel(logging.ERROR)
+
+        timer = StageTimer()
+        instrument(fetch_data, flatten_cosmos, timer)
+
+        started = time.perf_counter()
+        downloads = []
+        for source_name in ("jira", "confluence"):
+            fetch_data.sync_source(source_name)
+            # sync_source resets the HTTP stats, so keep each source's download latencies
+            if "attachment" in fetch_data.http_stats.endpoints:
+                downloads.extend(fetch_data.http_stats.endpoints["attachment"].latencies)
+        synced = time.perf_counter()
+        source_db = account.get_database_client("source")
+        source = source_db.get_container_client("documents")
+        target_db = account.get_database_client("flattened")
+        flatten_cosmos.flatten_incremental(source, target_db.get_container_client("documents"),
+                                           target_db.get_container_client(flatten_cosmos.FLATTEN_STATE_CONTAINER),
+                                           target_db.get_container_client("chunks"),
+                                           source_db.get_container_client(flatten_cosmos.ATTACHMENT_CONTAINER))
+        finished = time.perf_counter()
+        # Nothing changed since, so a second run must resume from the saved continuation and flatten nothing
+        flattened_once = len(timer.samples["flatten.document"])
+        flatten_cosmos.flatten_incremental(source, target_db.get_container_client("documents"),
+                                           target_db.get_container_client(flatten_cosmos.FLATTEN_STATE_CONTAINER),
+                                           target_db.get_container_client("chunks"),
+                                           source_db.get_container_client(flatten_cosmos.ATTACHMENT_CONTAINER))
+        reflattened = len(timer.samples["flatten.document"]) - flattened_once
+
+    records = args.issues + args.pages
+    target = target_db.get_container_client("documents")
+    results = {
+        "records": records,
+        "attachments": sum(len(timer.samples.get(f"enrich.{kind}", [])) for kind in ("image", "pdf")),
+        "sync_seconds": synced - started,
+        "flatten_seconds": finished - synced,
+        "total_seconds": finished - started,
+        "sync_docs_per_second": records / (synced - started),
+        "flatten_docs_per_second": records / max(finished - synced, 1e-9),
+        "docs_per_second": records / (finished - started),
+        "peak_rss_mib": peak_rss_mib(),
+        "rss_before_mib": rss_before,
+        "stages": {},
+        "cosmos": {},
+        "fake_requests": {"jira": jira.requests, "confluence": confluence.requests, "attachments": store.requests,
+                          "vision": vision.requests, "document_intelligence": docintel.requests,
+                          "throttled": jira.throttled + confluence.throttled + vision.throttled + docintel.throttled},
+    }
+    for stage, samples in sorted(timer.samples.items()):
+        p50, p99 = percentiles(samples)
+        results["stages"][stage] = {"count": len(samples), "p50_ms": p50 * 1000, "p99_ms": p99 * 1000}
+    # Attachment downloads are timed by the HTTP client itself
+    if downloads:
+        p50, p99 = percentiles(downloads)
+        results["stages"]["enrich.download"] = {"count": len(downloads), "p50_ms": p50 * 1000, "p99_ms": p99 * 1000}
+    for database in account.databases.values():
+        for name, container in database.containers.items():
+            p50, p99 = percentiles(container.stats.latencies)
+            results["cosmos"][f"{database.id}/{name}"] = {
+                "documents": len(container), "request_units": container.stats.request_charge,
+                "operations": container.stats.operations, "throttled": container.stats.throttled,
+                "p50_ms": p50 * 1000, "p99_ms": p99 * 1000,
+            }
+
+    print(f"records:       {records} ({args.issues} issues, {args.pages} pages), {results['attachments']} attachments")
+    print(f"sync:          {results['sync_seconds']:7.2f}s  {results['sync_docs_per_second']:8.1f} docs/s")
+    print(f"flatten:       {results['flatten_seconds']:7.2f}s  {results['flatten_docs_per_second']:8.1f} docs/s")
+    print(f"end to end:    {results['total_seconds']:7.2f}s  {results['docs_per_second']:8.1f} docs/s")
+    print(f"peak RSS:      {results['peak_rss_mib']:.0f} MiB ({rss_before:.0f} MiB before the run)")
+    print(f"\n{'stage':24} {'count':>7} {'p50 ms':>9} {'p99 ms':>9}")
+    for stage, stats in results["stages"].items():
+        print(f"{stage:24} {stats['count']:7} {stats['p50_ms']:9.2f} {stats['p99_ms']:9.2f}")
+    print(f"\n{'container':24} {'docs':>7} {'RU':>10} {'RU/record':>10} {'throttled':>9} {'p99 ms':>9}")
+    for name, stats in results["cosmos"].items():
+        print(f"{name:24} {stats['documents']:7} {stats['request_units']:10.0f} {stats['request_units'] / records:10.2f} "
+              f"{stats['throttled']:9} {stats['p99_ms']:9.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    flattened = {doc["id"] for doc in target.documents()}
+    if len(flattened) != records:
+        raise SystemExit(f"expected {records} flattened documents, found {len(flattened)}")
+    if reflattened:
+        raise SystemExit(f"a second incremental flatten re-read {reflattened} unchanged documents")
+    attachments = source_db.get_container_client("attachments")
+    joined = sum(bool(doc.get("image_text") or doc.get("pdf_text")) for doc in target.documents())
+    analysed = len({doc["parent_id"] for doc in attachments.documents() if doc.get("text")})
+    if joined != analysed:
+        raise SystemExit(f"{analysed} records have analysed attachments but {joined} flattened documents carry their text")
+    if results["docs_per_second"] < args.min_docs_per_second:
+        raise SystemExit(f"{results['docs_per_second']:.1f} docs/s is below the {args.min_docs_per_second} docs/s threshold")
+
+
+if __name__ == "__main__":
+    main()
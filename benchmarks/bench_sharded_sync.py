@@ -0,0 +1,142 @@
+"""
+Sharded sync benchmark: one shard per source vs one per Jira project /
+Confluence space, synced on SYNC_WORKERS threads under leases.
+
+Every scenario runs in a fresh interpreter against local Jira, Confluence
+and attachment fakes with in-memory Cosmos DB:
+
+  unsharded    SYNC_SHARD_BY=none, as before sharding
+  sharded      SYNC_SHARD_BY=project on --workers threads
+  overlapping  two sharded runs started together, like overlapping timer
+               runs or two Function instances; the leases should divide the
+               shards between them, so no record is fetched twice
+  backfill     (with --slice-days) the corpus spread over --span-days and the
+               first sync split into time slices of --slice-days per shard,
+               followed by a second run that resumes incrementally
+
+Each scenario checks that every record was stored. Sharding pays off when the
+sync is bound by Atlassian latency; --atlassian-rate caps all shards
+together, as the shared rate limiter does in production.
+
+    python benchmarks/bench_sharded_sync.py [--issues 2000] [--pages 500] [--projects 8] [--workers 4]
+        [--atlassian-latency 0.05] [--slice-days 30 --span-days 365]
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from fakes import FakeConfluence, FakeJira, import_fetch_data
+from memory_cosmos import MemoryCosmosAccount
+
+SCENARIOS = ("unsharded", "sharded", "overlapping", "backfill")
+
+
+def child(scenario, args):
+    epoch = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    spacing = 1.0
+    env = {"SYNC_SHARD_BY": "none" if scenario == "unsharded" else "project", "SYNC_WORKERS": args.workers}
+    if scenario == "backfill":
+        epoch = datetime.now(timezone.utc) - timedelta(days=args.span_days)
+        spacing = args.span_days * 86400 / max(args.issues, args.pages, 1)
+        env.update(SYNC_BACKFILL_START=epoch.isoformat(), SYNC_BACKFILL_SLICE_DAYS=args.slice_days)
+    if args.atlassian_rate is not None:
+        env["ATLASSIAN_RATE_PER_SECOND"] = args.atlassian_rate
+
+    with FakeJira(args.issues, latency=args.atlassian_latency, projects=args.projects, spacing=spacing,
+                  epoch=epoch) as jira, \
+            FakeConfluence(args.pages, latency=args.atlassian_latency, spaces=args.projects, spacing=spacing,
+                           epoch=epoch) as confluence:
+        account = MemoryCosmosAccount()
+        fetch_data = import_fetch_data(JIRA_API_URL=jira.url, CONFLUENCE_API_URL=confluence.url, COSMOSDB_URL="memory://",
+                                       COSMOSDB_DATABASE="source", COSMOSDB_CONTAINER="documents",
+                                       COSMOS_DEAD_LETTER_PATH=os.devnull, **env)
+        fetch_data.CosmosClient = account.client
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+        # Keep each run's shard outcomes; concurrent runs share this process's run summary
+        outcomes = []
+        run_shards = fetch_data.run_shards
+        fetch_data.run_shards = lambda *a, **kw: outcomes.append(run_shards(*a, **kw)) or outcomes[-1]
+
+        def run():
+            try:
+                fetch_data.sync_sources("jira", "confluence")
+            except RuntimeError as e:
+                print(f"run failed: {e}", file=sys.stderr)
+
+        started = time.perf_counter()
+        if scenario == "overlapping":
+            threads = [threading.Thread(target=run) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            run()
+            if scenario == "backfill":
+                # The second run promotes finished shards and continues incrementally
+                run()
+        elapsed = time.perf_counter() - started
+
+    state = account.get_database_client("source").get_container_client(fetch_data.SYNC_STATE_CONTAINER)
+    result = {
+        "seconds": elapsed,
+        "stored": len(account.get_database_client("source").get_container_client("documents")),
+        "fetched": jira.served + confluence.served,
+        "requests": jira.requests + confluence.requests,
+        "runs": [dict(sorted(Counter(run_outcomes.values()).items())) for run_outcomes in outcomes],
+        "checkpoints": sum(1 for doc in state.documents() if doc.get("type") == "sync_checkpoint"),
+    }
+    print("RESULT " + json.dumps(result), flush=True)
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--issues", type=int, default=2000)
+    parser.add_argument("--pages", type=int, default=500, help="Confluence pages")
+    parser.add_argument("--projects", type=int, default=8, help="Jira projects, and as many Confluence spaces")
+    parser.add_argument("--workers", type=int, default=4, help="SYNC_WORKERS for the sharded scenarios")
+    parser.add_argument("--atlassian-latency", type=float, default=0.05, help="seconds added to every Jira/Confluence response")
+    parser.add_argument("--atlassian-rate", type=float, help="client requests/s per Atlassian host (default: the app's "
+                        "ATLASSIAN_RATE_PER_SECOND; 0 = unlimited)")
+    parser.add_argument("--slice-days", type=float, default=0, help="also run the backfill scenario with slices this long")
+    parser.add_argument("--span-days", type=float, default=365, help="age of the oldest record in the backfill scenario")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args)
+
+    scenarios = [name for name in SCENARIOS if name != "backfill" or args.slice_days > 0]
+    records = args.issues + args.pages
+    results = {}
+    for scenario in scenarios:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--child", scenario],
+                                capture_output=True, text=True, check=True).stdout
+        line = next(line for line in output.splitlines() if line.startswith("RESULT "))
+        results[scenario] = json.loads(line[len("RESULT "):])
+
+    print(f"{records} records ({args.issues} issues, {args.pages} pages) in {args.projects} projects/spaces, "
+          f"{args.workers} workers, {args.atlassian_latency * 1000:.0f} ms Atlassian latency\n")
+    print(f"{'scenario':12} {'seconds':>8} {'docs/s':>8} {'fetched':>8} {'requests':>9} {'checkpoints':>11}  shards per run")
+    for scenario, result in results.items():
+        print(f"{scenario:12} {result['seconds']:8.2f} {records / result['seconds']:8.1f} {result['fetched']:8} "
+              f"{result['requests']:9} {result['checkpoints']:11}  {result['runs']}")
+
+    for scenario, result in results.items():
+        if result["stored"] != records:
+            raise SystemExit(f"{scenario}: expected {records} stored records, found {result['stored']}")
+    if "overlapping" in results and results["overlapping"]["fetched"] > results["sharded"]["fetched"]:
+        raise SystemExit(f"overlapping runs fetched {results['overlapping']['fetched']} records, "
+                         f"{results['sharded']['fetched']} expected: a shard was processed twice")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Micro-benchmark for the ADF and Confluence storage-format text extractors.
+
+Builds large, real-shaped documents (headings, nested lists, tables, code
+blocks, panels, mentions) plus a pathologically deep one, and reports
+extraction throughput.
+
+    python benchmarks/bench_text_extract.py [--blocks 5000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "function-app-flatten", "FlattenCosmosData"))
+from text_extract import adf_to_text, storage_to_text  # noqa: E402
+
+
+def text(value, marks=None):
+    node = {"type": "text", "text": value}
+    if marks:
+        node["marks"] = [{"type": mark} for mark in marks]
+    return node
+
+
+def paragraph(*inlines):
+    return {"type": "paragraph", "content": list(inlines)}
+
+
+def build_adf(blocks):
+    content = []
+    for i in range(blocks):
+        kind = i % 6
+        if kind == 0:
+            content.append({"type": "heading", "attrs": {"level": 2}, "content": [text(f"Section {i}")]})
+        elif kind == 1:
+            content.append(paragraph(text("The deployment of "), text("service-%d" % i, ["code"]),
+                                     text(" failed after the node pool upgrade, see "),
+                                     {"type": "mention", "attrs": {"id": "abc", "text": "@Ops"}}, text(".")))
+        elif kind == 2:
+            content.append({"type": "bulletList", "content": [
+                {"type": "listItem", "content": [paragraph(text(f"Step {n}")), {"type": "orderedList", "content": [
+                    {"type": "listItem", "content": [paragraph(text("check the pod logs"))]}]}]} for n in range(4)]})
+        elif kind == 3:
+            content.append({"type": "table", "content": [
+                {"type": "tableRow", "content": [{"type": "tableCell", "content": [paragraph(text(f"r{r}c{c}"))]}
+                                                 for c in range(4)]} for r in range(5)]})
+        elif kind == 4:
+            content.append({"type": "codeBlock", "attrs": {"language": "bash"},
+                            "content": [text("kubectl rollout restart deploy/api\nkubectl get pods -w")]})
+        else:
+            content.append({"type": "panel", "attrs": {"panelType": "warning"},
+                            "content": [paragraph(text("Do not run this during business hours."))]})
+    return {"type": "doc", "version": 1, "content": content}
+
+
+def build_storage(blocks):
+    parts = []
+    for i in range(blocks):
+        kind = i % 6
+        if kind == 0:
+            parts.append(f"<h2>Section {i}</h2>")
+        elif kind == 1:
+            parts.append(f'<p>The deployment of <code>service-{i}</code> failed, see '
+                         f'<ac:link><ri:user ri:account-id="abc"/></ac:link> &amp; the runbook.</p>')
+        elif kind == 2:
+            parts.append("<ul>" + "".join(f"<li>Step {n}<ol><li>check the pod logs</li></ol></li>" for n in range(4)) + "</ul>")
+        elif kind == 3:
+            parts.append("<table><tbody>" + "".join(
+                "<tr>" + "".join(f"<td><p>r{r}c{c}</p></td>" for c in range(4)) + "</tr>" for r in range(5)) + "</tbody></table>")
+        elif kind == 4:
+            parts.append('<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">bash</ac:parameter>'
+                         '<ac:plain-text-body><![CDATA[kubectl rollout restart deploy/api\nkubectl get pods -w]]>'
+                         '</ac:plain-text-body></ac:structured-macro>')
+        else:
+            parts.append('<ac:structured-macro ac:name="warning"><ac:rich-text-body><p>Do not run this during '
+                         'business hours.</p></ac:rich-text-body></ac:structured-macro>')
+    return "".join(parts)
+
+
+def build_deep_adf(depth):
+    doc = {"type": "doc", "content": []}
+    node = doc
+    for _ in range(depth):
+        child = {"type": "bulletList", "content": [{"type": "listItem", "content": []}]}
+        node["content"].append(child)
+        node = child["content"][0]
+    node["content"].append(paragraph(text("bottom")))
+    return doc
+
+
+def timed(label, func, value, size, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = func(value)
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<22} {size / 1024 / 1024:6.2f} MiB in {best * 1000:8.1f} ms "
+          f"({size / 1024 / 1024 / best:6.1f} MiB/s) -> {len(output)} chars")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--depth", type=int, default=20000)
+    args = parser.parse_args()
+
+    adf = build_adf(args.blocks)
+    storage = build_storage(args.blocks)
+    deep = build_deep_adf(args.depth)
+    timed("ADF", adf_to_text, adf, len(json.dumps(adf)), args.repeat)
+    timed("storage XHTML", storage_to_text, storage, len(storage), args.repeat)
+    # json.dumps itself recurses, so size the deep document by its node count instead
+    timed(f"ADF depth {args.depth}", adf_to_text, deep, args.depth * 3 * 40, 1)
+
+
+if __name__ == "__main__":
+    main()
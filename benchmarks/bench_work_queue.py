@@ -0,0 +1,134 @@
+"""
+SQLite work queue benchmark: throughput, backpressure and crash recovery.
+
+  throughput   put, receive and ack --messages records of --size bytes
+  backpressure a fast producer against a slow consumer with --max-depth;
+               checks the depth never passes the bound and reports how long
+               the producer was held back
+  crash        a consumer in a child process acks half its messages and is
+               killed with the rest received but not acked; after the
+               visibility timeout a second consumer drains the queue. Checks
+               every message was delivered at least once and counts the
+               redeliveries.
+
+    python benchmarks/bench_work_queue.py [--messages 20000] [--size 4000] [--max-depth 200]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from fakes import FETCH_DATA_DIR, prose
+
+sys.path.insert(0, FETCH_DATA_DIR)
+from work_queue import SqliteQueueFile, SqliteWorkQueue  # noqa: E402
+
+
+def open_queue(path, name="bench", **kwargs):
+    return SqliteWorkQueue(SqliteQueueFile(path), name, threading.Event(), **kwargs)
+
+
+def drain(queue, done=None):
+    done = done or threading.Event()
+    done.set()
+    seen = []
+    for message in queue.consume(done):
+        seen.append(message.body["n"])
+        queue.ack(message)
+    return seen
+
+
+def throughput(path, messages, size):
+    queue = open_queue(path, max_depth=messages + 1)
+    text = prose(0, size)
+    started = time.perf_counter()
+    for n in range(messages):
+        queue.put({"n": n, "text": text})
+    put = time.perf_counter() - started
+    started = time.perf_counter()
+    seen = drain(queue)
+    consumed = time.perf_counter() - started
+    if sorted(seen) != list(range(messages)):
+        raise SystemExit(f"throughput: {len(seen)} of {messages} messages consumed")
+    print(f"throughput:   put {messages / put:9.0f} msg/s   receive+ack {messages / consumed:9.0f} msg/s "
+          f"({size} byte bodies, file {os.path.getsize(path) / 1024 / 1024:.1f} MiB)")
+
+
+def backpressure(path, messages, max_depth):
+    queue = open_queue(path, "backpressure", max_depth=max_depth)
+    done = threading.Event()
+    peak = [0]
+
+    def produce():
+        for n in range(messages):
+            queue.put({"n": n})
+            peak[0] = max(peak[0], queue.depth())
+        done.set()
+
+    producer = threading.Thread(target=produce)
+    started = time.perf_counter()
+    producer.start()
+    seen = []
+    for message in queue.consume(done):
+        time.sleep(0.0002)
+        seen.append(message.body["n"])
+        queue.ack(message)
+    producer.join()
+    elapsed = time.perf_counter() - started
+    if sorted(seen) != list(range(messages)):
+        raise SystemExit(f"backpressure: {len(seen)} of {messages} messages consumed")
+    if peak[0] > max_depth:
+        raise SystemExit(f"backpressure: depth reached {peak[0]}, above the bound of {max_depth}")
+    print(f"backpressure: peak depth {peak[0]} (bound {max_depth}), producer held back "
+          f"{queue.stats.backpressure_seconds:.2f}s of {elapsed:.2f}s")
+
+
+def crash_child(path, visibility):
+    queue = open_queue(path, "crash", visibility=visibility)
+    received = []
+    for message in queue.consume(threading.Event()):
+        received.append(message)
+        if len(received) % 2 == 0:
+            queue.ack(message)
+        if len(received) >= 2 * 32:
+            break
+    # Die without acking the rest, as a crashed Function instance would
+    os._exit(0)
+
+
+def crash(path, messages, visibility):
+    queue = open_queue(path, "crash", visibility=visibility)
+    for n in range(messages):
+        queue.put({"n": n})
+    subprocess.run([sys.executable, os.path.abspath(__file__), "--crash-child", path, str(visibility)], check=True)
+    acked_by_child = messages - queue.depth()
+    time.sleep(visibility + 0.1)
+    seen = drain(queue)
+    if len(seen) + acked_by_child != messages or queue.depth():
+        raise SystemExit(f"crash: {messages - len(seen) - acked_by_child} messages lost")
+    print(f"crash:        child acked {acked_by_child} and died holding {queue.stats.redelivered}; "
+          f"all {queue.stats.redelivered} were redelivered and {len(seen)} drained, none lost")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=4000, help="approximate body size in bytes")
+    parser.add_argument("--max-depth", type=int, default=200)
+    parser.add_argument("--visibility", type=float, default=1.0, help="visibility timeout in the crash test")
+    parser.add_argument("--crash-child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.crash_child:
+        crash_child(args.crash_child[0], float(args.crash_child[1]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        throughput(os.path.join(directory, "throughput.sqlite3"), args.messages, args.size)
+        backpressure(os.path.join(directory, "backpressure.sqlite3"), args.messages // 4, args.max_depth)
+        crash(os.path.join(directory, "crash.sqlite3"), 200, args.visibility)
+
+
+if __name__ == "__main__":
+    main()
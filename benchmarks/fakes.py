@@ -0,0 +1,584 @@
+"""
+Local stand-ins for the external services the sync talks to.
+
+Each fake is a small threaded HTTP server bound to 127.0.0.1 on a free port.
+They generate their corpus on the fly from an index, so serving tens of
+thousands of records costs no memory in the benchmark process.
+"""
+import base64
+import json
+import math
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FETCH_DATA_DIR = os.path.join(REPO_ROOT, "function-app", "fetch_data")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs add ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def _dispatch(self, method):
+        service = self.server.service
+        if service.latency:
+            time.sleep(service.latency)
+        parsed = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if service.throttle():
+            status, headers, payload = 429, {"Retry-After": "0"}, {"message": "Rate limit exceeded"}
+        else:
+            status, headers, payload = service.handle(method, parsed.path, query, body, self.headers)
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode()
+            headers = {"Content-Type": "application/json", **headers}
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients abandoning a download (size caps, sniffing) are expected
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeService:
+    """
+    Base class: runs handle() behind a background HTTP server. With
+    throttle_every=N, every Nth request is answered with 429 and a
+    Retry-After header instead, like Atlassian Cloud and Azure AI rate limits.
+    """
+
+    def __init__(self, latency=0.0, throttle_every=0):
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self.throttled = 0
+        self._calls = 0
+        self._throttle_lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.service = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def throttle(self):
+        """Whether this request is one of the throttled ones (counted in requests and throttled)."""
+        if not self.throttle_every:
+            return False
+        with self._throttle_lock:
+            self._calls += 1
+            if self._calls % self.throttle_every:
+                return False
+            self.requests += 1
+            self.throttled += 1
+            return True
+
+    def handle(self, method, path, query, body, headers):
+        self.requests += 1
+        return 404, {}, b""
+
+
+SENTENCES = (
+    "The nightly deployment failed after the node pool upgrade.",
+    "Rolling back the ingress controller restored traffic within ten minutes.",
+    "Certificate renewal is now automated through the key vault integration.",
+    "Latency on the search API doubled while the index was rebuilt.",
+    "The database migration runs in batches of five thousand rows.",
+    "Owners must acknowledge a paged incident within fifteen minutes.",
+)
+
+
+# Function to generate about `chars` characters of varied prose for record `index`
+def prose(index, chars):
+    sentences = []
+    total = 0
+    while total < chars:
+        sentence = SENTENCES[(index + len(sentences)) % len(SENTENCES)]
+        sentences.append(sentence)
+        total += len(sentence) + 1
+    return " ".join(sentences)
+
+
+# Function to spread `per_record` attachments (e.g. 0.3) evenly over records:
+# record `index` gets the number that keeps the running average exact
+def attachment_count(index, per_record):
+    return int((index + 1) * per_record) - int(index * per_record)
+
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+# Function to give record `index` an ascending last-modified time, `spacing` seconds apart from `epoch`
+def modified_at(index, spacing=1.0, epoch=EPOCH):
+    return epoch + timedelta(seconds=index * spacing)
+
+
+SCOPE_CLAUSE = re.compile(r'\b(?:project|space) = "([^"]+)"')
+SINCE_CLAUSE = re.compile(r'(?:updated|lastmodified) >= (?:now\(")?-(\d+)m')
+UNTIL_CLAUSE = re.compile(r'(?:updated|lastmodified) < (?:now\(")?-(\d+)m')
+
+
+# Function to apply the project/space and relative-time clauses of a JQL or
+# CQL query to a synthetic corpus: returns the matching record indexes.
+# candidates narrows the scan to the indexes that can match (all by default).
+def matching_indexes(query, total, key_of, updated_of, candidates=None):
+    scope = SCOPE_CLAUSE.search(query)
+    lower, upper = time_bounds(query)
+    indexes = []
+    for index in range(total) if candidates is None else candidates:
+        if scope and key_of(index) != scope.group(1):
+            continue
+        updated = updated_of(index)
+        if (lower is None or updated >= lower) and (upper is None or updated < upper):
+            indexes.append(index)
+    return indexes
+
+
+# Function to turn the relative-time clauses of a query into (lower, upper) datetimes or None
+def time_bounds(query):
+    since = SINCE_CLAUSE.search(query)
+    until = UNTIL_CLAUSE.search(query)
+    now = datetime.now(timezone.utc)
+    return (now - timedelta(minutes=int(since.group(1))) if since else None,
+            now - timedelta(minutes=int(until.group(1))) if until else None)
+
+
+class FakeCorpus(FakeService):
+    """
+    Base class for the Atlassian fakes: `total` synthetic records, record i
+    updated `spacing` seconds after record i - 1. With edit_every=N, every
+    Nth record served edits the oldest record served before it, which moves
+    that record to the end of the update order, as a user editing tickets or
+    pages during a long backfill would.
+    """
+
+    def __init__(self, total, latency=0.0, throttle_every=0, spacing=1.0, epoch=EPOCH, edit_every=0):
+        super().__init__(latency, throttle_every)
+        self.total = total
+        self.spacing = spacing
+        self.epoch = epoch
+        # Records returned by searches, so a benchmark can tell whether any were fetched twice
+        self.served = 0
+        self.edit_every = edit_every
+        # index -> time of its latest edit
+        self.edited = {}
+        self._unedited = deque()
+        self._matches = {}
+        self._edit_lock = threading.Lock()
+
+    def updated(self, index):
+        return self.edited.get(index) or modified_at(index, self.spacing, self.epoch)
+
+    def matches(self, query, key_of):
+        # Every page of one search repeats the same query; a small cache saves rescanning the corpus per page
+        if query not in self._matches:
+            if len(self._matches) > 256:
+                self._matches.clear()
+            # Unedited records are in update order, so only the range within the time bounds is scanned
+            lower, upper = time_bounds(query)
+            first = 0 if lower is None else max(0, math.ceil((lower - self.epoch).total_seconds() / self.spacing))
+            last = self.total if upper is None else min(self.total, max(0, math.ceil((upper - self.epoch).total_seconds() / self.spacing)))
+            candidates = [i for i in range(first, last) if i not in self.edited]
+            edited = sorted(self.edited, key=lambda i: self.edited[i])
+            self._matches[query] = matching_indexes(query, self.total, key_of, self.updated, candidates + edited)
+        return self._matches[query]
+
+    def serve(self, matches, start, end):
+        """Counts matches[start:end] as served and makes the edits they are due."""
+        self.served += end - start
+        if self.edit_every:
+            self.edit(matches[start:end], self.served // self.edit_every - (self.served - (end - start)) // self.edit_every)
+
+    def edit(self, served, count):
+        # Edits the `count` oldest served records not edited yet
+        with self._edit_lock:
+            self._unedited.extend(served)
+            while count and self._unedited:
+                index = self._unedited.popleft()
+                if index not in self.edited:
+                    self.edited[index] = datetime.now(timezone.utc)
+                    self._matches.clear()
+                    count -= 1
+
+
+class FakeJira(FakeCorpus):
+    """
+    Serves GET /search with `total` synthetic issues through the classic
+    startAt/maxResults API, page size capped at max_page like Jira Cloud.
+    Issues carry a description of about text_chars characters and, on
+    average, `images` image and `pdfs` PDF attachments served from
+    attachment_url. Issue i belongs to project i % projects (listed by GET
+    /project/search), and the JQL's project and relative `updated` clauses
+    are honoured. See FakeCorpus for spacing and edit_every.
+    """
+
+    def __init__(self, total, max_page=100, latency=0.0, throttle_every=0, text_chars=200,
+                 images=0.0, pdfs=0.0, attachment_url=None, projects=1, spacing=1.0, epoch=EPOCH, edit_every=0):
+        super().__init__(total, latency, throttle_every, spacing, epoch, edit_every)
+        self.max_page = max_page
+        self.text_chars = text_chars
+        self.images = images
+        self.pdfs = pdfs
+        self.attachment_url = attachment_url
+        self.projects = ["OPS"] if projects == 1 else [f"P{p}" for p in range(projects)]
+
+    def project(self, index):
+        return self.projects[index % len(self.projects)]
+
+    def attachments(self, index):
+        key = f"{self.project(index)}-{index + 1}"
+        attachments = [{"id": f"{10000 + index}{n:02}", "mimeType": "image/png",
+                        "content": f"{self.attachment_url}/attachments/{key}-{n}.png"}
+                       for n in range(attachment_count(index, self.images))]
+        attachments += [{"id": f"{10000 + index}{50 + n:02}", "mimeType": "application/pdf",
+                         "content": f"{self.attachment_url}/attachments/{key}-{n}.pdf"}
+                        for n in range(attachment_count(index, self.pdfs))]
+        return attachments
+
+    def issue(self, index):
+        return {
+            "id": str(10000 + index),
+            "key": f"{self.project(index)}-{index + 1}",
+            "fields": {
+                "summary": f"Synthetic issue {index + 1}",
+                "updated": self.updated(index).strftime("%Y-%m-%dT%H:%M:%S.000+0000"),
+                "description": {
+                    "type": "doc",
+                    "version": 1,
+                    "content": [{"type": "paragraph", "content": [{"type": "text", "text": prose(index, self.text_chars)}]}],
+                },
+                "attachment": self.attachments(index),
+            },
+        }
+
+    def handle(self, method, path, query, body, headers):
+        self.requests += 1
+        if path.endswith("/project/search"):
+            start = int(query.get("startAt", 0))
+            values = self.projects[start:start + int(query.get("maxResults", 50))]
+            return 200, {}, {"values": [{"key": key} for key in values],
+                             "isLast": start + len(values) >= len(self.projects)}
+        if not path.endswith("/search"):
+            return 404, {}, b""
+        matches = self.matches(query.get("jql", ""), self.project)
+        size = min(int(query.get("maxResults", 50)), self.max_page)
+        start = int(query.get("startAt", 0))
+        end = min(start + size, len(matches))
+        page = {"issues": [self.issue(i) for i in matches[start:end]]}
+        self.serve(matches, start, end)
+        page.update({"startAt": start, "maxResults": size, "total": len(matches)})
+        return 200, {}, page
+
+
+EXCLUDED_IDS_CLAUSE = re.compile(r"\bid not in \(([^)]*)\)")
+
+
+class FakeConfluence(FakeCorpus):
+    """
+    Serves GET /rest/api/content/search with `total` synthetic pages, paged
+    through relative `_links.next` URLs like Confluence Cloud. Pages carry a
+    storage-format body of about text_chars characters and, on average,
+    `images` image and `pdfs` PDF attachments with relative download links;
+    /attachments/... requests are passed on to the `attachments` store, so
+    links resolve against the Confluence base URL as they do in production.
+    Page i belongs to space i % spaces (listed by GET /rest/api/space), and
+    the CQL's space, `id not in` and relative `lastmodified` clauses are
+    honoured. See FakeCorpus for spacing and edit_every.
+    """
+
+    def __init__(self, total, latency=0.0, throttle_every=0, text_chars=2000, images=0.0, pdfs=0.0, attachments=None,
+                 spaces=1, spacing=1.0, epoch=EPOCH, edit_every=0):
+        super().__init__(total, latency, throttle_every, spacing, epoch, edit_every)
+        self.text_chars = text_chars
+        self.images = images
+        self.pdfs = pdfs
+        self.attachments = attachments
+        self.spaces = ["DOCS"] if spaces == 1 else [f"S{s}" for s in range(spaces)]
+
+    def space(self, index):
+        return self.spaces[index % len(self.spaces)]
+
+    def page_matches(self, cql):
+        matches = self.matches(cql, self.space)
+        excluded = EXCLUDED_IDS_CLAUSE.search(cql)
+        if excluded:
+            ids = {int(value) - 200000 for value in excluded.group(1).split(",") if value.strip()}
+            matches = [i for i in matches if i not in ids]
+        return matches
+
+    def attachment(self, index, n, extension, media_type):
+        return {"id": f"att{index}{extension}{n}", "title": f"page-{index}-{n}.{extension}",
+                "version": {"number": 1}, "metadata": {"mediaType": media_type},
+                "_links": {"download": f"/attachments/page-{index}-{n}.{extension}"}}
+
+    def page(self, index):
+        paragraphs = "".join(f"<p>{prose(index + n, 400)}</p>" for n in range(max(1, self.text_chars // 400)))
+        attachments = [self.attachment(index, n, "png", "image/png") for n in range(attachment_count(index, self.images))]
+        attachments += [self.attachment(index, n, "pdf", "application/pdf") for n in range(attachment_count(index, self.pdfs))]
+        return {
+            "id": str(200000 + index),
+            "type": "page",
+            "title": f"Runbook {index + 1}",
+            "space": {"key": self.space(index)},
+            "version": {"number": 2 if index in self.edited else 1, "when": self.updated(index).isoformat().replace("+00:00", "Z")},
+            "body": {"storage": {"value": f"<h2>Runbook {index + 1}</h2>{paragraphs}", "representation": "storage"}},
+            "children": {"attachment": {"results": attachments, "size": len(attachments)}},
+        }
+
+    def handle(self, method, path, query, body, headers):
+        if path.startswith("/attachments/") and self.attachments is not None:
+            return self.attachments.handle(method, path, query, body, headers)
+        self.requests += 1
+        if path.endswith("/rest/api/space"):
+            start = int(query.get("start", 0))
+            limit = int(query.get("limit", 25))
+            results = [{"key": key} for key in self.spaces[start:start + limit]]
+            links = {}
+            if start + limit < len(self.spaces):
+                links["next"] = "/rest/api/space?" + urlencode({"limit": limit, "start": start + limit})
+            return 200, {}, {"results": results, "start": start, "limit": limit, "size": len(results), "_links": links}
+        if not path.endswith("/rest/api/content/search"):
+            return 404, {}, b""
+        matches = self.page_matches(query.get("cql", ""))
+        start = int(query.get("cursor", 0))
+        limit = int(query.get("limit", 25))
+        end = min(start + limit, len(matches))
+        links = {}
+        if end < len(matches):
+            links["next"] = "/rest/api/content/search?" + urlencode(
+                {"cql": query.get("cql", ""), "limit": limit, "expand": query.get("expand", ""), "cursor": end})
+        results = [self.page(i) for i in matches[start:end]]
+        self.serve(matches, start, end)
+        return 200, {}, {"results": results, "start": start, "limit": limit, "size": end - start, "_links": links}
+
+
+class FakeCosmosAccount(FakeService):
+    """Answers the database-account probe CosmosClient makes when it is constructed."""
+
+    def handle(self, method, path, query, body, headers):
+        self.requests += 1
+        endpoint = self.url + "/"
+        location = [{"name": "local", "databaseAccountEndpoint": endpoint}]
+        return 200, {}, {
+            "id": "fake",
+            "_self": "",
+            "writableLocations": location,
+            "readableLocations": location,
+            "enableMultipleWriteLocations": False,
+            "userConsistencyPolicy": {"defaultConsistencyLevel": "Session"},
+        }
+
+
+def png_bytes(width, height, noise=False):
+    """A valid RGB PNG: a horizontal gradient (compresses like a screenshot) or random noise (like a photo)."""
+    if noise:
+        raw = b"".join(b"\x00" + os.urandom(width * 3) for _ in range(height))
+    else:
+        raw = (b"\x00" + bytes(i * 255 // max(width * 3 - 1, 1) for i in range(width * 3))) * height
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+def pdf_bytes(pages):
+    """A minimal valid PDF with the given number of blank pages and an uncompressed page tree."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (3 + i) for i in range(pages)) + b"] /Count %d >>" % pages]
+    objects += [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>"] * pages
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class FakeAttachmentStore(FakeService):
+    """
+    Serves GET /attachments/<name>. files maps a name to (content type, body);
+    any other name gets a `pdf_pages`-page PDF (*.pdf) or a small 800x600 PNG.
+    """
+
+    def __init__(self, files=None, latency=0.0, pdf_pages=2):
+        super().__init__(latency)
+        self.files = files or {}
+        self.default = ("image/png", png_bytes(800, 600))
+        self.default_pdf = ("application/pdf", pdf_bytes(pdf_pages))
+        self.bytes_served = 0
+
+    def handle(self, method, path, query, body, headers):
+        self.requests += 1
+        if not path.startswith("/attachments/"):
+            return 404, {}, b""
+        name = path[len("/attachments/"):]
+        content_type, payload = self.files.get(name, self.default_pdf if name.endswith(".pdf") else self.default)
+        self.bytes_served += len(payload)
+        return 200, {"Content-Type": content_type}, payload
+
+
+class FakeVision(FakeService):
+    """Answers Image Analysis 4.0 `imageanalysis:analyze` calls with a fixed set of tags."""
+
+    def handle(self, method, path, query, body, headers):
+        self.requests += 1
+        if not path.endswith("imageanalysis:analyze"):
+            return 404, {}, b""
+        return 200, {}, {
+            "modelVersion": "2023-10-01",
+            "metadata": {"width": 800, "height": 600},
+            "tagsResult": {"values": [{"name": "screenshot", "confidence": 0.98}, {"name": "text", "confidence": 0.95}]},
+        }
+
+
+class FakeDocumentIntelligence(FakeService):
+    """
+    Mimics the prebuilt-layout long-running operation: POST returns 202 with an
+    Operation-Location, and polling it returns the finished result. `latency`
+    applies to every request, so each analysis costs at least two round trips.
+
+    PDFs sent as bytes (or base64Source) are "read": the result has one line
+    per analysed page ("Text of page N."), honouring the `pages` option, and
+    only becomes ready seconds_per_page x pages after the POST, like the real
+    service's processing time. Polls while running wait briefly and answer
+    "running". url_source requests get a single placeholder line.
+    """
+
+    def __init__(self, latency=0.0, seconds_per_page=0.0, throttle_every=0):
+        super().__init__(latency, throttle_every)
+        self.seconds_per_page = seconds_per_page
+        self.pages_analysed = 0
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    @staticmethod
+    def selected_pages(spec, total):
+        if not spec:
+            return list(range(1, total + 1))
+        pages = []
+        for part in spec.split(","):
+            first, _, last = part.partition("-")
+            pages.extend(range(int(first), min(int(last or first), total) + 1))
+        return pages
+
+    def document_pages(self, body):
+        if body[:1] == b"{":
+            source = json.loads(body).get("base64Source")
+            if not source:
+                return None
+            body = base64.b64decode(source)
+        return len(re.findall(rb"/Type\s*/Page\b", body))
+
+    def handle(self, method, path, query, body, headers):
+        self.requests += 1
+        if method == "POST" and path.endswith(":analyze"):
+            total = self.document_pages(body)
+            pages = self.selected_pages(query.get("pages"), total) if total is not None else None
+            with self._lock:
+                operation_id = str(len(self._operations) + 1)
+                self._operations[operation_id] = {
+                    "pages": pages,
+                    "ready": time.monotonic() + self.seconds_per_page * len(pages or [1]),
+                }
+                self.pages_analysed += len(pages or [1])
+            location = f"{self.url}/documentintelligence/documentModels/prebuilt-layout/analyzeResults/{operation_id}?api-version={query.get('api-version', '')}"
+            return 202, {"Operation-Location": location, "Retry-After": "0"}, b""
+        if method == "GET" and "/analyzeResults/" in path:
+            operation_id = path.rsplit("/", 1)[-1]
+            with self._lock:
+                operation = self._operations.get(operation_id)
+            if operation is None:
+                return 404, {}, b""
+            remaining = operation["ready"] - time.monotonic()
+            if remaining > 0:
+                time.sleep(min(remaining, 0.05))
+                if operation["ready"] > time.monotonic():
+                    return 200, {"Retry-After": "0"}, {"status": "running"}
+            if operation["pages"] is None:
+                content, pages = f"Extracted text for operation {operation_id}", []
+            else:
+                content = "\n".join(f"Text of page {page}." for page in operation["pages"])
+                pages = [{"pageNumber": page} for page in operation["pages"]]
+            return 200, {}, {
+                "status": "succeeded",
+                "analyzeResult": {"apiVersion": query.get("api-version", ""), "modelId": "prebuilt-layout",
+                                  "content": content, "pages": pages},
+            }
+        return 404, {}, b""
+
+
+def import_fetch_data(path=FETCH_DATA_DIR, **env):
+    """Import fetch_data.py from path (the working tree by default) with the given environment variables applied."""
+    defaults = {
+        "JIRA_API_USERNAME": "bench",
+        "JIRA_API_TOKEN": "bench",
+        "CONFLUENCE_API_USERNAME": "bench",
+        "CONFLUENCE_API_TOKEN": "bench",
+        "COSMOSDB_KEY": "YmVuY2g=",
+        "COSMOSDB_DATABASE": "bench",
+        "COSMOSDB_CONTAINER": "bench",
+        "AZURE_VISION_ENDPOINT": "http://127.0.0.1:9",
+        "AZURE_VISION_KEY": "bench",
+        "AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT": "http://127.0.0.1:9",
+        "AZURE_DOCUMENT_INTELLIGENCE_KEY": "bench",
+        "ANALYSIS_CACHE_BACKEND": "none",
+        "WORK_QUEUE_BACKEND": "none",
+    }
+    for name, value in {**defaults, **env}.items():
+        os.environ[name] = str(value)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    import fetch_data
+    return fetch_data
@@ -0,0 +1,363 @@
+"""
+In-memory stand-in for the Cosmos DB containers the sync and flatten
+functions use.
+
+Implements just the container surface the code calls: point reads, create,
+replace (with etag checks), upsert, transactional batches, the handful of
+query shapes used (SELECT * / projections, ARRAY_CONTAINS and equality
+filters joined by AND), paged queries and the change feed. Items are kept
+as JSON strings, so every read returns a fresh copy like the real service.
+
+Each operation reports a simulated request charge through response_hook and
+the x-ms-request-charge header, using rough published figures (1 RU per KB
+point read, ~5.5 RU per KB write, 2.5 RU plus 1 RU per KB returned for
+queries and change feed pages). They are for comparing runs, not billing.
+With throttle_every=N, every Nth operation on a container fails with 429 and
+an x-ms-retry-after-ms hint.
+
+As with the SDK, where last_response_headers belongs to the client
+connection, the containers of one account share a single connection whose
+headers every operation overwrites.
+"""
+import json
+import re
+import threading
+import time
+
+from azure.cosmos.exceptions import (CosmosAccessConditionFailedError, CosmosHttpResponseError,
+                                     CosmosResourceExistsError, CosmosResourceNotFoundError)
+
+WRITE_RU_PER_KB = 5.5
+READ_RU_PER_KB = 1.0
+QUERY_RU_BASE = 2.5
+
+_SELECT = re.compile(r"^\s*SELECT\s+(?P<fields>.+?)\s+FROM\s+c(?:\s+WHERE\s+(?P<where>.+?))?\s*$", re.I | re.S)
+_ARRAY_CONTAINS = re.compile(r"^ARRAY_CONTAINS\(\s*(@\w+)\s*,\s*c\.(\w+)\s*\)$", re.I)
+_EQUALS = re.compile(r"^c\.(\w+)\s*=\s*(.+)$")
+_AND = re.compile(r"\s+AND\s+", re.I)
+
+
+class ContainerStats:
+    """Operation counts, request charge and latency samples of one container."""
+
+    def __init__(self):
+        self.operations = {}
+        self.request_charge = 0.0
+        self.throttled = 0
+        self.latencies = []
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _Connection:
+    """Holds the headers of the account's latest response, like the SDK's CosmosClientConnection."""
+
+    def __init__(self):
+        self.last_response_headers = {}
+
+
+class _Pager:
+    """Iterates items and, via by_page(), pages carrying a continuation_token, like azure.core's ItemPaged."""
+
+    def __init__(self, fetch_page, continuation=None):
+        self._fetch_page = fetch_page
+        self._continuation = continuation
+
+    def __iter__(self):
+        for page in self.by_page(self._continuation):
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return _PageIterator(self._fetch_page, continuation_token if continuation_token is not None else self._continuation)
+
+
+class _PageIterator:
+    def __init__(self, fetch_page, continuation):
+        self._fetch_page = fetch_page
+        self.continuation_token = continuation
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        items, continuation = self._fetch_page(self.continuation_token)
+        # An empty page ends iteration and, as in the SDK, leaves the token of the last page
+        if not items:
+            self._done = True
+            raise StopIteration
+        self.continuation_token = continuation
+        self._done = continuation is None
+        return iter(items)
+
+
+class MemoryContainer:
+    def __init__(self, name, partition_key="/id", latency=0.0, throttle_every=0, connection=None):
+        self.id = name
+        self.partition_key = [part for part in partition_key.split("/") if part]
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.stats = ContainerStats()
+        self.client_connection = connection or _Connection()
+        # (id, partition key) -> (JSON text, parsed item); the parsed copy is only
+        # read for filtering, callers always get a fresh copy of the text
+        self._items = {}
+        self._by_id = {}
+        self._lsn = 0
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def partition_key_of(self, body):
+        value = body
+        for part in self.partition_key:
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def documents(self):
+        """Every stored item (with system properties), for assertions."""
+        with self._lock:
+            return [json.loads(data) for data, _ in self._items.values()]
+
+    # Charges, latency and throttling common to every operation
+    def _operation(self, kind, charge, response_hook=None, result=None):
+        with self._lock:
+            self._calls += 1
+            throttled = self.throttle_every and self._calls % self.throttle_every == 0
+            self.stats.operations[kind] = self.stats.operations.get(kind, 0) + 1
+            if throttled:
+                self.stats.throttled += 1
+            else:
+                self.stats.request_charge += charge
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            raise _throttled_error()
+        headers = {"x-ms-request-charge": f"{charge:.2f}"}
+        self.client_connection.last_response_headers = headers
+        if response_hook is not None:
+            response_hook(headers, result)
+        return headers
+
+    def _timed(self, started):
+        with self._lock:
+            self.stats.latencies.append(time.perf_counter() - started)
+
+    def _store(self, body):
+        """Stamps system properties and stores body; returns (stored copy, size in bytes). Caller holds the lock."""
+        self._lsn += 1
+        item = {k: v for k, v in body.items() if not k.startswith("_")}
+        item.update(_lsn=self._lsn, _etag=f'"{self._lsn}"', _ts=int(time.time()))
+        data = json.dumps(item, default=str)
+        key = self._key(item)
+        self._items[key] = (data, json.loads(data))
+        self._by_id.setdefault(key[0], set()).add(key)
+        return json.loads(data), len(data)
+
+    def _key(self, body):
+        return body.get("id"), json.dumps(self.partition_key_of(body), default=str)
+
+    def read_item(self, item, partition_key, **kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            data, _ = self._items.get((item, json.dumps(partition_key, default=str)), (None, None))
+        self._operation("read", READ_RU_PER_KB * max(1.0, len(data or "") / 1024), kwargs.get("response_hook"))
+        self._timed(started)
+        if data is None:
+            raise CosmosResourceNotFoundError(status_code=404, message=f"{self.id}/{item} not found")
+        return json.loads(data)
+
+    def create_item(self, body, **kwargs):
+        started = time.perf_counter()
+        size = len(json.dumps(body, default=str))
+        self._operation("create", WRITE_RU_PER_KB * max(1.0, size / 1024), kwargs.get("response_hook"))
+        with self._lock:
+            if self._key(body) in self._items:
+                raise CosmosResourceExistsError(status_code=409, message=f"{self.id}/{body.get('id')} already exists")
+            stored, _ = self._store(body)
+        self._timed(started)
+        return stored
+
+    def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        started = time.perf_counter()
+        size = len(json.dumps(body, default=str))
+        self._operation("replace", WRITE_RU_PER_KB * max(1.0, size / 1024), kwargs.get("response_hook"))
+        with self._lock:
+            current = self._items.get(self._key(body))
+            if current is None:
+                raise CosmosResourceNotFoundError(status_code=404, message=f"{self.id}/{item} not found")
+            if etag is not None and current[1]["_etag"] != etag:
+                raise CosmosAccessConditionFailedError(status_code=412, message=f"{self.id}/{item} was modified")
+            stored, _ = self._store(body)
+        self._timed(started)
+        return stored
+
+    def upsert_item(self, body, **kwargs):
+        started = time.perf_counter()
+        size = len(json.dumps(body, default=str))
+        self._operation("upsert", WRITE_RU_PER_KB * max(1.0, size / 1024), kwargs.get("response_hook"))
+        with self._lock:
+            stored, _ = self._store(body)
+        self._timed(started)
+        return stored
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        started = time.perf_counter()
+        bodies = []
+        for operation, args in batch_operations:
+            if operation != "upsert":
+                raise NotImplementedError(f"MemoryContainer batches only support upsert, not {operation}")
+            bodies.append(args[0])
+        charge = sum(WRITE_RU_PER_KB * max(1.0, len(json.dumps(body, default=str)) / 1024) for body in bodies)
+        self._operation("batch", charge, kwargs.get("response_hook"))
+        with self._lock:
+            results = [{"statusCode": 200, "resourceBody": self._store(body)[0]} for body in bodies]
+        self._timed(started)
+        return results
+
+    def query_items(self, query, parameters=None, max_item_count=None, **kwargs):
+        fields, conditions, ids = _parse_query(query, {p["name"]: p["value"] for p in parameters or []})
+        page_size = max_item_count or 1000
+
+        # Continuation is the last (id, partition key) returned, in key order
+        def fetch_page(continuation):
+            started = time.perf_counter()
+            after = tuple(json.loads(continuation)) if continuation else None
+            with self._lock:
+                if ids is not None:
+                    candidates = (key for i in ids for key in self._by_id.get(i, ()))
+                else:
+                    candidates = self._items
+                keys = sorted(key for key in candidates if after is None or key > after)
+                page, last = [], None
+                for key in keys:
+                    data, item = self._items[key]
+                    if all(condition(item) for condition in conditions):
+                        page.append(json.loads(data) if fields is None else {f: item[f] for f in fields if f in item})
+                        last = key
+                        if len(page) >= page_size:
+                            break
+            size = sum(len(json.dumps(item, default=str)) for item in page)
+            self._operation("query", QUERY_RU_BASE + READ_RU_PER_KB * size / 1024)
+            self._timed(started)
+            full = len(page) >= page_size and last != keys[-1]
+            return page, json.dumps(last) if full else None
+
+        return _Pager(fetch_page)
+
+    def query_items_change_feed(self, start_time=None, continuation=None, max_item_count=None, **kwargs):
+        page_size = max_item_count or 1000
+        if continuation is not None:
+            first = int(continuation)
+        elif start_time == "Now":
+            first = self._lsn
+        else:
+            first = 0
+
+        # Latest version of every item changed after the continuation, in change order
+        def fetch_page(after):
+            started = time.perf_counter()
+            after = first if after is None else int(after)
+            with self._lock:
+                changed = sorted((item for _, item in self._items.values() if item["_lsn"] > after),
+                                 key=lambda item: item["_lsn"])
+                page = [json.loads(self._items[self._key(item)][0]) for item in changed[:page_size]]
+            last = page[-1]["_lsn"] if page else after
+            headers = self._operation(
+                "changefeed", QUERY_RU_BASE + READ_RU_PER_KB * sum(len(json.dumps(item)) for item in page) / 1024)
+            self.client_connection.last_response_headers = {**headers, "etag": str(last)}
+            self._timed(started)
+            # The change feed has no last page: iteration ends on an empty one
+            return page, str(last)
+
+        return _Pager(fetch_page)
+
+
+class MemoryDatabase:
+    """Containers created on first use; partition_keys maps a container name to its partition key path."""
+
+    def __init__(self, name, partition_keys=None, latency=0.0, throttle_every=0, connection=None):
+        self.id = name
+        self.partition_keys = partition_keys or {}
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.connection = connection or _Connection()
+        self.containers = {}
+        self._lock = threading.Lock()
+
+    def get_container_client(self, name):
+        with self._lock:
+            if name not in self.containers:
+                self.containers[name] = MemoryContainer(name, self.partition_keys.get(name, "/id"), self.latency,
+                                                        self.throttle_every, self.connection)
+            return self.containers[name]
+
+
+class MemoryCosmosAccount:
+    """
+    Holds the databases of one fake account. client() has CosmosClient's
+    signature, so it can replace the CosmosClient a module imported.
+    """
+
+    def __init__(self, partition_keys=None, latency=0.0, throttle_every=0):
+        self.partition_keys = partition_keys or {}
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.connection = _Connection()
+        self.databases = {}
+
+    def client(self, url=None, credential=None, **kwargs):
+        return self
+
+    def get_database_client(self, name):
+        if name not in self.databases:
+            self.databases[name] = MemoryDatabase(name, self.partition_keys, self.latency, self.throttle_every,
+                                                  self.connection)
+        return self.databases[name]
+
+    def containers(self):
+        return [container for database in self.databases.values() for container in database.containers.values()]
+
+
+def _throttled_error():
+    error = CosmosHttpResponseError(status_code=429, message="Request rate is large")
+    error.headers = {"x-ms-retry-after-ms": "1"}
+    return error
+
+
+# Function to turn one of the supported query shapes into (projected fields or
+# None for *, [predicate(item)...], ids the item must be one of or None)
+def _parse_query(query, parameters):
+    match = _SELECT.match(query)
+    if match is None:
+        raise NotImplementedError(f"MemoryContainer does not support query: {query}")
+    fields = match.group("fields").strip()
+    fields = None if fields == "*" else [field.strip()[2:] for field in fields.split(",")]
+    conditions = []
+    ids = None
+    for clause in _AND.split(match.group("where") or ""):
+        clause = clause.strip()
+        if not clause:
+            continue
+        contains = _ARRAY_CONTAINS.match(clause)
+        equals = _EQUALS.match(clause)
+        if contains:
+            values = set(parameters[contains.group(1)])
+            if contains.group(2) == "id":
+                ids = values
+            conditions.append(lambda item, field=contains.group(2), values=values: item.get(field) in values)
+        elif equals:
+            value = equals.group(2).strip()
+            value = parameters[value] if value.startswith("@") else json.loads(value.replace("'", '"'))
+            conditions.append(lambda item, field=equals.group(1), value=value: field in item and item[field] == value)
+        else:
+            raise NotImplementedError(f"MemoryContainer does not support condition: {clause}")
+    return fields, conditions, ids
@@ -0,0 +1,128 @@
+"""
+Token-bounded chunking of flattened documents for the search index.
+
+chunk_text splits a long text into overlapping windows of at most
+CHUNK_MAX_TOKENS tokens, preferring to cut at a paragraph break, then a
+line break, then a sentence end in the second half of each window. Tokens
+are approximated with a regex (words of up to 8 characters, single
+punctuation marks), which over-counts slightly against BPE tokenizers for
+English text and keeps chunks safely under embedding model limits. The
+work is linear in the text length: token and break offsets are collected
+in one regex pass each (token offsets as running sums of piece lengths,
+without a Match object per token) and windows are cut with binary searches.
+
+build_chunks turns one flattened document into chunk documents with stable
+ids ("<parent id>-<field>-<n>"), each carrying the parent's text hash so a
+later run can tell whether the parent needs re-chunking.
+"""
+import os
+import re
+import hashlib
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+CHUNK_FIELDS = [field.strip() for field in os.getenv("CHUNK_FIELDS", "description,content,pdf_text").split(",") if field.strip()]
+
+# Parent fields copied onto every chunk so a search hit can be shown without a lookup
+CHUNK_CONTEXT_FIELDS = ("key", "title", "summary")
+
+_TOKEN = re.compile(r"\w{1,8}|[^\w\s]")
+# A token with its leading whitespace; the pieces of a text concatenate back to it
+_PIECE = re.compile(r"\s*(?:\w{1,8}|[^\w\s])")
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+_LINE_BREAK = re.compile(r"\n")
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*(?=\s)")
+
+
+def count_tokens(text):
+    return len(_TOKEN.findall(text))
+
+
+def _break_offsets(pattern, text, end):
+    # Character offsets inside the whitespace after a break; the piece holding
+    # an offset is where the next chunk may start
+    return [m.end() if end else m.start() for m in pattern.finditer(text)]
+
+
+def chunk_text(text, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Returns the text split into overlapping chunks of at most max_tokens tokens."""
+    if not isinstance(text, str) or not text.strip():
+        return []
+    max_tokens = max(2, max_tokens)
+    # Overlap is capped so every window still advances by at least a quarter
+    overlap = max(0, min(overlap, max_tokens // 4))
+    # bounds[i] is where piece i starts; bounds[-1] is the end of the last token
+    bounds = list(accumulate(map(len, _PIECE.findall(text)), initial=0))
+    total = len(bounds) - 1
+    if total <= max_tokens:
+        return [text.strip()]
+    breaks = [_break_offsets(_PARAGRAPH_BREAK, text, False), _break_offsets(_LINE_BREAK, text, False),
+              _break_offsets(_SENTENCE_END, text, True)]
+
+    chunks = []
+    start = 0
+    while start < total:
+        end = min(start + max_tokens, total)
+        if end < total:
+            # Cut at the strongest break in the second half of the window
+            low, high = bounds[start + max_tokens // 2], bounds[end + 1]
+            for offsets in breaks:
+                i = bisect_left(offsets, high) - 1
+                if i >= 0 and offsets[i] > low:
+                    end = bisect_right(bounds, offsets[i]) - 1
+                    break
+        chunks.append(text[bounds[start]:bounds[end]].strip())
+        if end >= total:
+            break
+        start = max(end - overlap, start + 1)
+        # Begin the overlap at a sentence or line start when one falls inside it
+        low, high = bounds[start], bounds[end]
+        candidates = [offsets[i] for offsets in breaks for i in (bisect_left(offsets, low),)
+                      if i < len(offsets) and offsets[i] < high]
+        if candidates:
+            start = bisect_right(bounds, min(candidates)) - 1
+    return chunks
+
+
+# Function to hash the chunkable text of a document. The chunking settings
+# are part of the hash so changing them re-chunks everything.
+def chunk_text_hash(doc, fields=CHUNK_FIELDS, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    digest = hashlib.sha256(f"{max_tokens}:{overlap}".encode("utf-8"))
+    for field in fields:
+        value = doc.get(field)
+        if isinstance(value, str):
+            digest.update(f"\0{field}\0".encode("utf-8"))
+            digest.update(value.encode("utf-8", "replace"))
+    return digest.hexdigest()
+
+
+def build_chunks(doc, text_hash=None, fields=CHUNK_FIELDS, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Returns the chunk documents of one flattened document, partitioned by parent_id."""
+    parent_id = doc.get("id")
+    if parent_id is None:
+        return []
+    if text_hash is None:
+        text_hash = chunk_text_hash(doc, fields, max_tokens, overlap)
+    context = {field: doc[field] for field in CHUNK_CONTEXT_FIELDS if isinstance(doc.get(field), str)}
+    chunks = []
+    for field in fields:
+        pieces = chunk_text(doc.get(field), max_tokens, overlap)
+        for index, piece in enumerate(pieces):
+            chunks.append({
+                "id": f"{parent_id}-{field}-{index}",
+                "parent_id": parent_id,
+                "type": "chunk",
+                "field": field,
+                "chunk_index": index,
+                "chunk_count": len(pieces),
+                "text": piece,
+                "text_hash": text_hash,
+                "is_deleted": False,
+                **context,
+            })
+    # Lets a sync tell a parent whose chunks were all written from one missing some
+    for chunk in chunks:
+        chunk["chunk_total"] = len(chunks)
+    return chunks
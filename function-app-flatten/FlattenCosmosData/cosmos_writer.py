@@ -0,0 +1,285 @@
+"""
+Batched, throttling-aware Cosmos DB writer.
+
+Records are grouped into chunks; within a chunk, records that share a
+partition key are written as one transactional batch and the rest as single
+upserts, all on a bounded thread pool. Throttled (429) and transient
+failures are retried after the server's x-ms-retry-after-ms hint, or with
+jittered exponential backoff when there is none. Records that still fail
+are appended to a dead-letter JSON Lines file instead of being dropped.
+
+With a ContentHashIndex, every record is stamped with a canonical content
+hash and skipped when the stored copy already carries the same hash, so
+steady-state runs that re-fetch unchanged data cost almost no writes.
+
+Given a RunMetrics (metrics.py), every write request is recorded as a
+"<metrics_name>.write" span, and the request charge and written/unchanged
+records as counters.
+
+This module is shared by the fetch_data and FlattenCosmosData functions.
+Each function folder is deployed as its own package, so keep both copies
+identical.
+"""
+import os
+import json
+import time
+import hashlib
+import random
+import logging
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosHttpResponseError
+
+COSMOS_WRITE_BATCH = int(os.getenv("COSMOS_WRITE_BATCH", "100"))
+COSMOS_WRITE_CONCURRENCY = int(os.getenv("COSMOS_WRITE_CONCURRENCY", "8"))
+COSMOS_WRITE_RETRIES = int(os.getenv("COSMOS_WRITE_RETRIES", "6"))
+COSMOS_PARTITION_KEY = os.getenv("COSMOS_PARTITION_KEY", "/id")
+COSMOS_DEAD_LETTER_PATH = os.getenv("COSMOS_DEAD_LETTER_PATH", os.path.join(tempfile.gettempdir(), "cosmos-dead-letter.jsonl"))
+
+CONTENT_HASH_INDEX_MAX = int(os.getenv("CONTENT_HASH_INDEX_MAX", "200000"))
+
+RETRYABLE_STATUS = {408, 429, 449, 503}
+MAX_TRANSACTIONAL_BATCH = 100
+
+
+# Function to hash a record's content. Cosmos system properties (_rid, _etag,
+# _ts, ...) and the hash itself are left out so the value only changes when
+# the data does.
+def content_hash(record):
+    content = {k: v for k, v in record.items() if not k.startswith("_") and k != "content_hash"}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ContentHashIndex:
+    """
+    id -> content hash of what is stored in a container. Misses are filled
+    with one query per chunk of ids against the stored documents' content_hash
+    field; entries stay in memory across warm invocations.
+    """
+
+    def __init__(self, container, max_entries=CONTENT_HASH_INDEX_MAX):
+        self.container = container
+        self.max_entries = max_entries
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def load(self, ids):
+        missing = [i for i in ids if i is not None and i not in self._hashes]
+        if not missing:
+            return
+        found = {i: None for i in missing}
+        query = "SELECT c.id, c.content_hash FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+        for item in self.container.query_items(query=query, parameters=[{"name": "@ids", "value": missing}],
+                                               enable_cross_partition_query=True):
+            found[item["id"]] = item.get("content_hash")
+        with self._lock:
+            if len(self._hashes) + len(found) > self.max_entries:
+                self._hashes.clear()
+            self._hashes.update(found)
+
+    def get(self, record_id):
+        return self._hashes.get(record_id)
+
+    def set(self, record_id, value):
+        with self._lock:
+            self._hashes[record_id] = value
+
+
+class WriteStats:
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self.retries = 0
+        self.request_charge = 0.0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, written=0, skipped=0, failed=0, retries=0, request_charge=0.0):
+        with self._lock:
+            self.written += written
+            self.skipped += skipped
+            self.failed += failed
+            self.retries += retries
+            self.request_charge += request_charge
+
+    def __str__(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"{self.written} written, {self.skipped} unchanged, {self.failed} dead-lettered, {self.retries} retries, "
+                f"{self.request_charge:.1f} RU in {elapsed:.1f}s ({self.written / elapsed:.0f} docs/s)")
+
+
+class CosmosBatchWriter:
+    """
+    Writes an iterable of records to a container. on_written(record) is
+    called for every successfully written (or unchanged) record and
+    on_failed(record) for every dead-lettered one, both in input order, so
+    callers can checkpoint progress safely.
+    """
+
+    def __init__(self, container, partition_key=COSMOS_PARTITION_KEY, batch_size=COSMOS_WRITE_BATCH,
+                 concurrency=COSMOS_WRITE_CONCURRENCY, max_retries=COSMOS_WRITE_RETRIES,
+                 dead_letter_path=COSMOS_DEAD_LETTER_PATH, on_written=None, hash_index=None, metrics=None,
+                 metrics_name="cosmos", on_failed=None):
+        self.container = container
+        self.partition_key = [part for part in partition_key.split("/") if part]
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.hash_index = hash_index
+        self.metrics = metrics
+        self.metrics_name = metrics_name
+        self.stats = WriteStats()
+        self._dead_letter_lock = threading.Lock()
+
+    def partition_key_of(self, record):
+        value = record
+        for part in self.partition_key:
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def write_all(self, records):
+        """Write every record and return the run's WriteStats."""
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="cosmos-write") as pool:
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) >= self.batch_size:
+                    in_flight.append(self._submit_chunk(pool, chunk))
+                    chunk = []
+                    # Keep a couple of chunks queued behind the one being drained
+                    while len(in_flight) > 2:
+                        self._drain(in_flight.popleft())
+            if chunk:
+                in_flight.append(self._submit_chunk(pool, chunk))
+            while in_flight:
+                self._drain(in_flight.popleft())
+        return self.stats
+
+    def _submit_chunk(self, pool, chunk):
+        unchanged = set()
+        if self.hash_index is not None:
+            started = time.monotonic()
+            try:
+                self.hash_index.load([record.get("id") for record in chunk])
+            except Exception as e:
+                logging.warning(f"Content hash lookup failed, writing the whole chunk: {str(e)[:200]}")
+            if self.metrics is not None:
+                self.metrics.record(f"{self.metrics_name}.hash_lookup", time.monotonic() - started)
+            for index, record in enumerate(chunk):
+                record["content_hash"] = content_hash(record)
+                if record.get("id") is not None and self.hash_index.get(record["id"]) == record["content_hash"]:
+                    unchanged.add(index)
+            self.stats.add(skipped=len(unchanged))
+            if self.metrics is not None:
+                self.metrics.add(f"{self.metrics_name}.unchanged", len(unchanged))
+        groups = {}
+        for index, record in enumerate(chunk):
+            if index in unchanged:
+                continue
+            groups.setdefault(json.dumps(self.partition_key_of(record), default=str), []).append(index)
+        futures = []
+        for indexes in groups.values():
+            for start in range(0, len(indexes), MAX_TRANSACTIONAL_BATCH):
+                part = indexes[start:start + MAX_TRANSACTIONAL_BATCH]
+                futures.append((part, pool.submit(self._write_timed, [chunk[i] for i in part])))
+        return chunk, unchanged, futures
+
+    def _drain(self, submitted):
+        chunk, unchanged, futures = submitted
+        ok = [index in unchanged for index in range(len(chunk))]
+        charge = 0.0
+        for indexes, future in futures:
+            results, group_charge = future.result()
+            charge += group_charge
+            for index, written in zip(indexes, results):
+                ok[index] = written
+        logging.info(f"Cosmos chunk: {sum(ok) - len(unchanged)}/{len(chunk)} written, {len(unchanged)} unchanged, {charge:.1f} RU")
+        for record, written in zip(chunk, ok):
+            if written and self.on_written is not None:
+                self.on_written(record)
+            elif not written and self.on_failed is not None:
+                self.on_failed(record)
+
+    def _write_timed(self, group):
+        started = time.monotonic()
+        results, charge = self._write_group(group)
+        if self.metrics is not None:
+            self.metrics.record(f"{self.metrics_name}.write", time.monotonic() - started, error=not all(results))
+            self.metrics.add(f"{self.metrics_name}.written", sum(results))
+            self.metrics.add(f"{self.metrics_name}.request_charge", charge)
+        return results, charge
+
+    def _write_group(self, group):
+        """Write records sharing one partition key; returns ([written?...], request charge)."""
+        if len(group) == 1:
+            written, charge = self._upsert(group[0])
+            return [written], charge
+        operations = [("upsert", (record,)) for record in group]
+        charges = []
+        try:
+            self._with_retries(lambda hook: self.container.execute_item_batch(
+                batch_operations=operations, partition_key=self.partition_key_of(group[0]), response_hook=hook), charges)
+            self.stats.add(written=len(group), request_charge=sum(charges))
+            for record in group:
+                self._remember(record)
+            return [True] * len(group), sum(charges)
+        except (CosmosBatchOperationError, CosmosHttpResponseError) as e:
+            # The batch rolled back as a whole; write one by one to isolate the bad record
+            logging.warning(f"Transactional batch of {len(group)} failed, falling back to single upserts: {str(e)[:200]}")
+        results = [self._upsert(record) for record in group]
+        return [written for written, _ in results], sum(charges) + sum(charge for _, charge in results)
+
+    def _upsert(self, record):
+        charges = []
+        try:
+            self._with_retries(lambda hook: self.container.upsert_item(record, response_hook=hook), charges)
+        except Exception as e:
+            logging.error(f"Error inserting record {record.get('id')}: {str(e)[:500]}")
+            self._dead_letter(record, e)
+            self.stats.add(failed=1, request_charge=sum(charges))
+            return False, sum(charges)
+        self.stats.add(written=1, request_charge=sum(charges))
+        self._remember(record)
+        return True, sum(charges)
+
+    def _remember(self, record):
+        if self.hash_index is not None and record.get("id") is not None:
+            self.hash_index.set(record["id"], record.get("content_hash"))
+
+    def _with_retries(self, call, charges):
+        def hook(headers, *_):
+            charge = headers.get("x-ms-request-charge") if headers else None
+            if charge:
+                charges.append(float(charge))
+
+        attempt = 0
+        while True:
+            try:
+                return call(hook)
+            except CosmosHttpResponseError as e:
+                if e.status_code not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    raise
+                headers = getattr(e, "headers", None) or {}
+                retry_after_ms = headers.get("x-ms-retry-after-ms")
+                if retry_after_ms:
+                    delay = float(retry_after_ms) / 1000
+                else:
+                    delay = min(30.0, 0.1 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt += 1
+                self.stats.add(retries=1)
+                time.sleep(delay)
+
+    def _dead_letter(self, record, error):
+        line = json.dumps({"error": str(error)[:1000], "record": record}, default=str)
+        with self._dead_letter_lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
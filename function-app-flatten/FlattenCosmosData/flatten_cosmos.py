@@ -1,7 +1,39 @@
 import os
+import time
+import queue
 import logging
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
 import azure.functions as func
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from .cosmos_writer import ContentHashIndex, CosmosBatchWriter
+from .text_extract import adf_to_text, storage_to_text
+from .chunker import build_chunks, chunk_text_hash
+from .metrics import RunMetrics, profiled
+
+# "incremental" follows the source change feed; "full" re-flattens every document
+FLATTEN_MODE = os.getenv("FLATTEN_MODE", "incremental")
+FLATTEN_PAGE_SIZE = int(os.getenv("FLATTEN_PAGE_SIZE", "500"))
+FLATTEN_STATE_CONTAINER = os.getenv("FLATTEN_STATE_CONTAINER", "syncstate")
+FLATTEN_STATE_ID = "flatten-changefeed"
+FLATTEN_WORKERS = int(os.getenv("FLATTEN_WORKERS", str(os.cpu_count() or 1)))
+FLATTEN_QUEUE_PAGES = int(os.getenv("FLATTEN_QUEUE_PAGES", "4"))
+# Container (partition key /parent_id) receiving search chunks; empty disables chunking
+CHUNK_CONTAINER = os.getenv("CHUNK_CONTAINER", "chunks")
+CHUNK_TOMBSTONE_TTL = int(os.getenv("CHUNK_TOMBSTONE_TTL", "604800"))
+# Source container (partition key /parent_id) with the per-attachment analyses; empty skips the join
+ATTACHMENT_CONTAINER = os.getenv("ATTACHMENT_CONTAINER", "attachments")
+# Attachment ids per lookup query
+ATTACHMENT_LOOKUP_BATCH = 1000
+# Flattened field receiving the joined text of each kind of attachment
+ATTACHMENT_TEXT_FIELDS = {"image": "image_text", "pdf": "pdf_text"}
+
+# Timing spans and counters of the current run, for its run summary
+metrics = RunMetrics("flatten")
 
 def flatten_description(desc):
     """
@@ -17,25 +49,314 @@ def flatten_description(desc):
               {"type": "text", "text": "some text"}
             ]
           },
-          // possibly more blocks…
+          // headings, lists, tables, code blocks, panels, mentions...
         ]
       }
-    Returns a string with the concatenated text.
+    Returns a string with the document's text; see text_extract.adf_to_text
+    for the structure markers kept.
     """
     if not isinstance(desc, dict):
         return desc
     if desc.get("type") != "doc" or "content" not in desc:
         return ""
-    lines = []
-    for block in desc["content"]:
-        if block.get("type") == "paragraph" and "content" in block:
-            paragraph_texts = [inline.get("text", "") for inline in block["content"] if inline.get("type") == "text"]
-            if paragraph_texts:
-                lines.append(" ".join(paragraph_texts))
-    return "\n".join(lines)
+    return adf_to_text(desc)
+
+def flatten_document(doc):
+    """Promotes and flattens the searchable fields of one Jira issue or Confluence page in place."""
+    if "fields" in doc:
+        fields = doc["fields"]
+        # Promote Jira summary to top level if it exists
+        if "summary" in fields:
+            doc["summary"] = fields["summary"]
+        # Flatten Jira description and promote to top level
+        if "description" in fields:
+            flattened = flatten_description(fields["description"])
+            fields["description"] = flattened
+            doc["description"] = flattened
+
+    # Explicit handling for Confluence pages
+    if "title" in doc:
+        doc["title"] = doc["title"]
+    if "body" in doc and "storage" in doc["body"]:
+        doc["content"] = storage_to_text(doc["body"]["storage"]["value"])
+    return doc
+
+def load_flatten_state(state_container):
+    try:
+        return state_container.read_item(item=FLATTEN_STATE_ID, partition_key=FLATTEN_STATE_ID)
+    except CosmosResourceNotFoundError:
+        return {"id": FLATTEN_STATE_ID, "type": "flatten_state", "continuation": None}
+
+def save_flatten_state(state_container, state, continuation, rebuild=None):
+    """
+    Stores the change feed continuation and, during a full rebuild, its
+    progress; the etag check stops overlapping runs clobbering each other.
+    """
+    body = {"id": FLATTEN_STATE_ID, "type": "flatten_state", "continuation": continuation, "rebuild": rebuild,
+            "updated": datetime.now(timezone.utc).isoformat()}
+    if state.get("_etag"):
+        return state_container.replace_item(item=FLATTEN_STATE_ID, body=body, etag=state["_etag"],
+                                            match_condition=MatchConditions.IfNotModified)
+    return state_container.create_item(body=body)
+
+def change_feed_position(source_container):
+    """Returns a continuation token for the current end of the change feed."""
+    for _ in source_container.query_items_change_feed(start_time="Now"):
+        pass
+    return source_container.client_connection.last_response_headers.get("etag")
+
+def timed_pages(pages, span):
+    """Yields each page of an SDK page iterator as a list, recording the time spent reading it as `span`."""
+    pages = iter(pages)
+    while True:
+        started = time.monotonic()
+        try:
+            page = list(next(pages))
+        except StopIteration:
+            return
+        metrics.record(span, time.monotonic() - started)
+        metrics.add("flatten.documents_read", len(page))
+        yield page
+
+@metrics.timed("flatten.join_attachments")
+def join_attachment_analyses(attachment_container, docs):
+    """
+    Joins the attachment analyses referenced by a page of documents in one
+    batched lookup (split only beyond ATTACHMENT_LOOKUP_BATCH ids) and writes
+    their text to image_text / pdf_text, one titled section per attachment in
+    attachment order. Documents stored before analyses had their own
+    documents carry no attachment_refs and keep their fields as they are.
+    """
+    if attachment_container is None:
+        return
+    ids = sorted({ref["id"] for doc in docs for ref in doc.get("attachment_refs") or []})
+    found = {}
+    query = "SELECT c.id, c.parent_id, c.kind, c.title, c.text FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+    for start in range(0, len(ids), ATTACHMENT_LOOKUP_BATCH):
+        batch = ids[start:start + ATTACHMENT_LOOKUP_BATCH]
+        for item in attachment_container.query_items(query=query, parameters=[{"name": "@ids", "value": batch}],
+                                                     enable_cross_partition_query=True):
+            found[(item.get("parent_id"), item["id"])] = item
+    missing = 0
+    for doc in docs:
+        refs = doc.get("attachment_refs")
+        if refs is None:
+            continue
+        sections = {kind: [] for kind in ATTACHMENT_TEXT_FIELDS}
+        for ref in refs:
+            item = found.get((doc.get("id"), ref["id"]))
+            if item is None:
+                missing += 1
+                continue
+            text = item.get("text")
+            if text and item.get("kind") in sections:
+                # Image analyses are lists of Vision tags
+                text = ", ".join(text) if isinstance(text, list) else text
+                title = item.get("title")
+                sections[item["kind"]].append(f"{title}\n{text}" if title else text)
+        for kind, field in ATTACHMENT_TEXT_FIELDS.items():
+            doc[field] = "\n\n".join(sections[kind])
+    metrics.add("flatten.attachments_joined", len(found))
+    if missing:
+        metrics.add("flatten.attachments_missing", missing)
+        logging.warning(f"{missing} referenced attachment analyses not found")
+
+def chunk_writer_for(chunk_container):
+    if chunk_container is None:
+        return None
+    return CosmosBatchWriter(chunk_container, partition_key="/parent_id", metrics=metrics, metrics_name="chunks")
+
+@metrics.timed("chunks.sync_page")
+def sync_chunks(chunk_writer, docs):
+    """
+    Brings the search chunks of a page of flattened documents up to date.
+    Parents whose live chunks are all there (chunk_total of them) and
+    already carry the current text hash are skipped; the rest are re-chunked, and chunks that are no longer produced
+    are replaced by soft-delete tombstones (is_deleted, with a ttl) so the
+    search indexer drops them before Cosmos expires them.
+    """
+    if chunk_writer is None:
+        return
+    ids = [doc["id"] for doc in docs if doc.get("id") is not None]
+    if not ids:
+        return
+    existing = {}
+    query = "SELECT c.id, c.parent_id, c.text_hash, c.chunk_total FROM c WHERE ARRAY_CONTAINS(@ids, c.parent_id) AND c.is_deleted = false"
+    for item in chunk_writer.container.query_items(query=query, parameters=[{"name": "@ids", "value": ids}],
+                                                   enable_cross_partition_query=True):
+        existing.setdefault(item["parent_id"], []).append(item)
+
+    records = []
+    rechunked = 0
+    for doc in docs:
+        parent_id = doc.get("id")
+        if parent_id is None:
+            continue
+        stored = existing.get(parent_id, [])
+        text_hash = chunk_text_hash(doc)
+        # A chunk whose write failed is missing; chunks stored before chunk_total existed count as complete
+        if stored and all(chunk.get("text_hash") == text_hash and chunk.get("chunk_total", len(stored)) == len(stored)
+                          for chunk in stored):
+            continue
+        chunks = build_chunks(doc, text_hash)
+        if not chunks and not stored:
+            continue
+        rechunked += 1
+        records.extend(chunks)
+        live = {chunk["id"] for chunk in chunks}
+        records.extend({"id": chunk["id"], "parent_id": parent_id, "is_deleted": True, "ttl": CHUNK_TOMBSTONE_TTL}
+                       for chunk in stored if chunk["id"] not in live)
+    if records:
+        chunk_writer.write_all(records)
+    metrics.add("chunks.rechunked_documents", rechunked)
+    logging.info(f"Chunks: {rechunked}/{len(ids)} documents re-chunked, {len(records)} chunk writes.")
+
+def write_page(writer, chunk_writer, docs):
+    """
+    Writes a page of flattened documents and syncs their chunks. Raises when
+    any document or chunk was dead-lettered, so the caller does not record
+    the page as done and the next run replays it; content hashing makes the
+    replay skip whatever was written.
+    """
+    def failed():
+        return writer.stats.failed + (chunk_writer.stats.failed if chunk_writer is not None else 0)
+
+    before = failed()
+    writer.write_all(docs)
+    sync_chunks(chunk_writer, docs)
+    if failed() > before:
+        raise RuntimeError(f"{failed() - before} documents or chunks of a page of {len(docs)} could not be written; "
+                           "progress is kept before the page so the next run replays it")
+
+def flatten_incremental(source_container, target_container, state_container, chunk_container=None,
+                        attachment_container=None):
+    """
+    Flattens only documents changed since the last run, reading the source
+    change feed page by page from the persisted continuation token. The token
+    is saved after each page is fully written, so a failed run resumes from
+    the first page that was not.
+    """
+    state = load_flatten_state(state_container)
+    if state.get("continuation"):
+        feed = source_container.query_items_change_feed(continuation=state["continuation"], max_item_count=FLATTEN_PAGE_SIZE)
+    else:
+        logging.info("No change feed continuation found, starting from the beginning.")
+        feed = source_container.query_items_change_feed(start_time="Beginning", max_item_count=FLATTEN_PAGE_SIZE)
+
+    writer = CosmosBatchWriter(target_container, hash_index=ContentHashIndex(target_container), metrics=metrics,
+                               metrics_name="target")
+    chunk_writer = chunk_writer_for(chunk_container)
+    count = 0
+    feed_pages = feed.by_page()
+    for page in timed_pages(feed_pages, "flatten.read_page"):
+        # Taken from the page iterator: the client's last response headers are
+        # overwritten by any later request, such as the attachment lookup
+        continuation = feed_pages.continuation_token
+        with metrics.span("flatten.transform_page"):
+            docs = [flatten_document(doc) for doc in page]
+        join_attachment_analyses(attachment_container, docs)
+        if docs:
+            write_page(writer, chunk_writer, docs)
+            count += len(docs)
+        state = save_flatten_state(state_container, state, continuation)
+    logging.info(f"Flattened {count} changed documents: {writer.stats}")
+    if chunk_writer is not None:
+        logging.info(f"Chunk writes: {chunk_writer.stats}")
+
+def write_pages(pages, writer, chunk_writer, on_page_written):
+    """Writer thread body: drains (docs, continuation) pages from the queue until a None sentinel."""
+    while True:
+        item = pages.get()
+        if item is None:
+            return
+        docs, continuation = item
+        write_page(writer, chunk_writer, docs)
+        on_page_written(docs, continuation)
+
+def flatten_full(source_container, target_container, state_container, chunk_container=None,
+                 attachment_container=None):
+    """
+    Re-flattens every document in the source container with constant memory:
+    source pages are read with a continuation token, transformed on a worker
+    pool and handed to a writer thread through a bounded queue. Progress is
+    saved after every written page, so an interrupted rebuild resumes from
+    the last completed page. When done, the change feed position recorded
+    at the start becomes the incremental starting point.
+    """
+    state = load_flatten_state(state_container)
+    rebuild = state.get("rebuild") or {}
+    if rebuild.get("count"):
+        logging.info(f"Resuming full rebuild after {rebuild['count']} documents.")
+    else:
+        rebuild = {"feed_position": change_feed_position(source_container), "continuation": None, "count": 0}
+    resumed_from = rebuild["count"]
+
+    writer = CosmosBatchWriter(target_container, hash_index=ContentHashIndex(target_container), metrics=metrics,
+                               metrics_name="target")
+    chunk_writer = chunk_writer_for(chunk_container)
+    pages = queue.Queue(maxsize=max(1, FLATTEN_QUEUE_PAGES))
+    progress = {"state": state, "error": None}
+    started = time.monotonic()
+
+    def on_page_written(docs, continuation):
+        rebuild.update(continuation=continuation, count=rebuild["count"] + len(docs))
+        progress["state"] = save_flatten_state(state_container, progress["state"], state.get("continuation"), rebuild)
+        rate = (rebuild["count"] - resumed_from) / max(time.monotonic() - started, 1e-9)
+        logging.info(f"Full rebuild: {rebuild['count']} documents flattened ({rate:.0f} docs/s)")
+
+    def run_writer():
+        try:
+            write_pages(pages, writer, chunk_writer, on_page_written)
+        except Exception as e:
+            progress["error"] = e
+            # Keep draining so the reader never blocks on a full queue
+            while pages.get() is not None:
+                pass
+
+    # Workers are spawned rather than forked: the Functions host and the Cosmos
+    # SDK already run threads, and a forked child would inherit the locks they hold
+    pool = (ProcessPoolExecutor(max_workers=FLATTEN_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            if FLATTEN_WORKERS > 1 else None)
+    writer_thread = threading.Thread(target=run_writer, name="flatten-writer")
+    writer_thread.start()
+    try:
+        # A resumed rebuild whose last page was already written has nothing left to read
+        if not (resumed_from and rebuild["continuation"] is None):
+            source_pages = source_container.query_items(
+                query="SELECT * FROM c",
+                enable_cross_partition_query=True,
+                max_item_count=FLATTEN_PAGE_SIZE
+            ).by_page(rebuild["continuation"])
+            for page in timed_pages(source_pages, "flatten.read_page"):
+                if progress["error"] is not None:
+                    break
+                with metrics.span("flatten.transform_page"):
+                    if pool is not None:
+                        docs = list(pool.map(flatten_document, page, chunksize=max(1, len(page) // (FLATTEN_WORKERS * 4))))
+                    else:
+                        docs = [flatten_document(doc) for doc in page]
+                join_attachment_analyses(attachment_container, docs)
+                with metrics.span("flatten.queue_wait"):
+                    pages.put((docs, source_pages.continuation_token))
+    finally:
+        pages.put(None)
+        writer_thread.join()
+        if pool is not None:
+            pool.shutdown()
+    if progress["error"] is not None:
+        raise progress["error"]
+
+    save_flatten_state(state_container, progress["state"], rebuild["feed_position"])
+    elapsed = time.monotonic() - started
+    logging.info(f"Full rebuild complete: {rebuild['count']} documents, "
+                 f"{(rebuild['count'] - resumed_from) / max(elapsed, 1e-9):.0f} docs/s. {writer.stats}")
+    if chunk_writer is not None:
+        logging.info(f"Chunk writes: {chunk_writer.stats}")
 
 def main(timer: func.TimerRequest) -> None:
-    logging.info("FlattenCosmosData timer function triggered.")
+    logging.info(f"FlattenCosmosData timer function triggered ({FLATTEN_MODE} mode).")
+    metrics.reset()
+    outcome = "failed"
     try:
         # Source Cosmos DB details
         source_url = os.environ["SOURCE_COSMOSDB_URL"]
@@ -56,40 +377,18 @@ def main(timer: func.TimerRequest) -> None:
         source_container = source_database.get_container_client(source_container_name)
         target_database = target_client.get_database_client(target_db)
         target_container = target_database.get_container_client(target_container_name)
+        state_container = target_database.get_container_client(FLATTEN_STATE_CONTAINER)
+        chunk_container = target_database.get_container_client(CHUNK_CONTAINER) if CHUNK_CONTAINER else None
+        attachment_container = source_database.get_container_client(ATTACHMENT_CONTAINER) if ATTACHMENT_CONTAINER else None
 
-        # Retrieve all documents from the source container
-        documents = list(source_container.query_items(
-            query="SELECT * FROM c",
-            enable_cross_partition_query=True
-        ))
-        logging.info(f"Found {len(documents)} documents in source container.")
-
-        processed_docs = []
-        for doc in documents:
-            if "fields" in doc:
-                fields = doc["fields"]
-                # Promote Jira summary to top level if it exists
-                if "summary" in fields:
-                    doc["summary"] = fields["summary"]
-                # Flatten Jira description and promote to top level
-                if "description" in fields:
-                    flattened = flatten_description(fields["description"])
-                    fields["description"] = flattened
-                    doc["description"] = flattened
-
-            # Explicit handling for Confluence pages
-            if "title" in doc:
-                doc["title"] = doc["title"]
-            if "body" in doc and "storage" in doc["body"]:
-                doc["content"] = doc["body"]["storage"]["value"]
-
-            processed_docs.append(doc)
-
-        count = 0
-        for doc in processed_docs:
-            target_container.upsert_item(doc)
-            count += 1
-
-        logging.info(f"Successfully processed and upserted {count} documents.")
+        with profiled(f"flatten-{FLATTEN_MODE}"):
+            if FLATTEN_MODE == "full":
+                flatten_full(source_container, target_container, state_container, chunk_container, attachment_container)
+            else:
+                flatten_incremental(source_container, target_container, state_container, chunk_container,
+                                    attachment_container)
+        outcome = "completed"
     except Exception as e:
         logging.error(f"Error processing documents: {str(e)}")
+    finally:
+        metrics.write_summary(mode=FLATTEN_MODE, outcome=outcome)
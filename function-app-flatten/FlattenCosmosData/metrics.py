@@ -0,0 +1,160 @@
+"""
+Per-run timing spans, counters and run summaries.
+
+A RunMetrics collects named spans (count, errors, total time and latency
+percentiles) and counters for one run, from any thread. At the end of the
+run, summary() returns them as a dict and write_summary() logs it as one
+"Run summary" JSON line, so a log query can pick it out, and appends it to
+RUN_SUMMARY_PATH when that is set. Comparing the spans of a run shows which
+stage is the bottleneck.
+
+With PROFILE_DIR set, profiled() also runs the wrapped block under cProfile
+and saves the stats there. cProfile only sees the thread that started it,
+so worker threads (enrichment, writes) show up as time spent waiting on them.
+
+This module is shared by the fetch_data and FlattenCosmosData functions.
+Each function folder is deployed as its own package, so keep both copies
+identical.
+"""
+import os
+import json
+import time
+import logging
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+RUN_SUMMARY_PATH = os.getenv("RUN_SUMMARY_PATH", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "25"))
+
+LATENCY_SAMPLES = 1000
+
+
+class SpanStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, seconds, error=False):
+        self.count += 1
+        self.errors += error
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.latencies.append(seconds)
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_s": round(self.seconds, 3),
+            "mean_ms": round(self.seconds / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 2),
+            "p99_ms": round(self.percentile(0.99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class RunMetrics:
+    """Spans and counters of one run; reset() starts the next one."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = {}
+            self.started = datetime.now(timezone.utc)
+            self._started = time.monotonic()
+
+    def record(self, span, seconds, error=False):
+        with self._lock:
+            self.spans.setdefault(span, SpanStats()).add(seconds, error)
+
+    def add(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextmanager
+    def span(self, name):
+        """Times the block as one occurrence of the span; an exception counts as an error and is re-raised."""
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            self.record(name, time.monotonic() - started, error=True)
+            raise
+        self.record(name, time.monotonic() - started)
+
+    def timed(self, name):
+        """Decorator recording every call of the function as the span `name`."""
+        def decorate(function):
+            @functools.wraps(function)
+            def timed_call(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return timed_call
+        return decorate
+
+    def summary(self, **extra):
+        with self._lock:
+            spans = {name: stats.summary() for name, stats in sorted(self.spans.items())}
+            counters = {name: round(value, 2) if isinstance(value, float) else value
+                        for name, value in sorted(self.counters.items())}
+        return {"run": self.name, "started": self.started.isoformat(),
+                "seconds": round(time.monotonic() - self._started, 3), "spans": spans, "counters": counters, **extra}
+
+    def write_summary(self, **extra):
+        """Logs the run summary as one JSON line and appends it to RUN_SUMMARY_PATH when set."""
+        line = json.dumps(self.summary(**extra), default=str)
+        logging.info(f"Run summary: {line}")
+        if RUN_SUMMARY_PATH:
+            try:
+                with open(RUN_SUMMARY_PATH, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logging.warning(f"Could not write run summary to {RUN_SUMMARY_PATH}: {str(e)}")
+        return line
+
+
+# Context manager running the block under cProfile when PROFILE_DIR is set;
+# the stats are saved to PROFILE_DIR/<name>-<time>.prof and the top entries logged
+@contextmanager
+def profiled(name, profile_dir=None):
+    profile_dir = PROFILE_DIR if profile_dir is None else profile_dir
+    if not profile_dir:
+        yield
+        return
+    # Only imported when profiling is asked for, to keep cold starts lean
+    import io
+    import pstats
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(profile_dir, f"{name}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}.prof")
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError as e:
+            logging.warning(f"Could not save profile to {path}: {str(e)}")
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        logging.info(f"Profile of {name} saved to {path}:\n{report.getvalue()}")
@@ -0,0 +1,284 @@
+"""
+Plain-text extraction for Jira and Confluence rich content.
+
+adf_to_text walks Atlassian Document Format (Jira descriptions and comments)
+with an explicit stack, so arbitrarily deep nesting cannot hit Python's
+recursion limit. storage_to_text streams Confluence storage-format XHTML
+(body.storage.value) through an incremental HTML parser. Both keep light
+structure markers that help search and chunking: "#" headings, "-" / "1."
+list items, " | " table cells, ``` code fences and [panel] labels.
+"""
+import re
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+
+_TRAILING_SPACE = re.compile(r"[ \t]+(?=\n)")
+_MANY_NEWLINES = re.compile(r"\n{3,}")
+
+STORAGE_FEED_CHUNK = 64 * 1024
+MAX_LIST_INDENT = 32
+
+
+def _normalise(pieces):
+    text = "".join(pieces)
+    text = _TRAILING_SPACE.sub("", text)
+    text = _MANY_NEWLINES.sub("\n\n", text)
+    return text.strip()
+
+
+# ADF block nodes that end with a line break (or a space inside table cells)
+_ADF_BLOCKS = {"paragraph", "heading", "blockquote", "panel", "expand", "nestedExpand", "mediaSingle",
+               "mediaGroup", "blockCard", "embedCard", "decisionItem", "taskItem", "listItem"}
+
+
+def adf_to_text(doc):
+    """Returns the text of an ADF document (or any ADF node) with structure markers."""
+    pieces = []
+    # Stack entries are literal strings to emit or (node, indent, in_cell) tuples to expand
+    stack = [(doc, "", False)]
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, str):
+            pieces.append(entry)
+            continue
+        node, indent, in_cell = entry
+        if not isinstance(node, dict):
+            continue
+        node_type = node.get("type")
+        attrs = node.get("attrs") or {}
+        content = node.get("content") or []
+        end = " " if in_cell else "\n"
+
+        if node_type == "text":
+            pieces.append(node.get("text", ""))
+            continue
+        if node_type == "hardBreak":
+            pieces.append(end)
+            continue
+        if node_type == "mention":
+            pieces.append(attrs.get("text") or f"@{attrs.get('id', '')}")
+            continue
+        if node_type == "emoji":
+            pieces.append(attrs.get("text") or attrs.get("shortName", ""))
+            continue
+        if node_type in ("inlineCard", "blockCard", "embedCard"):
+            pieces.append((attrs.get("url") or "") + (end if node_type != "inlineCard" else ""))
+            continue
+        if node_type == "status":
+            pieces.append(f"[{attrs.get('text', '')}]")
+            continue
+        if node_type == "date":
+            try:
+                pieces.append(datetime.fromtimestamp(int(attrs.get("timestamp")) / 1000, tz=timezone.utc).strftime("%Y-%m-%d"))
+            except (TypeError, ValueError):
+                pass
+            continue
+        if node_type == "media":
+            label = attrs.get("alt") or attrs.get("filename")
+            if label:
+                pieces.append(f"[media: {label}]")
+            continue
+        if node_type == "rule":
+            pieces.append(f"{end}---{end}")
+            continue
+
+        # Container nodes: push the closing text, then children in reverse, then the opening text
+        if node_type in ("bulletList", "orderedList", "taskList", "decisionList"):
+            start = attrs.get("order", 1) if node_type == "orderedList" else None
+            # Indentation stops growing past MAX_LIST_INDENT so very deep lists stay linear
+            child_indent = indent + "  " if len(indent) < MAX_LIST_INDENT else indent
+            items = []
+            for i, child in enumerate(content):
+                if node_type == "orderedList":
+                    marker = f"{start + i}. "
+                elif node_type == "taskList":
+                    marker = "[x] " if (child.get("attrs") or {}).get("state") == "DONE" else "[ ] "
+                else:
+                    marker = "- "
+                items.append((indent + marker, (child, child_indent, in_cell)))
+            # Nested lists continue straight into the next outer item
+            stack.append("" if indent else end)
+            for marker, item in reversed(items):
+                stack.append(item)
+                stack.append(marker if not in_cell else marker.strip() + " ")
+            continue
+        if node_type == "table":
+            stack.append(end)
+            for row in reversed(content):
+                stack.append((row, indent, True))
+            continue
+        if node_type == "tableRow":
+            stack.append("\n")
+            cells = list(content)
+            for i in range(len(cells) - 1, -1, -1):
+                stack.append((cells[i], indent, True))
+                if i:
+                    # Cell content already ends with a space
+                    stack.append("| ")
+            continue
+        if node_type == "codeBlock":
+            language = attrs.get("language") or ""
+            stack.append(f"\n```{end}" if not in_cell else " ")
+            stack.extend((child, indent, in_cell) for child in reversed(content))
+            stack.append(f"\n```{language}\n" if not in_cell else " ")
+            continue
+
+        if node_type in _ADF_BLOCKS or node_type in ("tableCell", "tableHeader", "doc"):
+            stack.append("" if node_type in ("tableCell", "tableHeader", "doc", "listItem") else end)
+        stack.extend((child, indent, in_cell) for child in reversed(content))
+        if node_type == "heading":
+            stack.append("#" * int(attrs.get("level", 1)) + " ")
+        elif node_type == "blockquote":
+            stack.append("> ")
+        elif node_type == "panel":
+            stack.append(f"[{attrs.get('panelType', 'panel')}] ")
+        elif node_type in ("expand", "nestedExpand") and attrs.get("title"):
+            stack.append(f"{attrs['title']}{end}")
+        elif node_type in ("paragraph", "heading", "blockquote") and indent and not in_cell and pieces and pieces[-1].endswith("\n"):
+            stack.append(indent)
+    return _normalise(pieces)
+
+
+class StorageTextExtractor(HTMLParser):
+    """Incremental Confluence storage-format to text converter; feed() chunks, then close() and read text()."""
+
+    BLOCKS = {"p", "div", "blockquote", "section", "article", "header", "footer", "dd", "dt", "caption"}
+    PANEL_MACROS = {"info", "note", "warning", "tip", "panel", "expand"}
+    SKIPPED_MACROS = {"toc", "children", "recently-updated", "pagetree", "attachments", "jira", "excerpt-include"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pieces = []
+        self.lists = []
+        self.macros = []
+        self.skip_depth = 0
+        self.cell_index = []
+        self.cell_depth = 0
+        self.pending = ""
+
+    def text(self):
+        return _normalise(self.pieces)
+
+    def _emit(self, value):
+        if not self.skip_depth:
+            self.pieces.append(value)
+
+    def _ends_with_space(self):
+        return not self.pieces or self.pieces[-1].endswith((" ", "\n"))
+
+    def _break(self):
+        # Block boundaries inside table cells become spaces so a row stays on one line
+        if not self.cell_depth:
+            self._emit("\n")
+        elif not self._ends_with_space():
+            self._emit(" ")
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in ("script", "style", "ac:parameter", "ac:task-status", "ac:task-id"):
+            self.skip_depth += 1
+        elif tag == "ac:structured-macro":
+            name = attrs.get("ac:name", "")
+            self.macros.append(name)
+            if name in self.SKIPPED_MACROS:
+                self.skip_depth += 1
+            elif name == "code" or name == "noformat":
+                self._emit("\n```\n")
+            elif name in self.PANEL_MACROS:
+                self._break()
+                # Emitted before the panel's first text, after its opening <p>
+                self.pending = f"[{name}] "
+        elif tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self._break()
+            self._emit("#" * int(tag[1]) + " ")
+        elif tag in self.BLOCKS or tag == "br":
+            self._break()
+        elif tag == "hr":
+            self._emit("\n---\n")
+        elif tag in ("ul", "ol"):
+            self.lists.append([tag, int(attrs.get("start") or 1)])
+        elif tag == "li":
+            indent = "  " * max(len(self.lists) - 1, 0)
+            if self.lists and self.lists[-1][0] == "ol":
+                self._emit(f"\n{indent}{self.lists[-1][1]}. ")
+                self.lists[-1][1] += 1
+            else:
+                self._emit(f"\n{indent}- ")
+        elif tag == "tr":
+            self.cell_index.append(0)
+            self._emit("\n")
+        elif tag in ("td", "th"):
+            self.cell_depth += 1
+            if self.cell_index:
+                if self.cell_index[-1]:
+                    self._emit("| " if self._ends_with_space() else " | ")
+                self.cell_index[-1] += 1
+        elif tag == "pre":
+            self._emit("\n```\n")
+        elif tag == "ri:user":
+            self._emit(f"@{attrs.get('ri:account-id') or attrs.get('ri:userkey') or attrs.get('ri:username') or 'user'}")
+        elif tag == "ac:emoticon":
+            self._emit(attrs.get("ac:emoji-fallback") or f":{attrs.get('ac:name', '')}:")
+        elif tag == "ri:attachment" and attrs.get("ri:filename"):
+            self._emit(f"[attachment: {attrs['ri:filename']}]")
+        elif tag == "time" and attrs.get("datetime"):
+            self._emit(attrs["datetime"])
+        elif tag == "ac:task":
+            self._emit("\n[ ] ")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in ("ac:structured-macro", "script", "style", "ac:parameter", "ul", "ol", "tr"):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style", "ac:parameter", "ac:task-status", "ac:task-id"):
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag == "ac:structured-macro":
+            name = self.macros.pop() if self.macros else ""
+            if name in self.SKIPPED_MACROS:
+                self.skip_depth = max(self.skip_depth - 1, 0)
+            elif name == "code" or name == "noformat":
+                self._emit("\n```\n")
+            elif name in self.PANEL_MACROS:
+                self.pending = ""
+                self._break()
+        elif tag in ("ul", "ol"):
+            if self.lists:
+                self.lists.pop()
+            # Nested lists continue straight into the next outer item
+            if not self.lists:
+                self._break()
+        elif tag in ("td", "th"):
+            self.cell_depth = max(self.cell_depth - 1, 0)
+        elif tag == "tr":
+            if self.cell_index:
+                self.cell_index.pop()
+        elif tag == "table":
+            self._emit("\n")
+        elif tag == "pre":
+            self._emit("\n```\n")
+        elif tag in ("h1", "h2", "h3", "h4", "h5", "h6") or tag in self.BLOCKS:
+            self._break()
+
+    def handle_data(self, data):
+        if self.pending and data.strip() and not self.skip_depth:
+            self._emit(self.pending)
+            self.pending = ""
+        self._emit(data)
+
+    def unknown_decl(self, data):
+        # Code and plain-text macro bodies arrive as CDATA sections
+        if data.startswith("CDATA["):
+            self._emit(data[6:])
+
+
+def storage_to_text(xhtml):
+    """Returns the text of a Confluence storage-format document with structure markers."""
+    if not isinstance(xhtml, str):
+        return xhtml
+    parser = StorageTextExtractor()
+    for start in range(0, len(xhtml), STORAGE_FEED_CHUNK):
+        parser.feed(xhtml[start:start + STORAGE_FEED_CHUNK])
+    parser.close()
+    return parser.text()
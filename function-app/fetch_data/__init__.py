@@ -3,12 +3,9 @@ import sys
 sys.path.insert(0, os.path.dirname(__file__))
 import logging
 import azure.functions as func
-from .fetch_data import is_first_run, fetch_jira_tickets, fetch_confluence_pages, store_data_in_cosmosdb
+from .fetch_data import sync_sources
 
 def main(timer: func.TimerRequest) -> None:
     logging.info("Timer triggered function started.")
-    first_run = is_first_run()
-    jira_tickets = fetch_jira_tickets(first_run)
-    confluence_pages = fetch_confluence_pages(first_run)
-    store_data_in_cosmosdb(jira_tickets + confluence_pages)
-    logging.info("Timer triggered function completed.")
+    sync_sources("jira", "confluence")
+    logging.info("Timer triggered function completed.")
\ No newline at end of file
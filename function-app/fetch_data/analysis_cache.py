@@ -0,0 +1,160 @@
+"""
+Persistent cache for Vision and Document Intelligence results.
+
+Entries are keyed by the analysis kind plus an attachment identity that
+changes whenever the attachment content does (Jira attachment id, Confluence
+attachment id + version), so an unchanged attachment skips both the download
+and the cognitive-service call. The default backend is a local SQLite file
+with age- and size-based eviction; a Cosmos DB container can be used instead
+so the cache survives scale-out and instance recycling.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+
+ANALYSIS_CACHE_BACKEND = os.getenv("ANALYSIS_CACHE_BACKEND", "sqlite")
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", os.path.join(tempfile.gettempdir(), "cloudsage-analysis-cache.sqlite3"))
+ANALYSIS_CACHE_CONTAINER = os.getenv("ANALYSIS_CACHE_CONTAINER", "analysiscache")
+ANALYSIS_CACHE_MAX_AGE_DAYS = float(os.getenv("ANALYSIS_CACHE_MAX_AGE_DAYS", "90"))
+ANALYSIS_CACHE_MAX_MB = float(os.getenv("ANALYSIS_CACHE_MAX_MB", "512"))
+
+
+class AnalysisCache:
+    """Common hit/miss accounting; subclasses implement _load and _store."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self._load(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def put(self, key, result):
+        self._store(key, json.dumps(result))
+        self.stores += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+
+    def close(self):
+        pass
+
+
+class SqliteAnalysisCache(AnalysisCache):
+    """Local SQLite cache evicting entries older than max_age or beyond max_bytes (least recently used first)."""
+
+    EVICT_EVERY = 100
+
+    def __init__(self, path=ANALYSIS_CACHE_PATH, max_age_days=ANALYSIS_CACHE_MAX_AGE_DAYS, max_mb=ANALYSIS_CACHE_MAX_MB):
+        super().__init__()
+        self.max_age = max_age_days * 86400
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS analysis_accessed ON analysis (accessed)")
+        self._db.commit()
+        self._writes_since_evict = 0
+        self.evict()
+
+    def _load(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM analysis WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                return None
+            self._db.execute("UPDATE analysis SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return row[0]
+
+    def _store(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analysis (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            self._db.commit()
+            self._writes_since_evict += 1
+        if self._writes_since_evict >= self.EVICT_EVERY:
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            self._writes_since_evict = 0
+            evicted = self._db.execute("DELETE FROM analysis WHERE created < ?", (time.time() - self.max_age,)).rowcount
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM analysis").fetchone()[0]
+            if total > self.max_bytes:
+                cursor = self._db.execute("SELECT key, size FROM analysis ORDER BY accessed")
+                doomed = []
+                for key, size in cursor:
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                self._db.executemany("DELETE FROM analysis WHERE key = ?", doomed)
+                evicted += len(doomed)
+            self._db.commit()
+        self.evictions += evicted
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self._db.close()
+
+
+class CosmosAnalysisCache(AnalysisCache):
+    """
+    Cosmos DB backed cache. Expects a container partitioned on /id with TTL
+    enabled; age-based eviction is left to the per-item ttl.
+    """
+
+    def __init__(self, container, max_age_days=ANALYSIS_CACHE_MAX_AGE_DAYS):
+        super().__init__()
+        self.container = container
+        self.ttl = int(max_age_days * 86400)
+
+    @staticmethod
+    def _item_id(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _load(self, key):
+        from azure.cosmos.exceptions import CosmosResourceNotFoundError
+        item_id = self._item_id(key)
+        try:
+            return self.container.read_item(item=item_id, partition_key=item_id)["value"]
+        except CosmosResourceNotFoundError:
+            return None
+
+    def _store(self, key, value):
+        self.container.upsert_item({"id": self._item_id(key), "key": key, "value": value, "ttl": self.ttl})
+
+
+# Function to open the configured cache; returns None when caching is disabled
+def open_analysis_cache(database=None):
+    if ANALYSIS_CACHE_BACKEND == "none":
+        return None
+    if ANALYSIS_CACHE_BACKEND == "cosmos":
+        return CosmosAnalysisCache(database.get_container_client(ANALYSIS_CACHE_CONTAINER))
+    try:
+        return SqliteAnalysisCache()
+    except sqlite3.Error as e:
+        logging.error(f"Could not open analysis cache at {ANALYSIS_CACHE_PATH}, continuing without it: {str(e)}")
+        return None
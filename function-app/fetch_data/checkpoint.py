@@ -0,0 +1,118 @@
+"""
+Per-source sync checkpoints.
+
+Each source (jira, confluence), or each shard of a source when the sync is
+sharded (see shards.py), has one small document in the sync state
+container holding the watermark of its last completed run and, while a run
+is in progress, a resume cursor: the `updated` time of the newest record
+already stored. Sources are fetched in ascending `updated` order, so a run
+that dies part way through resumes from the cursor instead of starting over.
+Writes use the document's etag, so two overlapping runs cannot silently
+overwrite each other's progress.
+"""
+import os
+import logging
+from datetime import datetime, timezone
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+
+SYNC_STATE_CONTAINER = os.getenv("SYNC_STATE_CONTAINER", "syncstate")
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "100"))
+CHECKPOINT_OVERLAP_MINUTES = int(os.getenv("CHECKPOINT_OVERLAP_MINUTES", "5"))
+
+
+def parse_timestamp(value):
+    """Parse an Atlassian timestamp (2024-01-31T10:00:00.000+0000 or ...Z) to an aware UTC datetime."""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z").astimezone(timezone.utc)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+
+def format_timestamp(value):
+    return value.astimezone(timezone.utc).isoformat() if value else None
+
+
+class SyncCheckpoint:
+    """
+    Progress of one source's sync run. Call advance(record) once a record is
+    stored and complete() once the whole run has been stored.
+    """
+
+    def __init__(self, container, source, doc, updated_of):
+        self.container = container
+        self.source = source
+        self.doc = doc
+        self.updated_of = updated_of
+        self.started = datetime.now(timezone.utc)
+        self._pending = 0
+        self._cursor = parse_timestamp(doc.get("cursor"))
+
+    @property
+    def since(self):
+        """Lower bound for this run's fetch: the resume cursor, else the last watermark (None for a full backfill)."""
+        return parse_timestamp(self.doc.get("cursor") or self.doc.get("watermark"))
+
+    def advance(self, record):
+        updated = parse_timestamp(self.updated_of(record))
+        if updated is not None and (self._cursor is None or updated > self._cursor):
+            self._cursor = updated
+        self._pending += 1
+        if self._pending >= CHECKPOINT_EVERY:
+            self.save()
+
+    def save(self):
+        self._pending = 0
+        if self._cursor is not None:
+            self._write({**self.doc, "cursor": format_timestamp(self._cursor)})
+
+    def complete(self, watermark=None):
+        """Records a finished run: the watermark becomes its start time (or the given time) and the cursor is cleared."""
+        self._write({**self.doc, "watermark": watermark or format_timestamp(self.started), "cursor": None,
+                     "completed": format_timestamp(datetime.now(timezone.utc))})
+        logging.info(f"Checkpoint for {self.source} advanced to {self.doc['watermark']}")
+
+    def _write(self, doc):
+        doc = {k: v for k, v in doc.items() if not k.startswith("_")}
+        etag = self.doc.get("_etag")
+        if etag:
+            self.doc = self.container.replace_item(item=doc["id"], body=doc, etag=etag,
+                                                   match_condition=MatchConditions.IfNotModified)
+        else:
+            self.doc = self.container.create_item(body=doc)
+
+
+# Function to load (or start) the checkpoint for a source or shard. A new
+# shard checkpoint can start from the progress of the checkpoint named by
+# inherit_from (its source's, from before the source was sharded), so turning
+# sharding on does not trigger a full backfill.
+def load_checkpoint(container, source, updated_of, inherit_from=None):
+    try:
+        doc = container.read_item(item=source, partition_key=source)
+    except CosmosResourceNotFoundError:
+        doc = {"id": source, "type": "sync_checkpoint", "watermark": None, "cursor": None}
+        if inherit_from:
+            try:
+                parent = container.read_item(item=inherit_from, partition_key=inherit_from)
+                doc["watermark"] = parent.get("cursor") or parent.get("watermark")
+            except CosmosResourceNotFoundError:
+                pass
+    checkpoint = SyncCheckpoint(container, source, doc, updated_of)
+    logging.info(f"Checkpoint for {source}: watermark={doc.get('watermark')} cursor={doc.get('cursor')}")
+    return checkpoint
+
+
+# Function to turn a checkpoint time into a timezone-independent relative
+# lookback for JQL/CQL ("-90m"), padded by `overlap` minutes
+def lookback_minutes(since, overlap=CHECKPOINT_OVERLAP_MINUTES):
+    elapsed = (datetime.now(timezone.utc) - since).total_seconds()
+    return int(elapsed // 60) + 1 + overlap
+
+
+# Function to turn the end of a backfill slice into a relative upper bound
+# for JQL/CQL; rounding down lets slices overlap rather than leave a gap
+def minutes_ago(until):
+    return max(0, int((datetime.now(timezone.utc) - until).total_seconds() // 60))
@@ -0,0 +1,212 @@
+"""
+Concurrent attachment enrichment.
+
+Images and PDFs are analysed on separate thread pools with their own
+concurrency limits, so one slow Document Intelligence call no longer stalls
+Vision work or the rest of the sync. Enrichers running side by side (one per
+shard) can share one set of pools, so the limits hold for the whole app. Records come out in the order they went
+in, each with one analysis per attachment, in attachment order, under
+record["attachment_analyses"]. With a cache, jobs that carry a cache_key and
+have a stored result skip the download and the service call entirely.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+IMAGE_CONCURRENCY = int(os.getenv("ENRICH_IMAGE_CONCURRENCY", "8"))
+PDF_CONCURRENCY = int(os.getenv("ENRICH_PDF_CONCURRENCY", "4"))
+ANALYSIS_TIMEOUT = float(os.getenv("ENRICH_TIMEOUT_SECONDS", "300"))
+ENRICH_WINDOW = int(os.getenv("ENRICH_WINDOW", "64"))
+
+# Record field receiving the analyses; the store stage moves them to their own documents
+ANALYSES_FIELD = "attachment_analyses"
+
+
+# Function to create the image and PDF pools an enricher submits its jobs to
+def analysis_pools(image_concurrency=IMAGE_CONCURRENCY, pdf_concurrency=PDF_CONCURRENCY):
+    return {
+        "image": ThreadPoolExecutor(max_workers=image_concurrency, thread_name_prefix="enrich-image"),
+        "pdf": ThreadPoolExecutor(max_workers=pdf_concurrency, thread_name_prefix="enrich-pdf"),
+    }
+
+
+class AttachmentJob:
+    """
+    One analysis call for one attachment. attachment describes it (id, title,
+    media_type) and is copied into the analysis; cache_key identifies the
+    attachment content (e.g. id + version) for the result cache.
+    """
+
+    def __init__(self, kind, attachment, *args, cache_key=None):
+        self.kind = kind
+        self.attachment = attachment
+        self.args = args
+        self.cache_key = f"{kind}:{cache_key}" if cache_key else None
+        self.cached = False
+        self.started = None
+        self.timed_out = False
+        self.future = None
+
+
+class AttachmentEnricher:
+    """
+    Runs attachment analysis for a stream of records.
+
+    analyzers maps a job kind ("image", "pdf") to the function that analyses
+    it. At most `window` records are in flight; a record is yielded once all
+    of its jobs have finished, failed or timed out. A job that runs longer
+    than `timeout` seconds is abandoned; its analysis gets status timed_out
+    and no text.
+    With a RunMetrics, job outcomes are counted as enrich.<kind>.<outcome>.
+    Given `pools` (see analysis_pools), jobs run on those shared pools, which
+    the enricher leaves running when it is done; otherwise it creates its own.
+    The enricher is cancelled when its `with` block exits with an exception
+    (including its consumer closing the record stream early) or when the
+    optional `abort` event is set, e.g. by the work queues of a failed run.
+    """
+
+    def __init__(self, analyzers, image_concurrency=IMAGE_CONCURRENCY, pdf_concurrency=PDF_CONCURRENCY,
+                 timeout=ANALYSIS_TIMEOUT, window=ENRICH_WINDOW, cache=None, metrics=None, abort=None, pools=None):
+        self.analyzers = analyzers
+        self.cache = cache
+        self.metrics = metrics
+        self.timeout = timeout
+        self.window = max(1, window)
+        self._owns_pools = pools is None
+        self._pools = analysis_pools(image_concurrency, pdf_concurrency) if pools is None else pools
+        # Futures of this enricher's jobs still queued or running, cancelled with it
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._abort = abort
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.cancel()
+        else:
+            self.close()
+
+    def close(self):
+        if self._owns_pools:
+            for pool in self._pools.values():
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def cancel(self):
+        """Stop submitting work; queued jobs are dropped and in-flight ones are abandoned."""
+        self._cancelled.set()
+        with self._pending_lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+        self.close()
+
+    @property
+    def cancelled(self):
+        if not self._cancelled.is_set() and self._abort is not None and self._abort.is_set():
+            logging.warning("Run aborted, cancelling attachment analysis")
+            self.cancel()
+        return self._cancelled.is_set()
+
+    def _run(self, job):
+        job.started = time.monotonic()
+        return self.analyzers[job.kind](*job.args)
+
+    def _submit(self, job):
+        if self.cache is not None and job.cache_key:
+            try:
+                cached = self.cache.get(job.cache_key)
+            except Exception as e:
+                logging.warning(f"Analysis cache lookup failed for {job.cache_key}: {str(e)}")
+                cached = None
+            if cached is not None:
+                job.cached = True
+                job.future = Future()
+                job.future.set_result(cached)
+                return job
+        job.future = self._pools[job.kind].submit(self._run, job)
+        with self._pending_lock:
+            self._pending.add(job.future)
+        job.future.add_done_callback(self._forget)
+        return job
+
+    def _forget(self, future):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def _wait(self, jobs):
+        pending = list(jobs)
+        while pending:
+            if self.cancelled:
+                for job in pending:
+                    job.future.cancel()
+                return
+            now = time.monotonic()
+            next_deadline = 1.0
+            still_pending = []
+            for job in pending:
+                if job.future.done():
+                    continue
+                if job.started is not None and now - job.started >= self.timeout:
+                    job.timed_out = True
+                    job.future.cancel()
+                    logging.warning(f"{job.kind} analysis timed out after {self.timeout}s: {job.args[0]}")
+                    continue
+                if job.started is not None:
+                    next_deadline = min(next_deadline, self.timeout - (now - job.started))
+                still_pending.append(job)
+            pending = still_pending
+            if pending:
+                wait([job.future for job in pending], timeout=max(next_deadline, 0.01), return_when=FIRST_COMPLETED)
+
+    def _finish(self, record, jobs):
+        self._wait(jobs)
+        analyses = []
+        for job in jobs:
+            result = None
+            if not job.timed_out and job.future.done() and not job.future.cancelled():
+                try:
+                    result = job.future.result()
+                except Exception as e:
+                    logging.error(f"{job.kind} analysis failed for {job.args[0]}: {str(e)}")
+            outcome = "cached" if job.cached else "timed_out" if job.timed_out else "analysed" if result else "failed"
+            if self.metrics is not None:
+                self.metrics.add(f"enrich.{job.kind}.{outcome}")
+            if result and not job.cached and self.cache is not None and job.cache_key:
+                try:
+                    self.cache.put(job.cache_key, result)
+                except Exception as e:
+                    logging.warning(f"Analysis cache store failed for {job.cache_key}: {str(e)}")
+            # A cached result is the analysis stored before, so it keeps that status and the stored
+            # document (and its content hash) stays the same
+            status = "analysed" if job.cached else outcome
+            analyses.append({**job.attachment, "kind": job.kind, "status": status, "text": result or None})
+        if jobs:
+            record[ANALYSES_FIELD] = analyses
+        return record
+
+    def enrich(self, records, jobs_for):
+        """
+        Yield records in input order with every job from jobs_for(record)
+        applied. Once cancelled, records still in flight are not yielded.
+        """
+        in_flight = deque()
+        for record in records:
+            if self.cancelled:
+                return
+            in_flight.append((record, [self._submit(job) for job in jobs_for(record)]))
+            if len(in_flight) >= self.window:
+                record = self._finish(*in_flight.popleft())
+                if self.cancelled:
+                    return
+                yield record
+        while in_flight and not self.cancelled:
+            record = self._finish(*in_flight.popleft())
+            if self.cancelled:
+                return
+            yield record
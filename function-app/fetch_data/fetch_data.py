@@ -1,18 +1,32 @@
 import os
-import json
-import requests
-import azure.functions as func
+import hashlib
 import logging
+import functools
+import threading
+from contextlib import closing
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
 from azure.cosmos import CosmosClient
-from datetime import datetime, timedelta
-from azure.ai.vision.imageanalysis import ImageAnalysisClient
-print(dir(ImageAnalysisClient))
-from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.core.credentials import AzureKeyCredential  # Add this import
-from dotenv import load_dotenv
+from azure.cosmos.exceptions import CosmosResourceExistsError
 from requests.auth import HTTPBasicAuth
-load_dotenv()  # This loads the .env file
-print("JIRA_API_URL:", os.getenv("JIRA_API_URL"))
+from enrichment import ANALYSES_FIELD, ANALYSIS_TIMEOUT, AttachmentEnricher, AttachmentJob, analysis_pools
+from analysis_cache import open_analysis_cache
+from checkpoint import (CHECKPOINT_OVERLAP_MINUTES, SYNC_STATE_CONTAINER, load_checkpoint, lookback_minutes, minutes_ago,
+                        parse_timestamp)
+from cosmos_writer import COSMOS_WRITE_BATCH, ContentHashIndex, CosmosBatchWriter, content_hash
+from http_client import HttpClient, HttpStats, RateLimiter
+from image_prep import ImageStats, prepare_image
+from metrics import RunMetrics, profiled
+from pdf_prep import PDF_SHARD_CONCURRENCY, PDF_SHARD_PAGES, count_pdf_pages, page_ranges, read_pdf
+from shards import (SYNC_BACKFILL_SLICE_DAYS, SYNC_BACKFILL_START, SYNC_SHARD_BY, SYNC_WORKERS, LeaseLost, Shard,
+                    backfill_slices, open_lease_store, parse_start, run_shards)
+from work_queue import QueueAborted, open_work_queues
+
+# Local runs read their settings from a .env file; in Azure (where
+# WEBSITE_INSTANCE_ID is set) they come from the app settings
+if not os.getenv("WEBSITE_INSTANCE_ID"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 
 # Environment Variables
@@ -26,59 +40,172 @@ COSMOSDB_URL = os.getenv("COSMOSDB_URL")
 COSMOSDB_KEY = os.getenv("COSMOSDB_KEY")
 COSMOSDB_DATABASE = os.getenv("COSMOSDB_DATABASE")
 COSMOSDB_CONTAINER = os.getenv("COSMOSDB_CONTAINER")
+# Container (partition key /parent_id) holding one analysis document per attachment
+ATTACHMENT_CONTAINER = os.getenv("ATTACHMENT_CONTAINER", "attachments")
+ATTACHMENT_TOMBSTONE_TTL = int(os.getenv("ATTACHMENT_TOMBSTONE_TTL", "86400"))
 AZURE_VISION_ENDPOINT = os.getenv("AZURE_VISION_ENDPOINT")
 AZURE_VISION_KEY = os.getenv("AZURE_VISION_KEY")
 AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT")
 AZURE_DOCUMENT_INTELLIGENCE_KEY = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_KEY")
+JIRA_PAGE_SIZE = int(os.getenv("JIRA_PAGE_SIZE", "100"))
+# Extra minutes each keyset page's search looks back, for clock skew between this host and Jira
+JIRA_KEYSET_OVERLAP_MINUTES = int(os.getenv("JIRA_KEYSET_OVERLAP_MINUTES", "1"))
+CONFLUENCE_PAGE_SIZE = int(os.getenv("CONFLUENCE_PAGE_SIZE", "50"))
+# Extra minutes each keyset page's search looks back, for clock skew between this host and Confluence
+CONFLUENCE_KEYSET_OVERLAP_MINUTES = int(os.getenv("CONFLUENCE_KEYSET_OVERLAP_MINUTES", "1"))
+# Most already-fetched page ids a keyset search excludes; the CQL goes in the request URL
+CONFLUENCE_KEYSET_MAX_EXCLUDED = int(os.getenv("CONFLUENCE_KEYSET_MAX_EXCLUDED", "200"))
+CONFLUENCE_EXPAND = "version,metadata.labels,body.storage,children.attachment,children.attachment.version"
+# Comma-separated project / space keys to shard by; when empty they are listed from the API
+JIRA_PROJECTS = [key.strip() for key in os.getenv("JIRA_PROJECTS", "").split(",") if key.strip()]
+CONFLUENCE_SPACES = [key.strip() for key in os.getenv("CONFLUENCE_SPACES", "").split(",") if key.strip()]
 
 # Initialize Logging
 logging.basicConfig(level=logging.INFO)
 
-# Initialize CosmosDB Client
-client = CosmosClient(COSMOSDB_URL, credential=COSMOSDB_KEY)
-database = client.get_database_client(COSMOSDB_DATABASE)
-container = database.get_container_client(COSMOSDB_CONTAINER)
+# Decorator turning a client factory into a getter that builds the client on
+# first use and returns the same instance afterwards, including across warm
+# invocations. A cold start only pays for the clients a run actually needs;
+# the lock stops concurrent first calls from enrichment threads building two.
+def cached_client(factory):
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+    return get
+
+# CosmosDB clients
+@cached_client
+def cosmos_database():
+    return CosmosClient(COSMOSDB_URL, credential=COSMOSDB_KEY).get_database_client(COSMOSDB_DATABASE)
+
+@cached_client
+def cosmos_container():
+    return cosmos_database().get_container_client(COSMOSDB_CONTAINER)
+
+@cached_client
+def sync_state_container():
+    return cosmos_database().get_container_client(SYNC_STATE_CONTAINER)
+
+@cached_client
+def attachment_container():
+    return cosmos_database().get_container_client(ATTACHMENT_CONTAINER)
+
+# Hashes of stored records, kept across warm invocations, so unchanged records are not rewritten
+@cached_client
+def content_hash_index():
+    return ContentHashIndex(cosmos_container())
+
+@cached_client
+def attachment_hash_index():
+    return ContentHashIndex(attachment_container())
+
+# Azure Vision & Document Intelligence clients. Their SDKs are only imported
+# when the first attachment of that kind needs analysis.
+@cached_client
+def vision_client():
+    from azure.ai.vision.imageanalysis import ImageAnalysisClient
+    from azure.core.credentials import AzureKeyCredential
+    return ImageAnalysisClient(endpoint=AZURE_VISION_ENDPOINT, credential=AzureKeyCredential(AZURE_VISION_KEY))
+
+@cached_client
+def document_intelligence_client():
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    from azure.core.credentials import AzureKeyCredential
+    return DocumentIntelligenceClient(endpoint=AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT,
+                                      credential=AzureKeyCredential(AZURE_DOCUMENT_INTELLIGENCE_KEY))
+
+# Pool analysing the page ranges of large PDFs, shared by every PDF job so
+# the number of concurrent Document Intelligence operations stays bounded
+@cached_client
+def pdf_shard_pool():
+    return ThreadPoolExecutor(max_workers=max(1, PDF_SHARD_CONCURRENCY), thread_name_prefix="pdf-shard")
+
+# Image and PDF analysis pools shared by the enrichers of every shard, so
+# ENRICH_IMAGE_CONCURRENCY and ENRICH_PDF_CONCURRENCY bound the whole app
+# rather than each of the SYNC_WORKERS shards
+@cached_client
+def enrichment_pools():
+    return analysis_pools()
 
-# Initialize Azure Vision & Document Intelligence Clients
-vision_client = ImageAnalysisClient(endpoint=AZURE_VISION_ENDPOINT, credential=AzureKeyCredential(AZURE_VISION_KEY) )
-document_intelligence_client = DocumentIntelligenceClient(endpoint=AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT, credential=AzureKeyCredential(AZURE_DOCUMENT_INTELLIGENCE_KEY))
+# Cache of analysis results so unchanged attachments are not re-analysed
+@cached_client
+def analysis_cache():
+    return open_analysis_cache(cosmos_database())
 
-# Function to check if this is the first run
-def is_first_run():
-    logging.info("Checking if this is the first data fetch...")
-    return container.query_items(query="SELECT VALUE COUNT(1) FROM c", enable_cross_partition_query=True).__next__() == 0
-    logging.info(f"is_first_run() returned: {is_first_run()}")
+# Durable queues between the fetch, enrich and store stages; None chains them in-process
+@cached_client
+def work_queues():
+    return open_work_queues()
 
+# Pooled HTTP clients; Jira and Confluence share one rate limiter, so calls
+# to the same Atlassian site draw from the same token bucket
+http_stats = HttpStats()
+atlassian_rate_limiter = RateLimiter()
+jira_http = HttpClient(auth=HTTPBasicAuth(JIRA_USERNAME, JIRA_API_TOKEN), rate_limiter=atlassian_rate_limiter, stats=http_stats)
+confluence_http = HttpClient(auth=HTTPBasicAuth(CONFLUENCE_USERNAME, CONFLUENCE_API_TOKEN), rate_limiter=atlassian_rate_limiter,
+                             stats=http_stats)
+
+# Bytes downloaded/sent and peak memory of the images sent to Vision
+image_stats = ImageStats()
+
+# Timing spans and counters of the current sync run, for its run summary
+metrics = RunMetrics("fetch_data")
+
+# Function to pick the client (and so the credentials) for an Atlassian URL
+def http_client_for(url):
+    if CONFLUENCE_API_URL and url.startswith(CONFLUENCE_API_URL.rstrip("/")):
+        return confluence_http
+    return jira_http
+
+
+# Function to resolve a possibly relative attachment URL against base_url
+def absolute_url(url, base_url=None):
+    # If the URL does not start with "http", it is relative.
+    if url.startswith("http"):
+        return url
+    if base_url:
+        # Prepend the base_url to form an absolute URL.
+        return base_url.rstrip("/") + "/" + url.lstrip("/")
+    logging.error("Relative attachment URL provided but no base_url given.")
+    return None
 
 # Function to analyze images using Azure AI Vision
 def analyze_image(image_url, base_url=None):
-    # If the URL does not start with "http", it is relative.
-    if not image_url.startswith("http"):
-        if base_url:
-            # Prepend the base_url to form an absolute URL.
-            image_url = base_url.rstrip("/") + "/" + image_url.lstrip("/")
-        else:
-            logging.error("Relative image URL provided but no base_url given.")
-            return None
+    image_url = absolute_url(image_url, base_url)
+    if image_url is None:
+        return None
 
     logging.info(f"Processing image: {image_url}")
     
-    # Fetch the image using credentials (this works for both Jira and Confluence if the URL is absolute)
-    image_response = requests.get(image_url, auth=HTTPBasicAuth(JIRA_USERNAME, JIRA_API_TOKEN))
-    if image_response.status_code != 200:
-        logging.error(f"Failed to fetch image from URL: {image_url} - Status code: {image_response.status_code}")
+    # Stream the image with the credentials of the site it belongs to
+    with metrics.span("attachment.download"):
+        image_response = http_client_for(image_url).get(image_url, endpoint="attachment", stream=True)
+        if image_response.status_code != 200:
+            logging.error(f"Failed to fetch image from URL: {image_url} - Status code: {image_response.status_code}")
+            image_response.close()
+            return None
+        # Size-capped, sniffed and (for large images) downscaled before it is sent
+        image = prepare_image(image_response, image_stats)
+    if image is None:
+        logging.info(f"Skipping attachment that is not a usable image: {image_url}")
         return None
-    image_data = image_response.content
-    
+    logging.info(f"Image {image_url}: {image.downloaded} bytes downloaded, {image.sent} bytes sent, ~{image.peak} bytes peak")
+
     # Analyze the image using the Vision client
     try:
-        analysis_response = vision_client.analyze(image_data, visual_features=["Tags"])
+        with metrics.span("vision.analyze"):
+            analysis_response = vision_client().analyze(image.data, visual_features=["Tags"], read_timeout=ANALYSIS_TIMEOUT)
     except Exception as e:
         logging.error(f"Vision analysis failed: {str(e)}")
         return None
 
-    logging.info(f"Vision client response: {analysis_response}")
-    
     if analysis_response:
         logging.info("Image processed successfully")
         tags = []
@@ -92,85 +219,611 @@ def analyze_image(image_url, base_url=None):
 
 
 
-# Function to analyze PDFs using Azure Document Intelligence
-def analyze_pdf(pdf_url):
+# Function to analyze a PDF (or one page range of it, e.g. "51-100") with
+# the Document Intelligence layout model
+@metrics.timed("docintel.analyze")
+def analyze_pdf_pages(pdf_data, pages=None):
+    response = document_intelligence_client().begin_analyze_document("prebuilt-layout", pdf_data, pages=pages)
+    result = response.result(timeout=ANALYSIS_TIMEOUT)
+    return result.content if result else None
+
+# Function to analyze one page range of a sharded PDF; a failed range is
+# logged and left out rather than failing the whole document
+def analyze_pdf_shard(pdf_data, pages, pdf_url):
+    try:
+        return analyze_pdf_pages(pdf_data, pages)
+    except Exception as e:
+        logging.error(f"PDF analysis of pages {pages} failed for {pdf_url}: {str(e)[:500]}")
+        return None
+
+# Function to analyze PDFs using Azure Document Intelligence. PDFs of up to
+# PDF_SHARD_PAGES pages take a single call; longer ones are analysed as
+# concurrent page ranges whose content is joined back in page order.
+def analyze_pdf(pdf_url, base_url=None):
+    pdf_url = absolute_url(pdf_url, base_url)
+    if pdf_url is None:
+        return None
     logging.info(f"Processing PDF: {pdf_url}")
-    response = document_intelligence_client.begin_analyze_document("prebuilt-layout", document_url=pdf_url)
-    result = response.result()
-    if result:
+
+    # Document Intelligence cannot fetch attachment URLs that need Atlassian
+    # credentials, so the PDF is downloaded here and sent as bytes
+    with metrics.span("attachment.download"):
+        pdf_response = http_client_for(pdf_url).get(pdf_url, endpoint="attachment", stream=True)
+        if pdf_response.status_code != 200:
+            logging.error(f"Failed to fetch PDF from URL: {pdf_url} - Status code: {pdf_response.status_code}")
+            pdf_response.close()
+            return None
+        pdf_data, reason = read_pdf(pdf_response)
+    if pdf_data is None:
+        logging.info(f"Skipping PDF attachment ({reason}): {pdf_url}")
+        metrics.add(f"pdf.skipped.{reason}")
+        return None
+
+    page_count = count_pdf_pages(pdf_data)
+    metrics.add("pdf.analysed")
+    metrics.add("pdf.pages", page_count or 0)
+    if page_count is None or page_count <= PDF_SHARD_PAGES:
+        content = analyze_pdf_pages(pdf_data)
+    else:
+        ranges = page_ranges(page_count, PDF_SHARD_PAGES)
+        logging.info(f"Analysing {page_count}-page PDF as {len(ranges)} page ranges: {pdf_url}")
+        parts = list(pdf_shard_pool().map(lambda pages: analyze_pdf_shard(pdf_data, pages, pdf_url), ranges))
+        content = "\n".join(part for part in parts if part) or None
+    if content:
         logging.info("PDF processed successfully")
-        return result.content
+        return content
     logging.warning("PDF processing failed")
     return None
 
-# Function to fetch Jira tickets including image & document analysis
-def fetch_jira_tickets(first_run=False):
-    logging.info("Fetching Jira tickets...")
-    #headers = {"Authorization": f"Basic {JIRA_API_TOKEN}", "Content-Type": "application/json"}
-    auth = HTTPBasicAuth(JIRA_USERNAME, JIRA_API_TOKEN)
-    jql_query = "ORDER BY created DESC" if first_run else f"updated >= '{(datetime.utcnow() - timedelta(days=1)).strftime('%Y-%m-%d')}'"
-    response = requests.get(f"{JIRA_API_URL}/search?jql={jql_query}&fields=summary,description,attachment", auth=auth)
-    logging.info(f"Jira response status: {response.status_code}")
-    logging.info(f"Jira response body: {response.text}")
-
-    #response = requests.get(f"{JIRA_API_URL}/search?jql={jql_query}&fields=summary,description,attachment", headers=headers)
-
-    if response.status_code == 200:
-        issues = response.json().get("issues", [])
-        for issue in issues:
-            attachments = issue.get("fields", {}).get("attachment", [])
-            for att in attachments:
-                if att["mimeType"].startswith("image/"):
-                    extracted_text = analyze_image(att["content"])
-                    issue["image_text"] = extracted_text if extracted_text else "No text extracted."
-                elif att["mimeType"].startswith("application/pdf"):
-                    extracted_pdf_text = analyze_pdf(att["content"])
-                    issue["pdf_text"] = extracted_pdf_text if extracted_pdf_text else "No structured data extracted."
-
-        logging.info(f"Fetched {len(issues)} Jira tickets")
-        return issues
-    logging.error(f"Failed to fetch Jira tickets: {response.status_code} {response.text}")
-    return []
-
-# Function to fetch Confluence pages including image & document analysis
-def fetch_confluence_pages(first_run=False):
-    logging.info("Fetching Confluence pages...")
-    #headers = {"Authorization": f"Basic {CONFLUENCE_API_TOKEN}", "Content-Type": "application/json"}
-    #response = requests.get(
-    #    f"{CONFLUENCE_API_URL}/rest/api/content?type=page&expand=version,metadata.labels,body.storage,children.attachment",
-    #    headers=headers
-    #)
-    auth = HTTPBasicAuth(CONFLUENCE_USERNAME, CONFLUENCE_API_TOKEN)
-    response = requests.get(
-        f"{CONFLUENCE_API_URL}/rest/api/content?type=page&expand=version,metadata.labels,body.storage,children.attachment",
-        auth=auth
-    )
-
-    if response.status_code == 200:
-        pages = response.json().get("results", [])
-        for page in pages:
-            attachments = page.get("children", {}).get("attachment", {}).get("results", [])
-            for att in attachments:
-                if att["metadata"]["mediaType"].startswith("image/"):
-                    extracted_text = analyze_image(att["_links"]["download"], base_url=CONFLUENCE_API_URL)
-                    page["image_text"] = extracted_text if extracted_text else "No text extracted."
-                elif att["metadata"]["mediaType"].startswith("application/pdf"):
-                    extracted_pdf_text = analyze_pdf(att["_links"]["download"])
-                    page["pdf_text"] = extracted_pdf_text if extracted_pdf_text else "No structured data extracted."
-
-        logging.info(f"Fetched {len(pages)} Confluence pages")
-        return pages
-    logging.error(f"Failed to fetch Confluence pages: {response.status_code} {response.text}")
-    return []
-
-# Function to store data in CosmosDB
-def store_data_in_cosmosdb(data):
+ATTACHMENT_ANALYZERS = {"image": analyze_image, "pdf": analyze_pdf}
+
+# Jira attachments are immutable (a re-upload gets a new id), so the id is enough
+def jira_attachment_key(att):
+    return f"jira:{att['id']}" if att.get("id") else None
+
+# Confluence attachments keep their id across uploads; the version number changes
+def confluence_attachment_key(att):
+    version = att.get("version", {}).get("number")
+    if not att.get("id") or version is None:
+        return None
+    return f"confluence:{att['id']}:v{version}"
+
+# Function to describe an attachment for its analysis; without an attachment
+# id (or version) the download URL identifies it
+def attachment_info(key, url, title, media_type):
+    attachment_id = key or f"url:{hashlib.sha1(url.encode('utf-8')).hexdigest()[:24]}"
+    return {"attachment_id": attachment_id, "title": title, "media_type": media_type}
+
+# Function to list the analysis jobs for a Jira issue's attachments
+def jira_attachment_jobs(issue):
+    jobs = []
+    for att in issue.get("fields", {}).get("attachment", []):
+        kind = "image" if att["mimeType"].startswith("image/") else "pdf" if att["mimeType"].startswith("application/pdf") else None
+        if kind:
+            key = jira_attachment_key(att)
+            info = attachment_info(key, att["content"], att.get("filename"), att["mimeType"])
+            jobs.append(AttachmentJob(kind, info, att["content"], cache_key=key))
+    return jobs
+
+# Function to list the analysis jobs for a Confluence page's attachments
+def confluence_attachment_jobs(page):
+    jobs = []
+    for att in page.get("children", {}).get("attachment", {}).get("results", []):
+        media_type = att["metadata"]["mediaType"]
+        kind = "image" if media_type.startswith("image/") else "pdf" if media_type.startswith("application/pdf") else None
+        if kind:
+            key = confluence_attachment_key(att)
+            info = attachment_info(key, att["_links"]["download"], att.get("title"), media_type)
+            jobs.append(AttachmentJob(kind, info, att["_links"]["download"], CONFLUENCE_API_URL, cache_key=key))
+    return jobs
+
+# Function to walk a paginated API, prefetching the next page while the caller
+# works through the current one. fetch_page(cursor) returns (items, next_cursor);
+# a next_cursor of None ends the walk. At most two pages are held in memory.
+def iter_pages(fetch_page, first_cursor=None):
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        pending = executor.submit(fetch_page, first_cursor)
+        while pending is not None:
+            items, next_cursor = pending.result()
+            pending = executor.submit(fetch_page, next_cursor) if next_cursor is not None else None
+            for item in items:
+                yield item
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Function to fetch one page of Jira search results at a startAt offset.
+# Offsets, unlike /search/jql page tokens, can be backed off when the keyset
+# paging in iter_jira_issues has to walk on within one search.
+@metrics.timed("jira.fetch_page")
+def fetch_jira_page(jql_query, start_at):
+    params = {"jql": jql_query, "fields": "summary,description,attachment,updated", "maxResults": JIRA_PAGE_SIZE,
+              "startAt": start_at}
+    response = jira_http.get(f"{JIRA_API_URL}/search", params=params, endpoint="jira.search")
+    if response.status_code != 200:
+        logging.error(f"Failed to fetch Jira tickets: {response.status_code} {response.text[:500]}")
+        response.raise_for_status()
+
+    page = response.json()
+    issues = page.get("issues", [])
+    metrics.add("jira.issues", len(issues))
+    logging.info(f"Fetched Jira page of {len(issues)} issues (startAt={start_at})")
+    total = page.get("total")
+    if page.get("isLast") or not issues or total is None:
+        return issues, None
+    start_at += len(issues)
+    return issues, start_at if start_at < total else None
+
+# Function to stream a shard's Jira issues with keyset paging. Each page is a
+# new search from the newest `updated` seen so far rather than a startAt
+# offset into one search: an issue edited during a long backfill moves to the
+# end of the order, which would shift every later offset and skip an unseen
+# issue for good. JQL times have minute precision, so consecutive searches
+# overlap and issues already yielded (same id and update) are dropped. Only
+# when a whole page falls within the first minutes of its search, so a new
+# search would start no later, is the page walked on by offset, backing off
+# a twentieth of a page so a few shifted issues are read again rather than
+# skipped.
+def iter_jira_issues(since=None, scope=None, until=None):
+    def fetch_page(cursor):
+        keyset, overlap, offset = cursor
+        issues, next_offset = fetch_jira_page(jira_query(keyset, scope, until, overlap), offset)
+        if next_offset is None:
+            return issues, None
+        newest = max(filter(None, (parse_timestamp(jira_updated(issue)) for issue in issues)), default=None)
+        if newest is not None and (keyset is None or lookback_minutes(newest, JIRA_KEYSET_OVERLAP_MINUTES)
+                                   < lookback_minutes(keyset, overlap)):
+            return issues, (newest, JIRA_KEYSET_OVERLAP_MINUTES, 0)
+        return issues, (keyset, overlap, max(offset + 1, next_offset - len(issues) // 20))
+
+    issues = iter_pages(fetch_page, (since, CHECKPOINT_OVERLAP_MINUTES, 0))
+    return drop_repeated_versions(issues, jira_updated, JIRA_KEYSET_OVERLAP_MINUTES, 4 * JIRA_PAGE_SIZE)
+
+# Function to drop records that overlapping keyset searches return again with
+# the same update. Records older than the searches' overlap cannot come back,
+# so once more than `limit` ids are held, only the recent ones are kept.
+def drop_repeated_versions(records, updated_of, overlap, limit):
+    seen = {}
+    for record in records:
+        version = updated_of(record)
+        if seen.get(record.get("id")) == version:
+            continue
+        seen[record.get("id")] = version
+        yield record
+        updated = parse_timestamp(version)
+        if len(seen) > limit and updated is not None:
+            horizon = updated - timedelta(minutes=CHECKPOINT_OVERLAP_MINUTES + overlap + 1)
+            seen = {key: value for key, value in seen.items()
+                    if parse_timestamp(value) is None or parse_timestamp(value) >= horizon}
+            limit = max(limit, 2 * len(seen))
+
+# Function to build the JQL for a shard: its scope (e.g. one project), updated
+# since `since` (None for everything, padded by `overlap` minutes) and, for a
+# backfill slice, before `until`
+def jira_query(since=None, scope=None, until=None, overlap=CHECKPOINT_OVERLAP_MINUTES):
+    clauses = [scope] if scope else []
+    if since is not None:
+        clauses.append(f"updated >= -{lookback_minutes(since, overlap)}m")
+    if until is not None:
+        clauses.append(f"updated < -{minutes_ago(until)}m")
+    return f"{' AND '.join(clauses)} ORDER BY updated ASC".strip()
+
+# Function to stream records with their image & document analysis applied, in
+# input order. Closing the stream early, or setting `abort`, cancels the analysis.
+def enrich_records(records, jobs_for, abort=None):
+    cache = analysis_cache()
+    with AttachmentEnricher(ATTACHMENT_ANALYZERS, cache=cache, metrics=metrics, abort=abort,
+                            pools=enrichment_pools()) as enricher:
+        yield from enricher.enrich(records, jobs_for)
+    if cache is not None:
+        logging.info(f"Analysis cache: {cache.stats()}")
+
+# Function to stream a shard's Jira issues without attachment analysis
+def iter_jira_shard(since=None, scope=None, until=None):
+    logging.info(f"Fetching Jira tickets{f' ({scope})' if scope else ''}...")
+    return iter_jira_issues(since, scope, until)
+
+# Function to fetch Jira tickets including image & document analysis.
+# Issues are yielded one at a time, oldest update first, so a full backfill
+# never sits in memory and an interrupted run can resume from its checkpoint.
+# since=None fetches everything; scope and until narrow it to one shard.
+def fetch_jira_tickets(since=None, scope=None, until=None):
+    count = 0
+    for issue in enrich_records(iter_jira_shard(since, scope, until), jira_attachment_jobs):
+        count += 1
+        yield issue
+    logging.info(f"Fetched {count} Jira tickets")
+
+# Function to fetch one page of a Confluence CQL search: the first page of
+# `cql_query`, or the page at the relative `_links.next` URL `cursor`
+@metrics.timed("confluence.fetch_page")
+def fetch_confluence_page(cql_query, cursor):
+    if cursor:
+        url, params = CONFLUENCE_API_URL.rstrip("/") + cursor, None
+    else:
+        url = f"{CONFLUENCE_API_URL.rstrip('/')}/rest/api/content/search"
+        params = {"cql": cql_query, "limit": CONFLUENCE_PAGE_SIZE, "expand": CONFLUENCE_EXPAND}
+    response = confluence_http.get(url, params=params, endpoint="confluence.search")
+    if response.status_code != 200:
+        logging.error(f"Failed to fetch Confluence pages: {response.status_code} {response.text[:500]}")
+        response.raise_for_status()
+
+    data = response.json()
+    pages = data.get("results", [])
+    metrics.add("confluence.pages", len(pages))
+    logging.info(f"Fetched Confluence page of {len(pages)} pages")
+    return pages, data.get("_links", {}).get("next") if pages else None
+
+# Function to stream a shard's Confluence pages with keyset paging, like
+# iter_jira_issues. Each page is a new search from the newest `lastmodified`
+# seen so far, excluding by id the pages already yielded within its
+# minute-precision overlap, so a page edited mid-run cannot shift an unseen
+# one past the cursor. Only when more than CONFLUENCE_KEYSET_MAX_EXCLUDED
+# pages share that window (a bulk import, say) does the walk follow the
+# search's own `_links.next` until the window has moved on.
+def iter_confluence_pages(since=None, scope=None, until=None):
+    def fetch_page(cursor):
+        keyset, overlap, recent, link = cursor
+        pages, next_link = fetch_confluence_page(confluence_query(keyset, scope, until, overlap, recent), link)
+        if next_link is None:
+            return pages, None
+        modified = {page.get("id"): parse_timestamp(confluence_updated(page)) for page in pages}
+        newest = max(filter(None, modified.values()), default=None)
+        if newest is None:
+            return pages, (keyset, overlap, recent, next_link)
+        # Pages modified before the next search's window cannot match it
+        horizon = newest - timedelta(minutes=CONFLUENCE_KEYSET_OVERLAP_MINUTES + 2)
+        recent = {key: value for key, value in {**recent, **modified}.items() if value is not None and value >= horizon}
+        if len(recent) > CONFLUENCE_KEYSET_MAX_EXCLUDED:
+            return pages, (keyset, overlap, recent, next_link)
+        return pages, (newest, CONFLUENCE_KEYSET_OVERLAP_MINUTES, recent, None)
+
+    pages = iter_pages(fetch_page, (since, CHECKPOINT_OVERLAP_MINUTES, {}, None))
+    return drop_repeated_versions(pages, confluence_updated, CONFLUENCE_KEYSET_OVERLAP_MINUTES, 4 * CONFLUENCE_PAGE_SIZE)
+
+# Function to build the CQL for a shard, like jira_query; `exclude` holds the
+# ids of pages a keyset search must leave out
+def confluence_query(since=None, scope=None, until=None, overlap=CHECKPOINT_OVERLAP_MINUTES, exclude=()):
+    clauses = ["type=page"] + ([scope] if scope else [])
+    if since is not None:
+        clauses.append(f'lastmodified >= now("-{lookback_minutes(since, overlap)}m")')
+    if until is not None:
+        clauses.append(f'lastmodified < now("-{minutes_ago(until)}m")')
+    if exclude:
+        clauses.append(f"id not in ({','.join(sorted(exclude))})")
+    return " and ".join(clauses) + " order by lastmodified asc"
+
+# Function to stream a shard's Confluence pages without attachment analysis
+def iter_confluence_shard(since=None, scope=None, until=None):
+    logging.info(f"Fetching Confluence pages{f' ({scope})' if scope else ''}...")
+    return iter_confluence_pages(since, scope, until)
+
+# Function to fetch Confluence pages including image & document analysis.
+# Incremental runs only search pages modified since the checkpoint, so bodies
+# and attachments are only expanded for pages that actually changed.
+# since=None fetches everything; scope and until narrow it to one shard.
+def fetch_confluence_pages(since=None, scope=None, until=None):
+    count = 0
+    for page in enrich_records(iter_confluence_shard(since, scope, until), confluence_attachment_jobs):
+        count += 1
+        yield page
+    logging.info(f"Fetched {count} Confluence pages")
+
+# Function to move a record's attachment analyses into documents of their
+# own: one per attachment, with the attachment's id and the record as
+# parent_id. The record keeps a compact reference to each; the reference
+# hash changes with the analysis, so the flatten stage sees the record change.
+def split_attachment_analyses(record):
+    analyses = record.pop(ANALYSES_FIELD, None)
+    if analyses is None:
+        return []
+    docs = []
+    refs = []
+    for analysis in analyses:
+        doc = {"id": analysis["attachment_id"], "type": "attachment_analysis", "parent_id": record.get("id"), **analysis}
+        docs.append(doc)
+        refs.append({"id": doc["id"], "kind": doc["kind"], "hash": content_hash(doc)[:16]})
+    record["attachment_refs"] = refs
+    return docs
+
+# Function to list tombstones for the stored analyses of a chunk of records
+# that the records no longer reference: attachments that were removed, or
+# replaced by a new version. They expire through the container TTL.
+def stale_attachment_analyses(chunk, analyses):
+    parent_ids = [record["id"] for record in chunk if record.get("id") is not None]
+    if not parent_ids:
+        return []
+    live = {(doc["parent_id"], doc["id"]) for doc in analyses}
+    query = "SELECT c.id, c.parent_id, c.is_deleted FROM c WHERE ARRAY_CONTAINS(@ids, c.parent_id)"
+    stale = []
+    for item in attachment_container().query_items(query=query, parameters=[{"name": "@ids", "value": parent_ids}],
+                                                   enable_cross_partition_query=True):
+        if not item.get("is_deleted") and (item["parent_id"], item["id"]) not in live:
+            stale.append({"id": item["id"], "type": "attachment_analysis", "parent_id": item["parent_id"],
+                          "is_deleted": True, "ttl": ATTACHMENT_TOMBSTONE_TTL})
+    if stale:
+        metrics.add("attachments.tombstoned", len(stale))
+    return stale
+
+# Function to store the attachment analyses of each chunk of records before
+# passing the records on, so a stored record never references an analysis
+# that is not there yet. Unchanged analyses are skipped by content hash. A
+# record with an analysis that could not be stored is not passed on but
+# given to on_failed, so it is fetched (or redelivered) and stored again.
+def store_attachment_analyses(records, on_failed=None):
+    failed_parents = set()
+    writer = CosmosBatchWriter(attachment_container(), partition_key="/parent_id", hash_index=attachment_hash_index(),
+                               metrics=metrics, metrics_name="attachments",
+                               on_failed=lambda doc: failed_parents.add(doc["parent_id"]))
+
+    def stored(chunk, analyses):
+        writer.write_all(analyses + stale_attachment_analyses(chunk, analyses))
+        for record in chunk:
+            if record.get("id") not in failed_parents:
+                yield record
+            elif on_failed is not None:
+                on_failed(record)
+        failed_parents.clear()
+
+    chunk, analyses = [], []
+    for record in records:
+        chunk.append(record)
+        analyses.extend(split_attachment_analyses(record))
+        if len(chunk) >= COSMOS_WRITE_BATCH:
+            yield from stored(chunk, analyses)
+            chunk, analyses = [], []
+    if chunk:
+        yield from stored(chunk, analyses)
+    logging.info(f"Stored attachment analyses: {writer.stats}")
+
+# Function to store data in CosmosDB in parallel batches. Records whose
+# content hash matches the stored copy are skipped. on_stored(record) is
+# called after each successful (or skipped) write and on_failed(record) for
+# each record that could not be stored, in input order, so callers
+# can track progress. Records that cannot be written go to the dead-letter file.
+def store_data_in_cosmosdb(data, on_stored=None, on_failed=None):
     logging.info("Storing data in CosmosDB...")
-    for record in data:
+    stats = CosmosBatchWriter(cosmos_container(), on_written=on_stored, on_failed=on_failed,
+                              hash_index=content_hash_index(),
+                              metrics=metrics).write_all(store_attachment_analyses(data, on_failed))
+    logging.info(f"Stored data in CosmosDB: {stats}")
+    return stats
+
+# Functions returning the last-modified time of a record, used for checkpoints
+def jira_updated(issue):
+    return issue.get("fields", {}).get("updated")
+
+def confluence_updated(page):
+    return page.get("version", {}).get("when")
+
+# Function to list the keys of every Jira project, for sharding by project
+@metrics.timed("jira.list_projects")
+def jira_project_keys():
+    if JIRA_PROJECTS:
+        return JIRA_PROJECTS
+    keys = []
+    start_at = 0
+    while True:
+        response = jira_http.get(f"{JIRA_API_URL}/project/search", params={"startAt": start_at, "maxResults": 50},
+                                 endpoint="jira.projects")
+        if response.status_code != 200:
+            logging.error(f"Failed to list Jira projects: {response.status_code} {response.text[:500]}")
+            response.raise_for_status()
+        page = response.json()
+        values = page.get("values", [])
+        keys.extend(project["key"] for project in values)
+        if page.get("isLast", True) or not values:
+            return keys
+        start_at += len(values)
+
+# Function to list the keys of every Confluence space, for sharding by space
+@metrics.timed("confluence.list_spaces")
+def confluence_space_keys():
+    if CONFLUENCE_SPACES:
+        return CONFLUENCE_SPACES
+    keys = []
+    url, params = f"{CONFLUENCE_API_URL.rstrip('/')}/rest/api/space", {"limit": 100}
+    while url:
+        response = confluence_http.get(url, params=params, endpoint="confluence.spaces")
+        if response.status_code != 200:
+            logging.error(f"Failed to list Confluence spaces: {response.status_code} {response.text[:500]}")
+            response.raise_for_status()
+        data = response.json()
+        keys.extend(space["key"] for space in data.get("results", []))
+        next_link = data.get("_links", {}).get("next")
+        url, params = (CONFLUENCE_API_URL.rstrip("/") + next_link, None) if next_link else (None, None)
+    return keys
+
+# source -> (fetch, last-modified getter, shard key lister, shard scope clause)
+SOURCES = {
+    "jira": (fetch_jira_tickets, jira_updated, jira_project_keys, 'project = "{}"'),
+    "confluence": (fetch_confluence_pages, confluence_updated, confluence_space_keys, 'space = "{}"'),
+}
+
+# source -> (shard stream without attachment analysis, attachment jobs of a
+# record): the fetch and enrich halves of SOURCES' fetch, for the work queues
+SOURCE_STAGES = {
+    "jira": (iter_jira_shard, jira_attachment_jobs),
+    "confluence": (iter_confluence_shard, confluence_attachment_jobs),
+}
+
+# Function to load a shard's checkpoint; project/space shards start from the
+# unsharded source's progress the first time they run
+def load_shard_checkpoint(shard):
+    inherit_from = shard.source if shard.key is not None and shard.parent is None else None
+    return load_checkpoint(sync_state_container(), shard.id, SOURCES[shard.source][1], inherit_from)
+
+# A backfill slice is done once a run over it has completed; its watermark
+# (that run's start) is then past the slice's end
+def slice_complete(checkpoint):
+    return bool(checkpoint.doc.get("watermark")) and not checkpoint.doc.get("cursor")
+
+# Function to list the shards a run of `source` should sync. A shard that has
+# never completed a run is replaced by its backfill slices when slicing is
+# configured; once every slice is done, the shard continues incrementally
+# from the last slice's watermark.
+def plan_shards(source):
+    _, _, list_keys, scope = SOURCES[source]
+    if SYNC_SHARD_BY == "project":
+        shards = [Shard(source, key, scope.format(key)) for key in list_keys()]
+    else:
+        shards = [Shard(source)]
+    if SYNC_BACKFILL_SLICE_DAYS <= 0 or not SYNC_BACKFILL_START:
+        return shards
+    planned = []
+    for shard in shards:
+        checkpoint = load_shard_checkpoint(shard)
+        if checkpoint.since is not None:
+            planned.append(shard)
+            continue
+        slices = backfill_slices(shard, parse_start(SYNC_BACKFILL_START), SYNC_BACKFILL_SLICE_DAYS)
+        pending = [part for part in slices if not slice_complete(load_shard_checkpoint(part))]
+        if pending:
+            planned.extend(pending)
+            continue
         try:
-            container.upsert_item(record)
-        except Exception as e:
-            logging.error(f"Error inserting record: {str(e)}")
+            checkpoint.complete(watermark=load_shard_checkpoint(slices[-1]).doc["watermark"])
+        except CosmosResourceExistsError:
+            pass  # promoted by a concurrent run
+        planned.append(shard)
+    return planned
+
+# Function to sync one shard from its checkpoint while holding its lease.
+# Progress is saved as records are stored, so a failed run resumes where it
+# stopped; the watermark only moves once everything has been stored. A
+# record that could not be stored holds the cursor below it and fails the
+# shard, so the next run fetches it again. With work queues, a record counts
+# as stored once it is on its enrich queue; the queue then guarantees it
+# reaches Cosmos DB.
+def sync_shard(shard, lease):
+    checkpoint = load_shard_checkpoint(shard)
+    since = checkpoint.since or shard.start
+    queues = work_queues()
+    failed = []
+
+    def on_stored(record):
+        if lease.lost:
+            raise LeaseLost(f"lease on shard {shard.id} lost")
+        # Records arrive in update order, so nothing past a failed one is safe to checkpoint
+        if not failed:
+            checkpoint.advance(record)
+
+    try:
+        if queues is None:
+            # Closed explicitly so a failed store cancels the shard's attachment analysis at once
+            with closing(SOURCES[shard.source][0](since, shard.scope, shard.end)) as records:
+                store_data_in_cosmosdb(records, on_stored=on_stored, on_failed=failed.append)
+            if failed:
+                raise RuntimeError(f"{len(failed)} records of shard {shard.id} could not be stored, "
+                                   f"first {failed[0].get('id')}; the next run fetches them again")
+        else:
+            queue = queues[f"enrich-{shard.source}"]
+            for record in SOURCE_STAGES[shard.source][0](since, shard.scope, shard.end):
+                queue.put(record)
+                on_stored(record)
+    except Exception:
+        if not lease.lost:
+            checkpoint.save()
+        raise
+    checkpoint.complete()
+
+# Function to run the enrich stage of a source: records from its enrich
+# queue get their attachments analysed and go on to the store queue; each
+# message is acked once its record is on the store queue
+def enrich_stage(source, messages):
+    queues = work_queues()
+    pending = {}
+
+    def records():
+        for message in messages:
+            pending[id(message.body)] = message
+            yield message.body
+
+    with closing(enrich_records(records(), SOURCE_STAGES[source][1], abort=queues.aborted)) as enriched:
+        for record in enriched:
+            queues["store"].put(record)
+            queues[f"enrich-{source}"].ack(pending.pop(id(record)))
+
+# Function to run the store stage: records from the store queue are written
+# to Cosmos DB and each message is acked once its record is stored. A record
+# that cannot be written is not acked, so it is retried on redelivery until
+# it lands in the poison queue.
+def store_stage(messages):
+    queue = work_queues()["store"]
+    pending = {}
+
+    def records():
+        for message in messages:
+            pending[id(message.body)] = message
+            yield message.body
+
+    store_data_in_cosmosdb(records(), on_stored=lambda record: queue.ack(pending.pop(id(record))))
+
+# Function to run the shards with the stages joined by work queues: shard
+# workers fill the per-source enrich queues while the enrich and store stages
+# drain them on their own threads, so records are stored as they become ready
+# and a full queue slows down the stage feeding it. Messages left behind by a
+# run that died are picked up as well. Returns the shard outcomes and raises
+# if a stage failed.
+def run_queued(sources, shards, lease_store):
+    queues = work_queues()
+    fetched, enriched = threading.Event(), threading.Event()
+    with ThreadPoolExecutor(max_workers=len(sources) + 1, thread_name_prefix="sync-stage") as pool:
+        enrich_stages = [pool.submit(enrich_stage, source, queues[f"enrich-{source}"].consume(fetched))
+                         for source in sources]
+        stages = enrich_stages + [pool.submit(store_stage, queues["store"].consume(enriched))]
+        # A failed stage stops the others rather than leave them blocked on a full queue
+        for stage in stages:
+            stage.add_done_callback(lambda stage: stage.exception() is not None and queues.abort())
+        try:
+            return run_shards(shards, sync_shard, lease_store, SYNC_WORKERS)
+        finally:
+            fetched.set()
+            wait(enrich_stages)
+            enriched.set()
+            wait(stages)
+            errors = [stage.exception() for stage in stages if stage.exception() is not None]
+            if errors:
+                # Report the stage that failed, not the ones it aborted
+                raise next((e for e in errors if not isinstance(e, QueueAborted)), errors[0])
+
+# Function to sync the given sources: their shards are planned, leased and
+# synced on SYNC_WORKERS threads, through the work queues when they are
+# enabled. Every run ends with a machine-readable run summary, and is
+# profiled when PROFILE_DIR is set. Raises if any shard failed.
+def sync_sources(*sources):
+    http_stats.reset()
+    image_stats.reset()
+    metrics.reset()
+    outcomes = {}
+    failed = []
+    outcome = "failed"
+    queues = None
+    try:
+        with profiled(f"sync-{'-'.join(sources)}"):
+            queues = work_queues()
+            if queues is not None:
+                queues.reset()
+            shards = [shard for source in sources for shard in plan_shards(source)]
+            logging.info(f"Syncing {len(shards)} shards of {', '.join(sources)} on {SYNC_WORKERS} workers")
+            lease_store = open_lease_store(sync_state_container())
+            if queues is None:
+                outcomes = run_shards(shards, sync_shard, lease_store, SYNC_WORKERS)
+            else:
+                outcomes = run_queued(sources, shards, lease_store)
+        failed = sorted(shard_id for shard_id, result in outcomes.items() if result not in ("completed", "skipped"))
+        outcome = "failed" if failed else "completed"
+    finally:
+        http_stats.log()
+        logging.info(f"Images: {image_stats}")
+        metrics.write_summary(sources=list(sources), outcome=outcome, shards=outcomes, http=http_stats.summary(),
+                              images=image_stats.summary(), queues=queues.summary() if queues is not None else None)
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(outcomes)} shards failed: {', '.join(failed[:20])}")
+
+# Function to sync one source
+def sync_source(source):
+    sync_sources(source)
 
 
 #for tmer triggered function
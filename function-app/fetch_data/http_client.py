@@ -0,0 +1,224 @@
+"""
+Shared HTTP client for Jira, Confluence and attachment downloads.
+
+Each HttpClient keeps one requests.Session, so connections are pooled per
+host and reused across pages, attachments and warm invocations. Requests
+carry connect/read timeouts and are retried on connection errors, 429 and
+5xx responses: after the server's Retry-After when it sends one, otherwise
+with jittered exponential backoff. A RateLimiter holds one token bucket
+per host; clients for the same Atlassian site share it, so Jira and
+Confluence traffic together stay under the site's request rate, and a 429
+pauses every caller of that host rather than just the one that saw it.
+
+HttpStats collects per-endpoint request counts, retries, throttles and
+latency percentiles for the run log and the machine-readable run summary.
+"""
+import os
+import re
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import SpanStats
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "60"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+# Atlassian Cloud rate limits are per site and user; 10 requests/s with short
+# bursts keeps a single sync well clear of them
+ATLASSIAN_RATE_PER_SECOND = float(os.getenv("ATLASSIAN_RATE_PER_SECOND", "10"))
+ATLASSIAN_BURST = int(os.getenv("ATLASSIAN_BURST", "20"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_NUMERIC_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+class TokenBucket:
+    """Blocking token bucket; rate tokens per second up to burst, with a shared pause after throttling."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class RateLimiter:
+    """One TokenBucket per host, created on first use."""
+
+    def __init__(self, rate=ATLASSIAN_RATE_PER_SECOND, burst=ATLASSIAN_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host):
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+
+class EndpointStats(SpanStats):
+    """The latency span of an endpoint's requests, plus its retries and throttled responses."""
+
+    def __init__(self):
+        super().__init__()
+        self.retries = 0
+        self.throttled = 0
+
+    @property
+    def requests(self):
+        return self.count
+
+    def summary(self):
+        span = super().summary()
+        del span["count"]
+        return {"requests": self.count, "retries": self.retries, "throttled": self.throttled, **span}
+
+    def __str__(self):
+        mean = self.seconds / self.requests if self.requests else 0.0
+        return (f"{self.requests} requests, {self.retries} retries, {self.throttled} throttled, {self.errors} errors, "
+                f"mean {mean * 1000:.0f} ms, p50 {self.percentile(0.5) * 1000:.0f} ms, "
+                f"p99 {self.percentile(0.99) * 1000:.0f} ms")
+
+
+class HttpStats:
+    """Per-endpoint request statistics, shared by every client of a run."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds=None, retry=False, throttled=False, error=False):
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, EndpointStats())
+            if seconds is not None:
+                stats.add(seconds)
+            stats.retries += retry
+            stats.throttled += throttled
+            stats.errors += error
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+
+    def summary(self):
+        with self._lock:
+            return {endpoint: stats.summary() for endpoint, stats in sorted(self.endpoints.items())}
+
+    def log(self):
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+        for endpoint, stats in endpoints:
+            logging.info(f"HTTP {endpoint}: {stats}")
+
+
+# Function to read a Retry-After header (seconds or an HTTP date) as seconds
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """
+    Pooled, retrying, rate-limited GETs with optional basic auth. get()
+    returns the final response, so non-retryable statuses (and retryable
+    ones that ran out of retries) reach the caller's status checks; only
+    connection errors and timeouts that outlast the retries are raised.
+    """
+
+    def __init__(self, auth=None, rate_limiter=None, stats=None, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, max_retries=HTTP_MAX_RETRIES,
+                 backoff_max=HTTP_BACKOFF_MAX_SECONDS, pool_size=HTTP_POOL_SIZE):
+        self.session = requests.Session()
+        self.session.auth = auth
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.rate_limiter = rate_limiter
+        self.stats = stats if stats is not None else HttpStats()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_max = backoff_max
+
+    def get(self, url, params=None, endpoint=None, **kwargs):
+        host = urlsplit(url).netloc
+        endpoint = endpoint or host + _NUMERIC_SEGMENT.sub("/{id}", urlsplit(url).path)
+        bucket = self.rate_limiter.bucket(host) if self.rate_limiter is not None else None
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.stats.record(endpoint, time.monotonic() - started, error=attempt >= self.max_retries)
+                if attempt >= self.max_retries:
+                    raise
+                logging.warning(f"GET {endpoint} failed ({str(e)[:200]}), retrying")
+                delay = self._backoff(attempt)
+            else:
+                elapsed = time.monotonic() - started
+                status = response.status_code
+                if status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    self.stats.record(endpoint, elapsed, throttled=status == 429, error=status >= 400)
+                    return response
+                self.stats.record(endpoint, elapsed, throttled=status == 429)
+                retry_after = retry_after_seconds(response)
+                delay = min(retry_after, self.backoff_max) if retry_after is not None else self._backoff(attempt)
+                if status == 429 and bucket is not None:
+                    # Everyone sharing the host backs off, not just this caller
+                    bucket.pause(delay)
+                logging.warning(f"GET {endpoint} returned {status}, retrying in {delay:.1f}s")
+                response.close()
+            attempt += 1
+            self.stats.record(endpoint, retry=True)
+            time.sleep(delay)
+
+    def _backoff(self, attempt):
+        return min(self.backoff_max, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def close(self):
+        self.session.close()
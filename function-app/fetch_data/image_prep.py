@@ -0,0 +1,187 @@
+"""
+Streamed, size-capped image preparation for Vision analysis.
+
+Attachments are streamed in 64KB chunks instead of being read whole. A
+download stops as soon as its Content-Length or the bytes received pass
+IMAGE_MAX_MB. The first bytes are sniffed, so a file that is not in a
+format Image Analysis accepts is dropped before the rest of it is read.
+When Pillow is installed, images larger than IMAGE_MAX_DIMENSION on their
+longest side, or heavier than IMAGE_REENCODE_ABOVE_KB, are downscaled and
+re-encoded as JPEG before being sent. JPEGs are decoded straight at the
+reduced scale, so a large photo is never expanded to full size in memory.
+Tags (and Read) results do not improve beyond that resolution.
+
+Every image records the bytes downloaded, the bytes sent and an estimate of
+its peak memory: the download buffer plus the decoded and resized pixel
+buffers plus the re-encoded output. Pillow allocates outside the Python
+heap, which is why this is an estimate rather than a tracemalloc reading.
+"""
+import io
+import os
+import logging
+import threading
+
+IMAGE_MAX_BYTES = int(float(os.getenv("IMAGE_MAX_MB", "20")) * 1024 * 1024)
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2048"))
+IMAGE_REENCODE_ABOVE = int(float(os.getenv("IMAGE_REENCODE_ABOVE_KB", "512")) * 1024)
+IMAGE_DOWNSCALE = os.getenv("IMAGE_DOWNSCALE", "true").lower() == "true"
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+DOWNLOAD_CHUNK = 64 * 1024
+# Image Analysis rejects images smaller than this on either side
+MIN_DIMENSION = 50
+
+# Leading bytes of the formats Image Analysis 4.0 accepts
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"\x00\x00\x01\x00", "image/x-icon"),
+    (b"BM", "image/bmp"),
+)
+
+
+# Function to identify an image format from its first bytes; None if unsupported
+def sniff_image_type(head):
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in _SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return None
+
+
+class PreparedImage:
+    """Bytes ready to send to Vision, with what it cost to produce them."""
+
+    def __init__(self, data, mime, downloaded, peak, size=None, downscaled=False):
+        self.data = data
+        self.mime = mime
+        self.downloaded = downloaded
+        self.sent = len(data)
+        self.peak = peak
+        self.size = size
+        self.downscaled = downscaled
+
+
+class ImageStats:
+    def __init__(self):
+        self.reset()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.images = 0
+        self.downscaled = 0
+        self.skipped = {}
+        self.downloaded = 0
+        self.sent = 0
+        self.peak = 0
+
+    def add(self, prepared):
+        with self._lock:
+            self.images += 1
+            self.downscaled += prepared.downscaled
+            self.downloaded += prepared.downloaded
+            self.sent += prepared.sent
+            self.peak = max(self.peak, prepared.peak)
+
+    def skip(self, reason, downloaded=0):
+        with self._lock:
+            self.skipped[reason] = self.skipped.get(reason, 0) + 1
+            self.downloaded += downloaded
+
+    def summary(self):
+        with self._lock:
+            return {"images": self.images, "downscaled": self.downscaled, "downloaded_bytes": self.downloaded,
+                    "sent_bytes": self.sent, "peak_bytes": self.peak, "skipped": dict(self.skipped)}
+
+    def __str__(self):
+        skipped = ", ".join(f"{count} {reason}" for reason, count in sorted(self.skipped.items())) or "none"
+        return (f"{self.images} images ({self.downscaled} downscaled), {self.downloaded / 2**20:.1f} MiB downloaded, "
+                f"{self.sent / 2**20:.1f} MiB sent, largest per-image peak ~{self.peak / 2**20:.1f} MiB, skipped: {skipped}")
+
+
+# Function to read a streamed response into memory, stopping at max_bytes or
+# as soon as the first bytes show it is not an image. Returns (data, mime,
+# skip reason, bytes downloaded); data is None when the download was abandoned.
+def read_image(response, max_bytes=IMAGE_MAX_BYTES):
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        return None, None, "over size cap", 0
+    buffer = bytearray()
+    mime = None
+    for chunk in response.iter_content(DOWNLOAD_CHUNK):
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            return None, None, "over size cap", len(buffer)
+        if mime is None and len(buffer) >= 12:
+            mime = sniff_image_type(bytes(buffer[:12]))
+            if mime is None:
+                return None, None, "not an image", len(buffer)
+    if mime is None:
+        mime = sniff_image_type(bytes(buffer))
+        if mime is None:
+            return None, None, "not an image", len(buffer)
+    return bytes(buffer), mime, None, len(buffer)
+
+
+# Function to downscale and re-encode an image when that makes it smaller.
+# Returns (data, mime, (width, height), decoded bytes, downscaled?); without
+# Pillow, or for images it cannot decode, the original bytes come back.
+def shrink_image(data, mime, max_dimension=IMAGE_MAX_DIMENSION, reencode_above=IMAGE_REENCODE_ABOVE,
+                 quality=IMAGE_JPEG_QUALITY):
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, mime, None, 0, False
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            size = image.size
+            if max(size) <= max_dimension and len(data) <= reencode_above:
+                return data, mime, size, 0, False
+            # JPEGs decode at a reduced scale when the target is much smaller
+            image.draft("RGB", (max_dimension, max_dimension))
+            image.load()
+            decoded = image.width * image.height * len(image.getbands())
+            image.thumbnail((max_dimension, max_dimension), reducing_gap=2.0)
+            if image.mode not in ("RGB", "L"):
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, "white")
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            decoded += image.width * image.height * len(image.getbands())
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=quality)
+    except Exception as e:
+        logging.warning(f"Could not downscale {mime} image, sending it as is: {str(e)[:200]}")
+        return data, mime, None, 0, False
+    encoded = out.getvalue()
+    if len(encoded) >= len(data) and max(size) <= max_dimension:
+        return data, mime, size, decoded, False
+    return encoded, "image/jpeg", size, decoded + len(encoded), True
+
+
+# Function to turn a streamed attachment response into a PreparedImage, or
+# None (recorded in stats) when it is too large, not an image or too small.
+def prepare_image(response, stats=None, downscale=IMAGE_DOWNSCALE, max_bytes=IMAGE_MAX_BYTES):
+    data, mime, reason, downloaded = read_image(response, max_bytes)
+    response.close()
+    if data is None:
+        if stats is not None:
+            stats.skip(reason, downloaded)
+        return None
+    size, extra, downscaled = None, 0, False
+    if downscale:
+        data_out, mime, size, extra, downscaled = shrink_image(data, mime)
+    else:
+        data_out = data
+    if size is not None and min(size) < MIN_DIMENSION:
+        if stats is not None:
+            stats.skip("too small", downloaded)
+        return None
+    prepared = PreparedImage(data_out, mime, downloaded, downloaded + extra, size, downscaled)
+    if stats is not None:
+        stats.add(prepared)
+    return prepared
@@ -0,0 +1,296 @@
+"""
+Sharded, lease-coordinated sync.
+
+A source is synced as one or more shards: the whole source, or one shard per
+Jira project / Confluence space (SYNC_SHARD_BY=project). The first backfill
+of a shard can be split further into time slices of SYNC_BACKFILL_SLICE_DAYS
+from SYNC_BACKFILL_START, each synced as a shard of its own. Every shard has
+its own checkpoint, and a pool of SYNC_WORKERS threads works through them.
+
+Before a worker syncs a shard it claims a lease on it: a document in the
+sync state container (or, for local runs, a file in SYNC_LEASE_DIR) naming
+the owner and an expiry. The lease is renewed while the shard runs and
+released afterwards, and a run that finds a shard leased by someone else
+skips it. Overlapping timer runs, or several Function instances started
+together, therefore divide the shards between them instead of processing
+them twice. A lease left behind by a crashed worker expires after
+SYNC_LEASE_SECONDS, and the next run picks the shard up from its checkpoint.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import (CosmosAccessConditionFailedError, CosmosResourceExistsError,
+                                     CosmosResourceNotFoundError)
+
+# "none" syncs each source as one shard; "project" shards Jira by project and Confluence by space
+SYNC_SHARD_BY = os.getenv("SYNC_SHARD_BY", "none")
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "4"))
+SYNC_LEASE_BACKEND = os.getenv("SYNC_LEASE_BACKEND", "cosmos")
+SYNC_LEASE_DIR = os.getenv("SYNC_LEASE_DIR", os.path.join(tempfile.gettempdir(), "cloudsage-leases"))
+SYNC_LEASE_SECONDS = float(os.getenv("SYNC_LEASE_SECONDS", "300"))
+SYNC_BACKFILL_START = os.getenv("SYNC_BACKFILL_START", "")
+SYNC_BACKFILL_SLICE_DAYS = float(os.getenv("SYNC_BACKFILL_SLICE_DAYS", "0"))
+
+# A lock file older than this was left by a crashed process and is broken
+FILE_LOCK_STALE_SECONDS = 30
+
+
+class LeaseLost(RuntimeError):
+    """Raised when a shard's lease could not be renewed, so another run may now own it."""
+
+
+class Shard:
+    """
+    One independently checkpointed part of a source's sync. scope is the
+    JQL/CQL clause selecting its records (None for the whole source). A
+    backfill slice also has a fixed start and, unless it is the last slice,
+    an end.
+    """
+
+    def __init__(self, source, key=None, scope=None, start=None, end=None, parent=None):
+        self.source = source
+        self.key = key
+        self.scope = scope
+        self.start = start
+        self.end = end
+        self.parent = parent
+        base = parent.id if parent is not None else (source if key is None else f"{source}:{key}")
+        self.id = f"{base}@{start.strftime('%Y%m%dT%H%M')}" if parent is not None else base
+
+    def __repr__(self):
+        return f"Shard({self.id})"
+
+
+# Function to parse SYNC_BACKFILL_START (an ISO date or time, UTC unless it says otherwise)
+def parse_start(value):
+    start = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+
+
+# Function to split a shard's backfill into slices of slice_days from start;
+# the last slice is open-ended so it also picks up changes made during the backfill
+def backfill_slices(shard, start, slice_days, now=None):
+    now = now or datetime.now(timezone.utc)
+    step = timedelta(days=slice_days)
+    slices = []
+    while start + step <= now:
+        slices.append(Shard(shard.source, shard.key, shard.scope, start, start + step, parent=shard))
+        start += step
+    slices.append(Shard(shard.source, shard.key, shard.scope, start, None, parent=shard))
+    return slices
+
+
+class Lease:
+    def __init__(self, shard_id, owner, expires, etag):
+        self.shard_id = shard_id
+        self.owner = owner
+        self.expires = expires
+        self.etag = etag
+        self.lost = False
+
+
+class CosmosLeaseStore:
+    """Leases as documents (id "lease:<shard id>") in a container partitioned on /id, updated with etag checks."""
+
+    def __init__(self, container, seconds=SYNC_LEASE_SECONDS, owner=None):
+        self.container = container
+        self.seconds = seconds
+        self.owner = owner or new_owner()
+
+    def _body(self, shard_id, expires):
+        return {"id": f"lease:{shard_id}", "type": "sync_lease", "shard": shard_id, "owner": self.owner,
+                "expires": expires}
+
+    def acquire(self, shard_id):
+        """Returns a Lease, or None while another owner holds an unexpired lease on the shard."""
+        doc_id = f"lease:{shard_id}"
+        body = self._body(shard_id, time.time() + self.seconds)
+        try:
+            current = self.container.read_item(item=doc_id, partition_key=doc_id)
+        except CosmosResourceNotFoundError:
+            try:
+                stored = self.container.create_item(body=body)
+            except CosmosResourceExistsError:
+                return None
+            return Lease(shard_id, self.owner, body["expires"], stored["_etag"])
+        if current.get("expires", 0) > time.time():
+            return None
+        try:
+            stored = self.container.replace_item(item=doc_id, body=body, etag=current["_etag"],
+                                                 match_condition=MatchConditions.IfNotModified)
+        except CosmosAccessConditionFailedError:
+            return None
+        return Lease(shard_id, self.owner, body["expires"], stored["_etag"])
+
+    def renew(self, lease):
+        """Extends the lease; False when it has been taken over or removed."""
+        body = self._body(lease.shard_id, time.time() + self.seconds)
+        try:
+            stored = self.container.replace_item(item=body["id"], body=body, etag=lease.etag,
+                                                 match_condition=MatchConditions.IfNotModified)
+        except (CosmosAccessConditionFailedError, CosmosResourceNotFoundError):
+            return False
+        lease.etag, lease.expires = stored["_etag"], body["expires"]
+        return True
+
+    def release(self, lease):
+        body = self._body(lease.shard_id, 0)
+        try:
+            self.container.replace_item(item=body["id"], body=body, etag=lease.etag,
+                                        match_condition=MatchConditions.IfNotModified)
+        except (CosmosAccessConditionFailedError, CosmosResourceNotFoundError):
+            pass
+
+
+class FileLeaseStore:
+    """
+    Local stand-in for CosmosLeaseStore: one JSON file per lease in a
+    directory, read and written under a directory-wide lock file, so separate
+    processes on one machine coordinate the same way Function instances do.
+    """
+
+    def __init__(self, directory=SYNC_LEASE_DIR, seconds=SYNC_LEASE_SECONDS, owner=None):
+        self.directory = directory
+        self.seconds = seconds
+        self.owner = owner or new_owner()
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        path = os.path.join(self.directory, ".lock")
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > FILE_LOCK_STALE_SECONDS:
+                        os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(path)
+
+    def _path(self, shard_id):
+        return os.path.join(self.directory, shard_id.replace(":", "_").replace("/", "_") + ".json")
+
+    def _read(self, shard_id):
+        try:
+            with open(self._path(shard_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, shard_id, expires):
+        doc = {"shard": shard_id, "owner": self.owner, "expires": expires, "etag": uuid.uuid4().hex}
+        temp = self._path(shard_id) + f".{os.getpid()}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(doc, f)
+        os.replace(temp, self._path(shard_id))
+        return doc
+
+    def acquire(self, shard_id):
+        with self._locked():
+            current = self._read(shard_id)
+            if current is not None and current.get("expires", 0) > time.time():
+                return None
+            doc = self._write(shard_id, time.time() + self.seconds)
+        return Lease(shard_id, self.owner, doc["expires"], doc["etag"])
+
+    def renew(self, lease):
+        with self._locked():
+            current = self._read(lease.shard_id)
+            if current is None or current.get("etag") != lease.etag:
+                return False
+            doc = self._write(lease.shard_id, time.time() + self.seconds)
+        lease.etag, lease.expires = doc["etag"], doc["expires"]
+        return True
+
+    def release(self, lease):
+        with self._locked():
+            current = self._read(lease.shard_id)
+            if current is not None and current.get("etag") == lease.etag:
+                self._write(lease.shard_id, 0)
+
+
+# Function to name the owner of a run's leases: instance, process and a per-run suffix
+def new_owner():
+    return f"{os.getenv('WEBSITE_INSTANCE_ID') or socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# Function to open the configured lease store
+def open_lease_store(container=None):
+    if SYNC_LEASE_BACKEND == "file":
+        return FileLeaseStore()
+    return CosmosLeaseStore(container)
+
+
+# Context manager renewing a lease every third of its duration while the
+# block runs and releasing it afterwards. lease.lost is set once it can no
+# longer be renewed (or has expired while renewals kept failing).
+@contextmanager
+def held(store, lease):
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(store.seconds / 3):
+            try:
+                renewed = store.renew(lease)
+            except Exception as e:
+                logging.warning(f"Could not renew the lease on shard {lease.shard_id}: {str(e)[:200]}")
+                renewed = None
+            if renewed is False or time.time() > lease.expires:
+                lease.lost = True
+                logging.error(f"Lost the lease on shard {lease.shard_id}; stopping its sync")
+                return
+
+    thread = threading.Thread(target=renew, name=f"lease-{lease.shard_id}", daemon=True)
+    thread.start()
+    try:
+        yield lease
+    finally:
+        stop.set()
+        thread.join()
+        try:
+            store.release(lease)
+        except Exception as e:
+            logging.warning(f"Could not release the lease on shard {lease.shard_id}: {str(e)[:200]}")
+
+
+# Function to run sync_shard(shard, lease) for every shard this run can lease,
+# on `workers` threads. Returns {shard id: "completed" | "skipped" | "failed" | "lease lost"}.
+def run_shards(shards, sync_shard, store, workers=SYNC_WORKERS):
+    def run(shard):
+        try:
+            lease = store.acquire(shard.id)
+        except Exception as e:
+            logging.error(f"Could not lease shard {shard.id}: {str(e)[:500]}")
+            return "failed"
+        if lease is None:
+            logging.info(f"Shard {shard.id} is leased by another run, skipping it")
+            return "skipped"
+        with held(store, lease):
+            try:
+                sync_shard(shard, lease)
+            except Exception as e:
+                logging.error(f"Sync of shard {shard.id} failed: {str(e)[:500]}")
+                return "lease lost" if lease.lost else "failed"
+        return "completed"
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sync-shard") as pool:
+        return dict(zip([shard.id for shard in shards], pool.map(run, shards)))
@@ -0,0 +1,339 @@
+"""
+Durable work queues between the sync stages.
+
+A sync run is split into stages joined by queues: shard workers fetch
+records into a per-source "enrich" queue, an enrich stage per source
+analyses their attachments and passes them on to the "store" queue, and the
+store stage writes them to Cosmos DB. A stage acks (deletes) a message only
+once its output is durable in the next queue or in Cosmos DB, so a crash at
+any point redelivers the message to the next consumer instead of losing it
+(at-least-once; every stage is idempotent). A message delivered more than
+WORK_QUEUE_MAX_ATTEMPTS times is moved to the queue's "-poison" queue.
+
+put() blocks while a queue holds WORK_QUEUE_MAX_DEPTH messages, so a slow
+stage holds back the ones feeding it instead of letting the backlog grow
+without bound. The depth counts messages a consumer has received but not yet
+acked, so it must stay well above what a stage holds in flight (the enrich
+window, or four write chunks for the store stage).
+
+Locally the default backend is a SQLite file, which separate processes on
+one machine can share. On Azure (WEBSITE_INSTANCE_ID is set) the default is
+storage: Azure Storage Queues on the Function's storage account, with
+messages too large for a queue message kept in a blob that the message
+names. A shard's checkpoint advances once its records are queued, so the
+queue must outlive the instance; an instance's temp directory does not.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import tempfile
+import threading
+
+WORK_QUEUE_BACKEND = os.getenv("WORK_QUEUE_BACKEND", "storage" if os.getenv("WEBSITE_INSTANCE_ID") else "sqlite")
+WORK_QUEUE_PATH = os.getenv("WORK_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "cloudsage-work-queue.sqlite3"))
+WORK_QUEUE_CONNECTION = os.getenv("WORK_QUEUE_CONNECTION") or os.getenv("AzureWebJobsStorage", "")
+WORK_QUEUE_PREFIX = os.getenv("WORK_QUEUE_PREFIX", "cloudsage")
+WORK_QUEUE_BLOB_CONTAINER = os.getenv("WORK_QUEUE_BLOB_CONTAINER", "cloudsage-work")
+WORK_QUEUE_MAX_DEPTH = int(os.getenv("WORK_QUEUE_MAX_DEPTH", "1000"))
+WORK_QUEUE_VISIBILITY_SECONDS = float(os.getenv("WORK_QUEUE_VISIBILITY_SECONDS", "600"))
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "5"))
+WORK_QUEUE_POLL_SECONDS = float(os.getenv("WORK_QUEUE_POLL_SECONDS", "1"))
+
+RECEIVE_BATCH = 32
+# Storage Queue messages are capped at 64 KiB; larger bodies go to a blob
+STORAGE_MESSAGE_MAX_BYTES = 48 * 1024
+
+
+class QueueAborted(RuntimeError):
+    """Raised by put() and consume() once the queues have been aborted because a stage failed."""
+
+
+class Message:
+    def __init__(self, message_id, receipt, body, attempts):
+        self.id = message_id
+        self.receipt = receipt
+        self.body = body
+        self.attempts = attempts
+
+
+class QueueStats:
+    def __init__(self):
+        self.put = 0
+        self.received = 0
+        self.redelivered = 0
+        self.acked = 0
+        self.poisoned = 0
+        self.backpressure_seconds = 0.0
+
+    def summary(self):
+        return {"put": self.put, "received": self.received, "redelivered": self.redelivered, "acked": self.acked,
+                "poisoned": self.poisoned, "backpressure_s": round(self.backpressure_seconds, 3)}
+
+
+class WorkQueue:
+    """Backpressure, polling and poison handling; subclasses implement _send, _receive, _delete and depth."""
+
+    def __init__(self, name, aborted, max_depth=WORK_QUEUE_MAX_DEPTH, visibility=WORK_QUEUE_VISIBILITY_SECONDS,
+                 max_attempts=WORK_QUEUE_MAX_ATTEMPTS, poison=None):
+        self.name = name
+        self.aborted = aborted
+        self.max_depth = max(1, max_depth)
+        self.visibility = visibility
+        self.max_attempts = max_attempts
+        self.poison = poison
+        self.stats = QueueStats()
+        self._lock = threading.Lock()
+        # Puts left before the depth has to be checked again; consumers only ever lower it
+        self._room = 0
+
+    def put(self, body):
+        """Enqueue body (a JSON-serialisable dict), waiting while the queue is full."""
+        with self._lock:
+            if self._room <= 0:
+                started = time.monotonic()
+                delay = 0.01
+                while True:
+                    if self.aborted.is_set():
+                        raise QueueAborted(f"work queue {self.name} was aborted")
+                    depth = self.depth()
+                    if depth < self.max_depth:
+                        self._room = self.max_depth - depth
+                        break
+                    time.sleep(delay)
+                    delay = min(delay * 2, WORK_QUEUE_POLL_SECONDS)
+                self.stats.backpressure_seconds += time.monotonic() - started
+            self._room -= 1
+        self._send(json.dumps(body, default=str))
+        with self._lock:
+            self.stats.put += 1
+
+    def consume(self, done):
+        """
+        Yield messages until `done` is set and no message is left to receive.
+        Messages still in flight elsewhere (received but not acked) do not
+        hold the consumer up; they reappear after the visibility timeout if
+        their consumer dies.
+        """
+        delay = 0.01
+        while True:
+            if self.aborted.is_set():
+                raise QueueAborted(f"work queue {self.name} was aborted")
+            finished = done.is_set()
+            messages = self._receive(RECEIVE_BATCH, self.visibility)
+            if not messages:
+                if finished:
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, WORK_QUEUE_POLL_SECONDS)
+                continue
+            delay = 0.01
+            for message in messages:
+                self.stats.received += 1
+                if message.attempts > 1:
+                    self.stats.redelivered += 1
+                if message.attempts > self.max_attempts:
+                    self._poison(message)
+                    continue
+                yield message
+
+    def ack(self, message):
+        self._delete(message)
+        self.stats.acked += 1
+
+    def _poison(self, message):
+        logging.error(f"Message {message.id} on work queue {self.name} failed {message.attempts - 1} times, "
+                      f"moving it to the poison queue")
+        if self.poison is not None:
+            self.poison.put(message.body)
+        self._delete(message)
+        self.stats.poisoned += 1
+
+
+class SqliteWorkQueue(WorkQueue):
+    """
+    Queue rows in a shared SQLite file. Receiving claims rows by pushing their
+    visible_at past the visibility timeout inside one write transaction, so
+    consumers in several processes never receive the same message at once.
+    """
+
+    def __init__(self, db, name, aborted, **kwargs):
+        super().__init__(name, aborted, **kwargs)
+        self.db = db
+
+    def _send(self, text):
+        with self.db.lock:
+            self.db.conn.execute("INSERT INTO messages (queue, body, visible_at, attempts) VALUES (?, ?, 0, 0)",
+                                 (self.name, text))
+
+    def _receive(self, count, visibility):
+        now = time.time()
+        with self.db.lock:
+            self.db.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.db.conn.execute(
+                    "SELECT id, body, attempts FROM messages WHERE queue = ? AND visible_at <= ? ORDER BY id LIMIT ?",
+                    (self.name, now, count)).fetchall()
+                self.db.conn.executemany("UPDATE messages SET visible_at = ?, attempts = attempts + 1 WHERE id = ?",
+                                         [(now + visibility, row[0]) for row in rows])
+                self.db.conn.execute("COMMIT")
+            except BaseException:
+                self.db.conn.execute("ROLLBACK")
+                raise
+        return [Message(row[0], row[2] + 1, json.loads(row[1]), row[2] + 1) for row in rows]
+
+    def _delete(self, message):
+        # The receipt is the attempt number: an ack from a consumer whose claim
+        # expired and was handed to someone else is ignored, as in Storage Queues
+        with self.db.lock:
+            self.db.conn.execute("DELETE FROM messages WHERE id = ? AND attempts = ?", (message.id, message.receipt))
+
+    def depth(self):
+        with self.db.lock:
+            return self.db.conn.execute("SELECT COUNT(*) FROM messages WHERE queue = ?", (self.name,)).fetchone()[0]
+
+
+class SqliteQueueFile:
+    """One connection to the queue file, shared by every queue of the process."""
+
+    def __init__(self, path=WORK_QUEUE_PATH):
+        self.lock = threading.Lock()
+        # Autocommit; _receive opens its own write transaction
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Commits survive a process crash without an fsync each; only power loss can drop the last few
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, queue TEXT NOT NULL, body TEXT NOT NULL, "
+            "visible_at REAL NOT NULL, attempts INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS messages_queue ON messages (queue, visible_at)")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class StorageWorkQueue(WorkQueue):
+    """Azure Storage Queue named <WORK_QUEUE_PREFIX>-<name>; large bodies are kept in blobs (claim check)."""
+
+    def __init__(self, client, blobs, name, aborted, **kwargs):
+        super().__init__(name, aborted, **kwargs)
+        self.client = client
+        self.blobs = blobs
+
+    def _send(self, text):
+        if len(text.encode("utf-8")) > STORAGE_MESSAGE_MAX_BYTES:
+            blob_name = f"{self.name}/{uuid.uuid4().hex}.json"
+            self.blobs().upload_blob(blob_name, text.encode("utf-8"))
+            text = json.dumps({"blob": blob_name})
+        self.client.send_message(text)
+
+    def _receive(self, count, visibility):
+        messages = []
+        for received in self.client.receive_messages(messages_per_page=count, max_messages=count,
+                                                     visibility_timeout=int(visibility)):
+            body = json.loads(received.content)
+            blob_name = body["blob"] if set(body) == {"blob"} else None
+            if blob_name:
+                body = json.loads(self.blobs().download_blob(blob_name).readall())
+            messages.append(Message(received.id, (received.pop_receipt, blob_name), body, received.dequeue_count))
+        return messages
+
+    def _delete(self, message):
+        from azure.core.exceptions import ResourceNotFoundError
+        pop_receipt, blob_name = message.receipt
+        try:
+            self.client.delete_message(message.id, pop_receipt)
+        except ResourceNotFoundError:
+            # Already deleted, or redelivered to another consumer after our claim expired
+            return
+        if blob_name:
+            try:
+                self.blobs().delete_blob(blob_name)
+            except ResourceNotFoundError:
+                pass
+
+    def depth(self):
+        return self.client.get_queue_properties().approximate_message_count
+
+
+class WorkQueues:
+    """The queues of one backend by name, opened on first use; abort() stops every put and consume."""
+
+    def __init__(self, backend=WORK_QUEUE_BACKEND):
+        self.backend = backend
+        self.aborted = threading.Event()
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._sqlite = SqliteQueueFile() if backend == "sqlite" else None
+        self._blobs = None
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._queues:
+                # Nothing consumes a poison queue, so it must never block
+                poison = self._open(f"{name}-poison", None, max_depth=2 ** 62)
+                self._queues[name] = self._open(name, poison)
+            return self._queues[name]
+
+    def _open(self, name, poison, max_depth=WORK_QUEUE_MAX_DEPTH):
+        if self.backend == "storage":
+            from azure.storage.queue import QueueClient
+            from azure.core.exceptions import ResourceExistsError
+            client = QueueClient.from_connection_string(WORK_QUEUE_CONNECTION, f"{WORK_QUEUE_PREFIX}-{name}")
+            try:
+                client.create_queue()
+            except ResourceExistsError:
+                pass
+            return StorageWorkQueue(client, self._blob_container, name, self.aborted, max_depth=max_depth, poison=poison)
+        return SqliteWorkQueue(self._sqlite, name, self.aborted, max_depth=max_depth, poison=poison)
+
+    # Blob container for large messages, only created once one is needed
+    def _blob_container(self):
+        if self._blobs is None:
+            from azure.storage.blob import ContainerClient
+            from azure.core.exceptions import ResourceExistsError
+            blobs = ContainerClient.from_connection_string(WORK_QUEUE_CONNECTION, WORK_QUEUE_BLOB_CONTAINER)
+            try:
+                blobs.create_container()
+            except ResourceExistsError:
+                pass
+            self._blobs = blobs
+        return self._blobs
+
+    def abort(self):
+        self.aborted.set()
+
+    def reset(self):
+        """Clears the abort flag and the queue statistics for the next run."""
+        self.aborted.clear()
+        with self._lock:
+            for queue in self._queues.values():
+                queue.stats = QueueStats()
+
+    def summary(self):
+        with self._lock:
+            return {name: queue.stats.summary() for name, queue in sorted(self._queues.items())}
+
+
+# Function to open the configured work queues; returns None when stages are
+# chained in-process (WORK_QUEUE_BACKEND=none)
+def open_work_queues():
+    if WORK_QUEUE_BACKEND == "none":
+        return None
+    if WORK_QUEUE_BACKEND == "storage" and not WORK_QUEUE_CONNECTION:
+        logging.error("WORK_QUEUE_BACKEND=storage needs WORK_QUEUE_CONNECTION or AzureWebJobsStorage, "
+                      "chaining stages in-process instead")
+        return None
+    if WORK_QUEUE_BACKEND == "sqlite" and os.getenv("WEBSITE_INSTANCE_ID"):
+        logging.warning(f"WORK_QUEUE_BACKEND=sqlite on Azure: records queued in {WORK_QUEUE_PATH} are lost if the "
+                        f"instance is recycled before they are stored; use storage or a path under /home")
+    try:
+        return WorkQueues()
+    except sqlite3.Error as e:
+        logging.error(f"Could not open work queue at {WORK_QUEUE_PATH}, chaining stages in-process: {str(e)}")
+        return None